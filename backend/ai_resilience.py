@@ -0,0 +1,245 @@
+"""
+Resilience for upstream AI calls: deadlines, retries, a circuit breaker and
+hedged requests.
+
+- Every question gets one overall deadline (AI_DEADLINE_SECONDS); each
+  attempt is bounded by AI_REQUEST_TIMEOUT and whatever is left of it.
+- Timeouts, connection errors, 429s and 5xx responses are retried up to
+  AI_MAX_RETRIES times with full-jitter exponential backoff, so a burst of
+  failures doesn't come back as a synchronized burst of retries.
+- When at least AI_BREAKER_FAILURE_RATE of the last AI_BREAKER_WINDOW
+  attempts failed (judged once half the window is filled), the circuit
+  opens and calls fail immediately (callers serve the fallback answer) for
+  AI_BREAKER_COOLDOWN_SECONDS. Then a single probe is let through - other
+  calls keep getting the fallback meanwhile - and its success closes the
+  circuit, its failure opens it again. A failure rate rather than a run of
+  consecutive failures keeps concurrent calls under a merely flaky
+  upstream from tripping it.
+- With AI_HEDGE_ENABLED, an attempt still running after the p95 latency of
+  recent calls (at least AI_HEDGE_MIN_MS) gets a second identical request;
+  the first answer wins and the other is cancelled. This trims the slow
+  tail for roughly 5% extra upstream calls.
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import Counter, deque
+from typing import Awaitable, Callable, Optional
+
+import openai
+
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "30"))
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+AI_DEADLINE_SECONDS = float(os.getenv("AI_DEADLINE_SECONDS", "30"))
+AI_RETRY_BASE_MS = float(os.getenv("AI_RETRY_BASE_MS", "200"))
+AI_RETRY_MAX_MS = float(os.getenv("AI_RETRY_MAX_MS", "2000"))
+AI_BREAKER_WINDOW = int(os.getenv("AI_BREAKER_WINDOW", "50"))
+AI_BREAKER_FAILURE_RATE = float(os.getenv("AI_BREAKER_FAILURE_RATE", "0.6"))
+AI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("AI_BREAKER_COOLDOWN_SECONDS", "30"))
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "False").lower() == "true"
+AI_HEDGE_MIN_MS = float(os.getenv("AI_HEDGE_MIN_MS", "500"))
+
+# Latency samples kept for the hedging percentile, and how many are needed first
+_LATENCY_WINDOW = 200
+_MIN_LATENCY_SAMPLES = 20
+
+_RETRYABLE = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class CircuitOpenError(Exception):
+    """The upstream is considered unhealthy; the call was not attempted"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed attempt is worth repeating (and counts against the circuit)"""
+    if isinstance(error, _RETRYABLE):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker with a single half-open probe"""
+
+    def __init__(self, window: int = AI_BREAKER_WINDOW, failure_rate: float = AI_BREAKER_FAILURE_RATE,
+                 cooldown_seconds: float = AI_BREAKER_COOLDOWN_SECONDS, probe_timeout: float = AI_REQUEST_TIMEOUT):
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self.probe_timeout = probe_timeout
+        self.state = "closed"
+        self._outcomes = deque(maxlen=window)  # True for a failed attempt
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._counters = Counter()
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now"""
+        now = time.monotonic()
+        if self.state == "open" and now - self._opened_at >= self.cooldown_seconds:
+            self.state = "half_open"
+            self._probe_started = None
+        if self.state == "closed":
+            return True
+        # A probe that never reported back (e.g. its caller was cancelled) expires
+        if self.state == "half_open" and (self._probe_started is None
+                                          or now - self._probe_started > self.probe_timeout):
+            self._probe_started = now
+            return True
+        self._counters["short_circuited"] += 1
+        return False
+
+    def record_success(self):
+        if self.state == "closed":
+            self._outcomes.append(False)
+            return
+        if self.state == "half_open":
+            print("AI circuit closed: upstream recovered")
+            self.state = "closed"
+            self._outcomes.clear()
+            self._probe_started = None
+
+    def record_failure(self):
+        if self.state == "closed":
+            self._outcomes.append(True)
+            failed = sum(self._outcomes)
+            if len(self._outcomes) * 2 < self._outcomes.maxlen or failed < self.failure_rate * len(self._outcomes):
+                return
+            print(f"AI circuit open: {failed} of the last {len(self._outcomes)} attempts failed; "
+                  f"serving fallbacks for {self.cooldown_seconds:g}s")
+        elif self.state != "half_open":
+            # Late failures from calls that started before the circuit opened
+            return
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._counters["opened"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "recent_failure_rate": round(sum(self._outcomes) / len(self._outcomes), 3) if self._outcomes else 0.0,
+            "opened": self._counters["opened"],
+            "short_circuited": self._counters["short_circuited"],
+        }
+
+
+class ResilientUpstream:
+    """Runs upstream calls under a deadline with retries, circuit breaking and hedging"""
+
+    def __init__(self, request_timeout: float = AI_REQUEST_TIMEOUT, max_retries: int = AI_MAX_RETRIES,
+                 deadline: float = AI_DEADLINE_SECONDS, hedge_enabled: bool = AI_HEDGE_ENABLED,
+                 hedge_min_ms: float = AI_HEDGE_MIN_MS, breaker: Optional[CircuitBreaker] = None):
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min = hedge_min_ms / 1000
+        self.breaker = breaker or CircuitBreaker()
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+        self._hedge_delay: Optional[float] = None
+        self._counters = Counter()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which an attempt is hedged, or None if hedging is off"""
+        if not self.hedge_enabled or len(self._latencies) < _MIN_LATENCY_SAMPLES:
+            return None
+        if self._hedge_delay is None:
+            # Recomputed lazily; _record_latency clears it every few samples
+            ordered = sorted(self._latencies)
+            self._hedge_delay = max(ordered[int(len(ordered) * 0.95) - 1], self.hedge_min)
+        return self._hedge_delay
+
+    def _record_latency(self, seconds: float):
+        self._latencies.append(seconds)
+        if len(self._latencies) % 10 == 0:
+            self._hedge_delay = None
+
+    async def call(self, make_request: Callable[[], Awaitable], hedge: bool = True):
+        """Return make_request()'s result, retrying and hedging as configured.
+
+        Raises CircuitOpenError without calling upstream when the circuit is
+        open, or the last error once retries or the deadline run out.
+        """
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("AI upstream circuit is open")
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("AI deadline exceeded")
+
+            self._counters["attempts"] += 1
+            try:
+                result = await self._attempt(make_request, min(self.request_timeout, remaining), hedge)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.breaker.record_failure()
+                self._counters["failed_attempts"] += 1
+                # Full jitter: anywhere between no wait and the exponential cap
+                backoff = random.uniform(0, min(AI_RETRY_MAX_MS, AI_RETRY_BASE_MS * 2 ** attempt) / 1000)
+                if attempt >= self.max_retries or time.monotonic() + backoff >= deadline_at:
+                    raise
+                self._counters["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(backoff)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    async def _attempt(self, make_request: Callable[[], Awaitable], timeout: float, hedge: bool):
+        started = time.monotonic()
+        hedge_after = self.hedge_delay() if hedge else None
+        if hedge_after is None or hedge_after >= timeout:
+            result = await asyncio.wait_for(make_request(), timeout)
+            self._record_latency(time.monotonic() - started)
+            return result
+
+        primary = asyncio.ensure_future(make_request())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                self._counters["hedged"] += 1
+                tasks.add(asyncio.ensure_future(make_request()))
+
+            error: Optional[BaseException] = None
+            while tasks:
+                remaining = timeout - (time.monotonic() - started)
+                done, _ = await asyncio.wait(tasks, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError("AI request timed out")
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._counters["hedge_wins"] += 1
+                        self._record_latency(time.monotonic() - started)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing (or timed-out) request is abandoned
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        """Attempt, retry and hedge counters plus circuit state"""
+        return {
+            "attempts": self._counters["attempts"],
+            "failed_attempts": self._counters["failed_attempts"],
+            "retries": self._counters["retries"],
+            "hedged": self._counters["hedged"],
+            "hedge_wins": self._counters["hedge_wins"],
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1) if self.hedge_delay() else None,
+            "circuit": self.breaker.stats(),
+        }
@@ -1,14 +1,73 @@
-import openai
 import os
-from typing import Optional
-import base64
-import json
+from typing import AsyncIterator, NamedTuple, Optional
+import asyncio
 import re
-
-# Set up OpenAI client - Updated for new OpenAI library
-from openai import OpenAI
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import time
+from functools import lru_cache
+
+from ai_resilience import AI_REQUEST_TIMEOUT, CircuitOpenError, ResilientUpstream, is_retryable
+from answer_bank import ANSWER_BANK_ENABLED, answer_bank
+from answer_cache import ANSWER_CACHE_ENABLED, answer_cache, cache_key
+from image_fingerprint import IMAGE_CACHE_ENABLED, image_cache
+from image_text import ExtractedText, image_text_stats, quote_text, text_question, vision_reason
+from knowledge_base import KNOWLEDGE_BASE_ENABLED, open_knowledge_base, training_documents
+from metrics import stage
+from model_router import AI_COMPLEX_BASE_URL, AI_COMPLEX_MODEL, AI_MODEL, ModelBackend, ModelRouter
+from prompt_builder import PromptBuilder, count_tokens
+from singleflight import SingleFlight
+
+# Set up OpenAI client - async so upstream calls don't block the event loop
+from openai import AsyncOpenAI
+
+# Upstream call limits (override via environment)
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "32"))
+
+# Retries are handled by ai_upstream (jittered, within one deadline), not the SDK
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    timeout=AI_REQUEST_TIMEOUT,
+    max_retries=0,
+)
+
+# Caps the number of in-flight upstream requests per worker
+ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+
+# Deadlines, retries, circuit breaker and hedging for upstream calls
+ai_upstream = ResilientUpstream()
+
+# Complex questions can go to another model, or another OpenAI-compatible server
+# with its own client and circuit breaker
+if AI_COMPLEX_BASE_URL:
+    complex_backend = ModelBackend(
+        AI_COMPLEX_MODEL,
+        AsyncOpenAI(
+            api_key=os.getenv("AI_COMPLEX_API_KEY") or os.getenv("OPENAI_API_KEY"),
+            base_url=AI_COMPLEX_BASE_URL,
+            timeout=AI_REQUEST_TIMEOUT,
+            max_retries=0,
+        ),
+        ResilientUpstream(),
+    )
+else:
+    complex_backend = ModelBackend(AI_COMPLEX_MODEL, client, ai_upstream)
+
+# Simple arithmetic and equations are solved locally; the rest picks a backend
+model_router = ModelRouter(ModelBackend(AI_MODEL, client, ai_upstream), complex_backend)
+
+class AIAnswer(NamedTuple):
+    """An answer (or streamed chunk); fallback answers are canned text and aren't charged"""
+    text: str
+    fallback: bool = False
+
+# Identical questions asked at the same time share one upstream call
+ai_singleflight = SingleFlight()
+
+# Per-stage latency histograms (see metrics.py)
+_subject_stage = stage("subject_detection")
+_routing_stage = stage("model_routing")
+_upstream_stage = stage("ai_upstream")
+_first_token_stage = stage("ai_first_token")
 
 # Comprehensive training data for each subject
 SUBJECT_TRAINING_DATA = {
@@ -280,130 +339,330 @@ It's how plants make their own food using sunlight, water, and air!
     }
 }
 
+# Extra guidance appended to each subject's system prompt
+SUBJECT_CONTEXT = {
+    "math": "Focus on step-by-step mathematical problem solving with clear calculations.",
+    "science": "Emphasize scientific understanding, experiments, and real-world applications.",
+    "english": "Help with language, grammar, writing, and reading comprehension.",
+    "history": "Provide historical context, timelines, and engaging storytelling.",
+    "geography": "Explain geographical concepts with visual descriptions and real-world examples."
+}
+
+# System messages (and few-shot examples) are formatted and measured once, here
+prompt_builder = PromptBuilder(
+    SUBJECT_TRAINING_DATA,
+    SUBJECT_CONTEXT,
+    default_subject="math",
+    default_context="Provide educational support appropriate for the student's level."
+)
+
+# Worked examples answered locally, and shown when the AI service is unavailable (see knowledge_base.py)
+knowledge_base = open_knowledge_base(training_documents(SUBJECT_TRAINING_DATA))
+
+# Keywords used to detect the subject of a question
+SUBJECT_KEYWORDS = {
+    "math": [
+        # Basic operations
+        "add", "subtract", "multiply", "divide", "plus", "minus", "times",
+        # Numbers and types
+        "number", "calculate", "solve", "equation", "formula", "fraction",
+        "decimal", "percentage", "ratio", "proportion", "average", "mean",
+        # Advanced topics
+        "algebra", "geometry", "trigonometry", "calculus", "statistics",
+        "probability", "graph", "function", "derivative", "integral",
+        # Specific terms
+        "x =", "solve for", "find x", "area", "volume", "perimeter",
+        "angle", "triangle", "circle", "square", "rectangle", "polygon"
+    ],
+
+    "science": [
+        # General science
+        "science", "experiment", "hypothesis", "theory", "observation",
+        # Biology
+        "biology", "cell", "organism", "DNA", "gene", "evolution",
+        "photosynthesis", "respiration", "ecosystem", "species", "habitat",
+        "plant", "animal", "human body", "digestive", "circulatory",
+        # Chemistry
+        "chemistry", "atom", "molecule", "element", "compound", "reaction",
+        "acid", "base", "pH", "chemical", "bond", "periodic table",
+        # Physics
+        "physics", "force", "energy", "motion", "gravity", "magnetism",
+        "electricity", "light", "sound", "heat", "wave", "matter"
+    ],
+
+    "english": [
+        # Language arts
+        "english", "grammar", "sentence", "paragraph", "essay", "write",
+        "writing", "composition", "literature", "poem", "poetry", "story",
+        # Grammar specifics
+        "verb", "noun", "adjective", "adverb", "pronoun", "preposition",
+        "subject", "predicate", "clause", "phrase", "tense", "punctuation",
+        # Reading and comprehension
+        "read", "comprehension", "meaning", "theme", "character", "plot",
+        "metaphor", "simile", "alliteration", "rhyme", "spelling"
+    ],
+
+    "history": [
+        "history", "historical", "past", "ancient", "medieval", "modern",
+        "war", "battle", "revolution", "empire", "civilization", "culture",
+        "timeline", "century", "decade", "era", "period", "dynasty",
+        "king", "queen", "president", "leader", "democracy", "government",
+        "world war", "independence", "colonialism", "apartheid", "mandela"
+    ],
+
+    "geography": [
+        "geography", "map", "continent", "country", "city", "capital",
+        "mountain", "river", "ocean", "sea", "desert", "forest", "climate",
+        "weather", "temperature", "rainfall", "latitude", "longitude",
+        "population", "culture", "economy", "natural resources", "environment",
+        "earthquake", "volcano", "plate tectonics", "erosion", "pollution"
+    ]
+}
+
+# Questions and keywords are split into words and standalone symbols ("x =" -> x, =)
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Words formed by adding these endings to a keyword still count as a match
+_STEM_PATTERN = re.compile(r"(\w{2,})(?:ing|ed|s)(?= )")
+
+def _compile_subject_classifier(subject_keywords: dict):
+    """Split keywords into a single-word set and a short list of padded phrases"""
+    keyword_subjects = {}
+    for subject, keywords in subject_keywords.items():
+        for keyword in keywords:
+            normalized = " ".join(_WORD_PATTERN.findall(keyword.lower()))
+            keyword_subjects.setdefault(normalized, set()).add(subject)
+    single_words = frozenset(k for k in keyword_subjects if " " not in k)
+    phrases = tuple(f" {k} " for k in keyword_subjects if " " in k)
+    return keyword_subjects, single_words, phrases
+
+_KEYWORD_SUBJECTS, _SINGLE_WORD_KEYWORDS, _PHRASE_KEYWORDS = _compile_subject_classifier(SUBJECT_KEYWORDS)
+
+@lru_cache(maxsize=4096)
 def detect_subject_advanced(question: str) -> Optional[str]:
-    """Advanced subject detection with better keyword matching"""
-    question_lower = question.lower()
-    
-    # Enhanced keyword detection
-    subject_keywords = {
-        "math": [
-            # Basic operations
-            "add", "subtract", "multiply", "divide", "plus", "minus", "times",
-            # Numbers and types
-            "number", "calculate", "solve", "equation", "formula", "fraction",
-            "decimal", "percentage", "ratio", "proportion", "average", "mean",
-            # Advanced topics
-            "algebra", "geometry", "trigonometry", "calculus", "statistics",
-            "probability", "graph", "function", "derivative", "integral",
-            # Specific terms
-            "x =", "solve for", "find x", "area", "volume", "perimeter",
-            "angle", "triangle", "circle", "square", "rectangle", "polygon"
-        ],
-        
-        "science": [
-            # General science
-            "science", "experiment", "hypothesis", "theory", "observation",
-            # Biology
-            "biology", "cell", "organism", "DNA", "gene", "evolution",
-            "photosynthesis", "respiration", "ecosystem", "species", "habitat",
-            "plant", "animal", "human body", "digestive", "circulatory",
-            # Chemistry
-            "chemistry", "atom", "molecule", "element", "compound", "reaction",
-            "acid", "base", "pH", "chemical", "bond", "periodic table",
-            # Physics
-            "physics", "force", "energy", "motion", "gravity", "magnetism",
-            "electricity", "light", "sound", "heat", "wave", "matter"
-        ],
-        
-        "english": [
-            # Language arts
-            "english", "grammar", "sentence", "paragraph", "essay", "write",
-            "writing", "composition", "literature", "poem", "poetry", "story",
-            # Grammar specifics
-            "verb", "noun", "adjective", "adverb", "pronoun", "preposition",
-            "subject", "predicate", "clause", "phrase", "tense", "punctuation",
-            # Reading and comprehension
-            "read", "comprehension", "meaning", "theme", "character", "plot",
-            "metaphor", "simile", "alliteration", "rhyme", "spelling"
-        ],
-        
-        "history": [
-            "history", "historical", "past", "ancient", "medieval", "modern",
-            "war", "battle", "revolution", "empire", "civilization", "culture",
-            "timeline", "century", "decade", "era", "period", "dynasty",
-            "king", "queen", "president", "leader", "democracy", "government",
-            "world war", "independence", "colonialism", "apartheid", "mandela"
-        ],
-        
-        "geography": [
-            "geography", "map", "continent", "country", "city", "capital",
-            "mountain", "river", "ocean", "sea", "desert", "forest", "climate",
-            "weather", "temperature", "rainfall", "latitude", "longitude",
-            "population", "culture", "economy", "natural resources", "environment",
-            "earthquake", "volcano", "plate tectonics", "erosion", "pollution"
-        ]
-    }
+    """Advanced subject detection with better keyword matching.
     
-    # Count keyword matches for each subject
-    subject_scores = {}
-    for subject, keywords in subject_keywords.items():
-        score = sum(1 for keyword in keywords if keyword in question_lower)
-        if score > 0:
-            subject_scores[subject] = score
+    Keywords match whole words only (so "add" no longer matches "address"),
+    every subject is scored in one pass over the question, and results are
+    memoized so repeated calls for one request are free.
+    """
+    words = _WORD_PATTERN.findall(question.lower())
+    text = f" {' '.join(words)} "
     
-    # Return subject with highest score
-    if subject_scores:
-        return max(subject_scores, key=subject_scores.get)
+    # Single-word keywords: one set intersection over the words and their stems
+    candidates = set(words)
+    candidates.update(_STEM_PATTERN.findall(text))
+    matched = list(candidates & _SINGLE_WORD_KEYWORDS)
+    
+    # Multi-word keywords ("world war", "x =") are matched on word boundaries
+    matched.extend(phrase[1:-1] for phrase in _PHRASE_KEYWORDS if phrase in text)
+    
+    # Count distinct keyword matches for each subject
+    subject_scores = dict.fromkeys(SUBJECT_KEYWORDS, 0)
+    for keyword in matched:
+        for subject in _KEYWORD_SUBJECTS[keyword]:
+            subject_scores[subject] += 1
+    
+    # Return subject with highest score (ties go to the first subject listed)
+    best = max(subject_scores, key=subject_scores.get)
+    if subject_scores[best] > 0:
+        return best
     
     return None
 
-async def process_homework_question(question: str, subject: Optional[str] = None) -> str:
-    """Process homework question with enhanced OpenAI integration"""
+def detect_subject(question: str) -> Optional[str]:
+    """detect_subject_advanced, timed as the subject_detection stage"""
+    with _subject_stage.time():
+        return detect_subject_advanced(question)
+
+async def process_homework_question(question: str, subject: Optional[str] = None, context=None) -> AIAnswer:
+    """Process homework question with enhanced OpenAI integration.
+    
+    context (a conversation.ConversationContext) is sent along for follow-up
+    questions; such answers depend on the conversation, so they bypass the
+    answer cache and request coalescing. If the upstream fails or its circuit
+    is open, the subject's fallback text is returned with fallback=True.
+    """
+    
+    # Precomputed curriculum answers (see answer_bank.py) come before anything else
+    if ANSWER_BANK_ENABLED and context is None:
+        banked = answer_bank.get(question)
+        if banked is not None:
+            return AIAnswer(banked)
     
     # Auto-detect subject if not provided
     if not subject:
-        subject = detect_subject_advanced(question)
-    
-    # Get appropriate training data
-    training_data = SUBJECT_TRAINING_DATA.get(subject, SUBJECT_TRAINING_DATA["math"])
-    system_prompt = training_data["system_prompt"]
-    
-    # Add specific subject context based on detected/provided subject
-    subject_context = {
-        "math": "Focus on step-by-step mathematical problem solving with clear calculations.",
-        "science": "Emphasize scientific understanding, experiments, and real-world applications.",
-        "english": "Help with language, grammar, writing, and reading comprehension.",
-        "history": "Provide historical context, timelines, and engaging storytelling.",
-        "geography": "Explain geographical concepts with visual descriptions and real-world examples."
-    }
+        subject = detect_subject(question)
     
-    context = subject_context.get(subject, "Provide educational support appropriate for the student's level.")
+    started = time.perf_counter()
+    route = model_router.route(question, subject)
+    _routing_stage.observe(time.perf_counter() - started)
+    if route.solution is not None:
+        model_router.record(route, time.perf_counter() - started)
+        return AIAnswer(route.solution.text)
     
-    try:
-        # Use the new OpenAI client
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": f"{system_prompt}\n\nAdditional context: {context}\n\nAlways format your response with clear sections, emojis, and practical examples. Include specific steps and encourage further learning."
-                },
-                {"role": "user", "content": question}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
+    # Cached answers skip the upstream call entirely
+    if ANSWER_CACHE_ENABLED and context is None:
+        cached = answer_cache.get(question, subject)
+        if cached is not None:
+            return AIAnswer(cached)
+    
+    # Near-identical worked examples are answered from the local knowledge base
+    if KNOWLEDGE_BASE_ENABLED and context is None:
+        stored = knowledge_base.answer(question, subject)
+        if stored is not None:
+            return AIAnswer(stored)
+    
+    async def ask_upstream() -> AIAnswer:
+        prompt = prompt_builder.build(question, subject, context)
+        backend = route.backend
         
-        return response.choices[0].message.content
+        async def request():
+            # Each attempt (and each hedge) holds its own concurrency slot
+            async with ai_semaphore:
+                return await backend.client.chat.completions.create(
+                    model=backend.model,
+                    messages=prompt.messages,
+                    max_tokens=prompt.max_tokens,
+                    temperature=0.7
+                )
+        
+        called = time.perf_counter()
+        try:
+            response = await backend.upstream.call(request)
+        finally:
+            latency = time.perf_counter() - called
+            _upstream_stage.observe(latency)
+        prompt_builder.record_completion(prompt, latency, response.usage, response.choices[0].finish_reason)
+        usage = response.usage
+        model_router.record(route, latency, usage.prompt_tokens if usage else prompt.input_tokens,
+                            usage.completion_tokens if usage else 0)
+        answer = response.choices[0].message.content
+        if ANSWER_CACHE_ENABLED and answer and context is None:
+            answer_cache.put(question, subject, answer)
+        return AIAnswer(answer)
+    
+    try:
+        if context is not None:
+            return await ask_upstream()
+        return await ai_singleflight.do(cache_key(question, subject), ask_upstream)
         
+    except CircuitOpenError:
+        model_router.record(route, time.perf_counter() - started, fallback=True)
+        return AIAnswer(generate_fallback_response(question, subject), fallback=True)
     except Exception as e:
         print(f"OpenAI API Error: {e}")
+        model_router.record(route, time.perf_counter() - started, fallback=True)
         # Enhanced fallback response based on subject
-        return generate_fallback_response(question, subject)
+        return AIAnswer(generate_fallback_response(question, subject), fallback=True)
+
+async def stream_homework_question(question: str, subject: Optional[str] = None,
+                                   context=None) -> AsyncIterator[AIAnswer]:
+    """Stream the answer to a homework question chunk by chunk as it is generated.
+    
+    Opening the stream is retried like any other call; once tokens have been
+    sent a failure is raised to the caller. A fallback arrives as a single
+    chunk with fallback=True.
+    """
+    
+    if ANSWER_BANK_ENABLED and context is None:
+        banked = answer_bank.get(question)
+        if banked is not None:
+            yield AIAnswer(banked)
+            return
+    
+    # Auto-detect subject if not provided
+    if not subject:
+        subject = detect_subject(question)
+    
+    started = time.perf_counter()
+    route = model_router.route(question, subject)
+    _routing_stage.observe(time.perf_counter() - started)
+    if route.solution is not None:
+        model_router.record(route, time.perf_counter() - started)
+        yield AIAnswer(route.solution.text)
+        return
+    
+    if ANSWER_CACHE_ENABLED and context is None:
+        cached = answer_cache.get(question, subject)
+        if cached is not None:
+            yield AIAnswer(cached)
+            return
+    
+    if KNOWLEDGE_BASE_ENABLED and context is None:
+        stored = knowledge_base.answer(question, subject)
+        if stored is not None:
+            yield AIAnswer(stored)
+            return
+    
+    prompt = prompt_builder.build(question, subject, context)
+    backend = route.backend
+    
+    def open_stream():
+        return backend.client.chat.completions.create(
+            model=backend.model,
+            messages=prompt.messages,
+            max_tokens=prompt.max_tokens,
+            temperature=0.7,
+            stream=True
+        )
+    
+    started = time.perf_counter()
+    finish_reason = None
+    received_any = False
+    chunks = []
+    try:
+        async with ai_semaphore:
+            # Not hedged: a duplicate stream would hold a second slot for the whole answer
+            stream = await backend.upstream.call(open_stream, hedge=False)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not received_any:
+                        _first_token_stage.observe(time.perf_counter() - started)
+                    received_any = True
+                    chunks.append(delta)
+                    yield AIAnswer(delta)
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+    
+    except Exception as e:
+        if not isinstance(e, CircuitOpenError):
+            if received_any and is_retryable(e):
+                # Broke mid-answer: count it against the circuit
+                backend.upstream.breaker.record_failure()
+            print(f"OpenAI streaming error: {e}")
+        # A stream that already sent tokens can't be swapped for a fallback
+        if received_any:
+            raise
+        model_router.record(route, time.perf_counter() - started, fallback=True)
+        yield AIAnswer(generate_fallback_response(question, subject), fallback=True)
+        return
+    
+    # Streams carry no usage counts, only why they ended: cost is estimated from our own counts
+    latency = time.perf_counter() - started
+    _upstream_stage.observe(latency)
+    prompt_builder.record_completion(prompt, latency, finish_reason=finish_reason)
+    model_router.record(route, latency, prompt.input_tokens, count_tokens("".join(chunks)))
+    
+    # Only complete answers are cached
+    if ANSWER_CACHE_ENABLED and chunks and context is None:
+        answer_cache.put(question, subject, "".join(chunks))
 
 def generate_fallback_response(question: str, subject: Optional[str]) -> str:
     """Generate comprehensive fallback responses when OpenAI is unavailable"""
     
+    # A worked example of a similar question helps more than general tips
+    example = knowledge_base.example(question) if KNOWLEDGE_BASE_ENABLED else None
+    if example is not None:
+        return f"""🤖 I can't reach my tutor brain right now, but here's a worked example of a similar question from my notes:
+
+**❓ {example.document.question}**
+
+{example.document.answer}
+
+**🌟 I'll be back soon to help with your exact question: "{question}" 💪**"""
+    
     subject_fallbacks = {
         "math": f"""🔢 I'm having trouble connecting to my math brain right now, but let me help you with: "{question}"
 
@@ -463,7 +722,45 @@ def generate_fallback_response(question: str, subject: Optional[str]) -> str:
 
 **👨‍👩‍👧‍👦 Parent Tip:** Make reading fun! Use different voices for characters and ask your child what they think will happen next.
 
-**🌟 I'll return with detailed grammar and writing help soon! Keep reading and writing! 📝**"""
+**🌟 I'll return with detailed grammar and writing help soon! Keep reading and writing! 📝**""",
+
+        "history": f"""📜 My history books are being dusted off, but I still want to help with: "{question}"
+
+**🕰️ History Detective Steps:**
+
+1️⃣ **When?** Find the date or time period - draw a quick timeline
+2️⃣ **Who?** List the people and groups involved
+3️⃣ **What happened?** Put the main events in order
+4️⃣ **Why?** Look for causes - what led to each event?
+5️⃣ **So what?** How did it change people's lives, then and now?
+
+**🏛️ History Around You:**
+- Ask grandparents about life when they were young
+- Visit a museum, monument or heritage site
+- Look up the history of your street or town name
+
+**👨‍👩‍👧‍👦 Parent Tip:** Stories make history stick - retell events as a story with heroes, problems and turning points!
+
+**🌟 I'll be back with the full story soon! Keep asking questions! 🔍**""",
+
+        "geography": f"""🗺️ My maps are being redrawn, but I still want to help with: "{question}"
+
+**🌍 Geography Explorer Steps:**
+
+1️⃣ **Where?** Find the place on a map or globe
+2️⃣ **What is it like?** Climate, landforms, rivers and plants
+3️⃣ **Who lives there?** People, cities and how they use the land
+4️⃣ **How are things connected?** Weather, water, trade and travel
+5️⃣ **What's changing?** Think about the environment and people's impact
+
+**🧭 Geography At Home:**
+- Use a phone map to find your home, school and nearest river
+- Track the weather for a week and spot patterns
+- Look at where the food in your kitchen comes from
+
+**👨‍👩‍👧‍👦 Parent Tip:** Plan a pretend trip together - choose a country and find its capital, weather and famous places!
+
+**🌟 I'll be back with detailed answers soon! Keep exploring! 🌎**"""
     }
     
     return subject_fallbacks.get(subject, f"""🤖 I'm temporarily offline but want to help with: "{question}"
@@ -479,8 +776,47 @@ def generate_fallback_response(question: str, subject: Optional[str]) -> str:
 
 **🌟 I'll be back soon with personalized help! You're doing great! 💪✨**""")
 
-async def analyze_homework_image(image_base64: str, additional_question: Optional[str] = None) -> str:
-    """Analyze homework image with enhanced processing"""
+async def analyze_homework_image(image_base64: str, additional_question: Optional[str] = None,
+                                 fingerprint: Optional[bytes] = None,
+                                 extracted: Optional[ExtractedText] = None) -> AIAnswer:
+    """Analyze homework image with enhanced processing.
+    
+    An image whose OCR text reads with confidence is answered as a text
+    question; the rest take the image-analysis (vision) path. With the
+    image's fingerprint, a near-duplicate of a recent upload with the same
+    question and the same text reuses its analysis (see image_fingerprint.py).
+    """
+    reason = vision_reason(extracted)
+    image_text_stats.record(reason or "text", extracted)
+    if reason is None:
+        analyze = lambda: _answer_from_text(extracted, additional_question)
+    else:
+        analyze = lambda: _analyze_image(image_base64, additional_question)
+    
+    if not (IMAGE_CACHE_ENABLED and fingerprint):
+        return await analyze()
+    
+    # Pages of one template can fingerprint alike, so reuse also needs the same text read from the page
+    text = extracted.text if extracted else None
+    cached = image_cache.get(fingerprint, additional_question, text)
+    if cached is not None:
+        return AIAnswer(cached)
+    return AIAnswer(*await image_cache.share(fingerprint, additional_question, analyze, text))
+
+async def _answer_from_text(extracted: ExtractedText, additional_question: Optional[str]) -> AIAnswer:
+    """Answer an image from its OCR text through the text pipeline"""
+    question = text_question(extracted, additional_question)
+    subject = detect_subject("\n".join(filter(None, [additional_question, extracted.text])))
+    answer = await process_homework_question(question, subject)
+    response = f"""📸 Here's what I read in your photo:
+
+{quote_text(extracted)}
+
+{answer.text}"""
+    return AIAnswer(response, answer.fallback)
+
+async def _analyze_image(image_base64: str, additional_question: Optional[str]) -> AIAnswer:
+    """Analysis of an image; a fallback if its question couldn't be answered"""
     
     try:
         # For demo purposes, provide comprehensive image analysis response
@@ -488,7 +824,7 @@ async def analyze_homework_image(image_base64: str, additional_question: Optiona
         
         detected_subject = None
         if additional_question:
-            detected_subject = detect_subject_advanced(additional_question)
+            detected_subject = detect_subject(additional_question)
         
         subject_specific_guidance = {
             "math": """
@@ -554,13 +890,16 @@ async def analyze_homework_image(image_base64: str, additional_question: Optiona
 
 **🌟 Success Strategy:** If any step seems confusing, break it down even further. Every expert started as a beginner!"""
 
+        fallback = False
         if additional_question:
+            answer = await process_homework_question(additional_question, detected_subject)
+            fallback = answer.fallback
             response += f"""
 
 **💬 About your additional question:** "{additional_question}"
 This gives me helpful context about what specific part you're working on! Let me address this directly:
 
-{await process_homework_question(additional_question, detected_subject)}"""
+{answer.text}"""
         
         response += """
 
@@ -572,11 +911,11 @@ This gives me helpful context about what specific part you're working on! Let me
 
 **✨ I'm here to help you succeed! If you need me to explain any specific part in more detail, just ask! 🚀**"""
         
-        return response
+        return AIAnswer(response, fallback)
         
     except Exception as e:
         print(f"Image analysis error: {e}")
-        return """🤖 I'm having trouble analyzing your image right now, but I still want to help!
+        return AIAnswer("""🤖 I'm having trouble analyzing your image right now, but I still want to help!
 
 **📸 Image Upload Tips:**
 - Make sure the photo is clear and well-lit
@@ -589,4 +928,4 @@ You can also type out your homework question in the chat, and I'll give you a de
 
 **💡 Quick Study Tip:** While waiting, read through the question carefully and identify what type of problem it is (math, science, English, etc.)
 
-**🌟 Please try uploading again or type your question - I'm excited to help you learn! 💪✨"""
+**🌟 Please try uploading again or type your question - I'm excited to help you learn! 💪✨""", fallback=True)
@@ -0,0 +1,54 @@
+"""Alembic environment: migrations run against the app's own engine and models"""
+
+from logging.config import fileConfig
+
+from alembic import context
+
+from chat_search import SEARCH_COLUMN, SEARCH_TABLE
+from database import DATABASE_URL, engine
+from models import Base
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Leave the chat search index (created outside the models) out of autogenerate"""
+    if type_ == "table" and name.startswith(SEARCH_TABLE):
+        return False
+    return not (type_ == "column" and name == SEARCH_COLUMN)
+
+
+def run_migrations_offline():
+    """Emit SQL to stdout instead of running it (alembic upgrade --sql)"""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=DATABASE_URL.startswith("sqlite"),
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=connection.dialect.name == "sqlite",
+            include_object=include_object,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
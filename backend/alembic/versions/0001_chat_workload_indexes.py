@@ -0,0 +1,47 @@
+"""Composite indexes for chat history and credit transaction lookups
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-06-01 00:00:00
+
+Databases created by init_db() after this change already have these
+indexes, so each one is only created if it is missing.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_chat_messages_user_id_created_at", "chat_messages", ["user_id", "created_at"]),
+    ("ix_credits_user_id_created_at", "credits", ["user_id", "created_at"]),
+]
+
+
+def _existing_indexes(table: str):
+    """Index names on the table, or None if the table doesn't exist yet"""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return None
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        existing = _existing_indexes(table)
+        # A missing table gets its indexes from init_db() when it is created
+        if existing is not None and name not in existing:
+            op.create_index(name, table, columns)
+    if op.get_bind().dialect.name == "sqlite":
+        # Refresh planner statistics so the new indexes are picked up straight away
+        op.execute("ANALYZE")
+
+
+def downgrade():
+    for name, table, _ in INDEXES:
+        if name in (_existing_indexes(table) or ()):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,46 @@
+"""Extend the chat history index with id for keyset pagination
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-06-08 00:00:00
+
+History pages are ordered by (created_at, id); with id in the index the
+cursor condition and the tie-break are both answered from the index.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+OLD_INDEX = ("ix_chat_messages_user_id_created_at", ["user_id", "created_at"])
+NEW_INDEX = ("ix_chat_messages_user_id_created_at_id", ["user_id", "created_at", "id"])
+
+
+def _existing_indexes():
+    """Index names on chat_messages, or None if the table doesn't exist yet"""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("chat_messages"):
+        return None
+    return {index["name"] for index in inspector.get_indexes("chat_messages")}
+
+
+def _swap(drop, create):
+    existing = _existing_indexes()
+    if existing is None:
+        return
+    if create[0] not in existing:
+        op.create_index(create[0], "chat_messages", create[1])
+    if drop[0] in existing:
+        op.drop_index(drop[0], table_name="chat_messages")
+
+
+def upgrade():
+    _swap(OLD_INDEX, NEW_INDEX)
+
+
+def downgrade():
+    _swap(NEW_INDEX, OLD_INDEX)
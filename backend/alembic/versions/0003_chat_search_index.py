@@ -0,0 +1,31 @@
+"""Full-text search index over chat messages
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-06-15 00:00:00
+
+SQLite gets an FTS5 table kept in sync by triggers, PostgreSQL a generated
+tsvector column with a GIN index (see chat_search.py). Existing messages
+are indexed here, which takes a while on a large table; init_db() does the
+same on startup for databases that haven't been migrated.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+from chat_search import create_search_index, drop_search_index
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A missing table gets its index from init_db() when it is created
+    if sa.inspect(op.get_bind()).has_table("chat_messages"):
+        create_search_index(op.get_bind())
+
+
+def downgrade():
+    drop_search_index(op.get_bind())
@@ -0,0 +1,164 @@
+"""
+Precomputed answers for predictable (curriculum) questions.
+
+warm_answer_bank.py answers a curriculum question list ahead of time
+through process_homework_question and stores the answers here; chat
+questions are looked up before anything else. Questions match on their
+normalized text (answer_cache.normalize_question), one answer per question
+whatever the subject.
+
+The bank is a SQLite file with one row per question, keyed by a 64-bit
+hash of the normalized question as the integer primary key (the table's
+own B-tree), with the answer zlib-compressed. A lookup is one key probe
+plus decompression, a few microseconds, and nothing is held in memory. The
+API opens the file read-only and sees rows a running warm-up job commits.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from collections import Counter
+from typing import Optional, Set, Tuple
+
+from answer_cache import normalize_question
+from metrics import stage
+
+# Answer bank configuration (override via environment)
+ANSWER_BANK_ENABLED = os.getenv("ANSWER_BANK_ENABLED", "True").lower() == "true"
+ANSWER_BANK_PATH = os.getenv("ANSWER_BANK_PATH", "answer_bank.db")
+
+# How long a missing bank file is remembered before trying to open it again
+_REOPEN_SECONDS = 30
+# How long the entry count in stats() is reused
+_COUNT_SECONDS = 60
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS answers ("
+    "id INTEGER PRIMARY KEY, normalized TEXT NOT NULL, question TEXT NOT NULL, "
+    "subject TEXT, answer BLOB NOT NULL, created_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value REAL NOT NULL)",
+)
+
+
+def question_id(question: str) -> Tuple[int, str]:
+    """Bank key of a question (a signed 64-bit hash of its normalized text) and the normalized text"""
+    normalized = normalize_question(question)
+    digest = hashlib.blake2b(normalized.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True), normalized
+
+
+class AnswerBank:
+    """Read-only lookups in the answer bank file"""
+
+    def __init__(self, path: str = ANSWER_BANK_PATH):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._retry_at = 0.0
+        self._entries = (0.0, 0)  # (counted at, entries)
+        self._counters = Counter()
+        self._lookup_stage = stage("answer_bank_lookup")
+
+    def _open(self) -> Optional[sqlite3.Connection]:
+        if self._connection is not None or not self.path:
+            return self._connection
+        now = time.monotonic()
+        if now < self._retry_at:
+            return None
+        try:
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            connection.execute("SELECT 1 FROM answers LIMIT 1")
+            self._connection = connection
+        except sqlite3.Error:
+            # No bank built yet (or not readable): check again later
+            self._retry_at = now + _REOPEN_SECONDS
+        return self._connection
+
+    def get(self, question: str) -> Optional[str]:
+        """The banked answer to a question, or None"""
+        connection = self._open()
+        if connection is None:
+            return None
+        with self._lookup_stage.time():
+            key, normalized = question_id(question)
+            try:
+                row = connection.execute("SELECT normalized, answer FROM answers WHERE id = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"Answer bank error: {e}")
+                return None
+            # The normalized text rules out hash collisions
+            if row is None or row[0] != normalized:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            return zlib.decompress(row[1]).decode()
+
+    def stats(self) -> dict:
+        """Entries, hit/miss counters and what the warm-up jobs spent"""
+        connection = self._open()
+        totals = {}
+        if connection is not None:
+            counted_at, entries = self._entries
+            if time.monotonic() - counted_at > _COUNT_SECONDS:
+                self._entries = (time.monotonic(), connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0])
+            totals = dict(connection.execute("SELECT name, value FROM totals").fetchall())
+        lookups = self._counters["hits"] + self._counters["misses"]
+        return {
+            "enabled": ANSWER_BANK_ENABLED,
+            "path": self.path,
+            "available": connection is not None,
+            "entries": self._entries[1],
+            "hits": self._counters["hits"],
+            "misses": self._counters["misses"],
+            "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            "warm_up_prompt_tokens": int(totals.get("prompt_tokens", 0)),
+            "warm_up_completion_tokens": int(totals.get("completion_tokens", 0)),
+            "warm_up_cost_usd": round(totals.get("cost_usd", 0.0), 6),
+        }
+
+
+class AnswerBankWriter:
+    """Adds answers to the bank file (used by warm_answer_bank.py); nothing is visible until commit()"""
+
+    def __init__(self, path: str = ANSWER_BANK_PATH):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        # WAL: the API keeps reading while the job writes
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        self._connection.commit()
+
+    def ids(self) -> Set[int]:
+        """Keys of every banked question"""
+        return {row[0] for row in self._connection.execute("SELECT id FROM answers")}
+
+    def add(self, question: str, subject: Optional[str], answer: str):
+        key, normalized = question_id(question)
+        self._connection.execute(
+            "INSERT OR REPLACE INTO answers (id, normalized, question, subject, answer, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, normalized, question, subject, zlib.compress(answer.encode(), 9), time.time()),
+        )
+
+    def add_totals(self, **amounts: float):
+        """Add to the running totals (answers, tokens, cost) kept across warm-up runs"""
+        for name, amount in amounts.items():
+            self._connection.execute(
+                "INSERT INTO totals (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount),
+            )
+
+    def totals(self) -> dict:
+        return dict(self._connection.execute("SELECT name, value FROM totals").fetchall())
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+answer_bank = AnswerBank()
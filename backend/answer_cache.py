@@ -0,0 +1,291 @@
+"""
+Answer cache for homework questions.
+
+Lookups go through three tiers:
+
+1. Exact match on the normalized question + subject key (in memory)
+2. Exact match in the optional SQLite-backed persistent tier
+3. Similarity match over a character-trigram index of the questions'
+   words apart from filler words (in memory)
+
+A similar match may only differ from the question in filler words, word
+order and spelling of those: its other words must be the same set, and its
+numbers, operators, brackets, negations and units the same sequence.
+"What is 25 + 17?" never answers "What is 25 + 18?", nor "How fast can a
+cheetah swim?" "... run?", nor "Convert 5 m to km" "Convert 5 km to m".
+"""
+
+import math
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Optional
+
+# Cache configuration (override via environment)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "True").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+ANSWER_CACHE_MAX_MB = float(os.getenv("ANSWER_CACHE_MAX_MB", "64"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85"))
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")
+
+# Numbers keep their decimal and thousands separators ("3,5", "1,000") and grouping is kept,
+# so "2(x+3)" and "2x+3" are different questions
+_NUMBER_OR_SYMBOL = r"\d+(?:[.,]\d+)*|[+\-*/=×÷^%<>()\[\]{}]"
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+|" + _NUMBER_OR_SYMBOL)
+_ORDERED_PATTERN = re.compile(_NUMBER_OR_SYMBOL)
+# Words a similar question may add, drop or reorder; question words ("why", "when") aren't among them
+_FILLER_WORDS = frozenset("""
+a an the is are was were be do does did i me my you your we our it its this that of to in on at by for
+with from and or please can could would help tell explain show give about
+""".split())
+# "what's" normalizes to "what s"; an "s" after these is "is", not seconds
+_CONTRACTED = frozenset("what that it there here who where how let he she".split())
+# Words whose order matters as much as the numbers' ("n't" normalizes to "t")
+_NEGATIONS = frozenset("not no never nor none without cannot t".split())
+_UNITS = frozenset("""
+mm cm m km in ft mi mg g kg t ml l kl s sec min h hr hrs c f k r rand cent cents percent degrees
+""".split())
+
+# Rough per-entry overhead (dict slots, index postings) on top of the text itself
+_ENTRY_OVERHEAD_BYTES = 512
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivial variations share one cache key"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return " ".join(_TOKEN_PATTERN.findall(text))
+
+
+def cache_key(question: str, subject: Optional[str]) -> str:
+    """Cache key for a question + subject pair"""
+    return f"{subject or ''}\x1f{normalize_question(question)}"
+
+
+def _content(normalized: str) -> str:
+    """The question without its filler words"""
+    tokens, previous = [], ""
+    for token in normalized.split():
+        # After a number a filler word is a unit ("5 in")
+        if _ORDERED_PATTERN.fullmatch(previous) and token in _UNITS:
+            tokens.append(token)
+        elif token not in _FILLER_WORDS and not (token == "s" and previous in _CONTRACTED):
+            tokens.append(token)
+        previous = token
+    return " ".join(tokens)
+
+
+def _signature(content: str) -> tuple:
+    """What a similar question must share: its words as a set, and its numbers, operators,
+    negations and units in order"""
+    ordered, words = [], set()
+    for token in content.split():
+        if _ORDERED_PATTERN.fullmatch(token) or token in _NEGATIONS or token in _UNITS:
+            ordered.append(token)
+        else:
+            words.add(token)
+    return frozenset(words), tuple(ordered)
+
+
+def _trigrams(content: str) -> frozenset:
+    if not content:
+        return frozenset()
+    padded = f"  {content} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class _Entry:
+    __slots__ = ("subject", "normalized", "answer", "expires_at", "size", "trigrams", "signature")
+
+    def __init__(self, subject, normalized, answer, expires_at):
+        self.subject = subject
+        self.normalized = normalized
+        self.answer = answer
+        self.expires_at = expires_at
+        self.size = len(answer.encode()) + len(normalized.encode()) + _ENTRY_OVERHEAD_BYTES
+        content = _content(normalized)
+        self.trigrams = _trigrams(content)
+        self.signature = _signature(content)
+
+
+class AnswerCache:
+    """LRU/TTL answer cache with exact and similarity lookup"""
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes: int = int(ANSWER_CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY,
+        persist_path: Optional[str] = ANSWER_CACHE_PATH or None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._postings: dict = {}
+        self._bytes = 0
+        self._counters = Counter()
+
+        self._disk = None
+        if persist_path:
+            self._disk = sqlite3.connect(persist_path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=NORMAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, subject TEXT, normalized TEXT NOT NULL, "
+                "answer TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._warm_from_disk()
+
+    # Lookup
+
+    def get(self, question: str, subject: Optional[str]) -> Optional[str]:
+        """Return a cached answer for the question, or None on a miss"""
+        normalized = normalize_question(question)
+        key = f"{subject or ''}\x1f{normalized}"
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self._counters["exact_hits"] += 1
+                return entry.answer
+            self._remove(key)
+            self._counters["expired"] += 1
+
+        if self._disk is not None:
+            row = self._disk.execute(
+                "SELECT answer, expires_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                self._insert(key, _Entry(subject, normalized, row[0], row[1]))
+                self._counters["disk_hits"] += 1
+                return row[0]
+
+        answer = self._similar(subject, normalized, now)
+        if answer is not None:
+            self._counters["similar_hits"] += 1
+            return answer
+
+        self._counters["misses"] += 1
+        return None
+
+    def _similar(self, subject: Optional[str], normalized: str, now: float) -> Optional[str]:
+        content = _content(normalized)
+        query = _trigrams(content)
+        if not query or self.similarity_threshold >= 1:
+            return None
+        signature = _signature(content)
+
+        # Prefix filter: cosine >= t needs an overlap of at least t^2 * |query|
+        # trigrams, so any match shares one of the (|query| - overlap + 1) rarest
+        min_overlap = math.ceil(self.similarity_threshold ** 2 * len(query))
+        rarest = sorted(query, key=lambda gram: len(self._postings.get(gram, ())))
+        candidates = set()
+        for gram in rarest[:len(query) - min_overlap + 1]:
+            candidates.update(self._postings.get(gram, ()))
+
+        best_key, best_score = None, self.similarity_threshold
+        for key in candidates:
+            entry = self._entries[key]
+            if entry.subject != subject or entry.signature != signature or entry.expires_at <= now:
+                continue
+            score = len(query & entry.trigrams) / math.sqrt(len(query) * len(entry.trigrams))
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key].answer
+
+    # Storage
+
+    def put(self, question: str, subject: Optional[str], answer: str):
+        """Store an answer for the question"""
+        normalized = normalize_question(question)
+        key = f"{subject or ''}\x1f{normalized}"
+        expires_at = time.time() + self.ttl_seconds
+        entry = _Entry(subject, normalized, answer, expires_at)
+        if entry.size > self.max_bytes:
+            return
+
+        self._insert(key, entry)
+        self._counters["stores"] += 1
+
+        if self._disk is not None:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO answers (key, subject, normalized, answer, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, subject, normalized, answer, expires_at),
+            )
+            self._disk.commit()
+
+    def _insert(self, key: str, entry: _Entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        for gram in entry.trigrams:
+            self._postings.setdefault(gram, set()).add(key)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counters["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for gram in entry.trigrams:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def _warm_from_disk(self):
+        now = time.time()
+        self._disk.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+        self._disk.commit()
+        rows = self._disk.execute(
+            "SELECT key, subject, normalized, answer, expires_at FROM answers ORDER BY expires_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        # Oldest first so the freshest answers end up most recently used
+        for key, subject, normalized, answer, expires_at in reversed(rows):
+            self._insert(key, _Entry(subject, normalized, answer, expires_at))
+
+    def clear(self):
+        """Drop every in-memory entry (the persistent tier is kept)"""
+        self._entries.clear()
+        self._postings.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size"""
+        hits = self._counters["exact_hits"] + self._counters["disk_hits"] + self._counters["similar_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "exact_hits": self._counters["exact_hits"],
+            "disk_hits": self._counters["disk_hits"],
+            "similar_hits": self._counters["similar_hits"],
+            "misses": self._counters["misses"],
+            "stores": self._counters["stores"],
+            "evictions": self._counters["evictions"],
+            "expired": self._counters["expired"],
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache()
@@ -1,16 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException
+import asyncio
 import os
 
+from metrics import stage
+
 # Secret key for JWT - should be in environment variables
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor: each step doubles the work (12 is ~250 ms of CPU per hash on a typical core)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads hashing passwords; bcrypt releases the GIL, so this bounds the cores logins can take
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# Hashes with any other cost are upgraded (or downgraded) on the next successful login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_stage = stage("password_hash")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
@@ -20,6 +39,37 @@ def get_password_hash(password: str) -> str:
     """Hash a password"""
     return pwd_context.hash(password)
 
+def _get_hash_executor() -> Optional[ThreadPoolExecutor]:
+    global _hash_executor
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _hash_executor
+
+async def _run_hashing(fn, *args):
+    # Includes any wait for a free worker; PASSWORD_HASH_WORKERS=0 hashes on the event loop
+    with _hash_stage.time():
+        executor = _get_hash_executor()
+        if executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+async def hash_password(password: str) -> str:
+    """Hash a password in the hashing pool"""
+    return await _run_hashing(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password in the hashing pool; also returns a new hash if the stored one uses another cost"""
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def shutdown_password_pool():
+    """Stop the hashing threads (called on application shutdown)"""
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=True, cancel_futures=True)
+        _hash_executor = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -32,13 +82,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str) -> str:
-    """Verify JWT token and return email"""
+def create_user_token(user) -> str:
+    """Create an access token carrying the claims endpoints need to authorize the user"""
+    return create_access_token(data={"sub": user.email, "uid": user.id})
+
+def decode_access_token(token: str) -> dict:
+    """Verify JWT token and return its claims"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return email
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+def verify_token(token: str) -> str:
+    """Verify JWT token and return email"""
+    return decode_access_token(token)["sub"]
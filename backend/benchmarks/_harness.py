@@ -0,0 +1,44 @@
+"""Shared helpers for the StudyBuddy benchmark scripts"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Benchmarks import the backend modules (main, ai_service, ...) by name
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def use_temp_database(prefix: str = "studybuddy-bench") -> str:
+    """Point DATABASE_URL at a fresh SQLite file (call before importing main)"""
+    path = os.path.join(tempfile.mkdtemp(prefix=prefix), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    return path
+
+
+def start_server(app, port: int, host: str = "127.0.0.1"):
+    """Run an ASGI app with uvicorn in a daemon thread and wait until it is up"""
+    import uvicorn
+
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"Server on port {port} did not start")
+        time.sleep(0.05)
+    return server
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
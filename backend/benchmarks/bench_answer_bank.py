@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Answer bank benchmark.
+
+1. Lookups: banks of --sizes synthetic questions (answers of about 1.5 KB)
+   are written, then looked up. Reported: write time, size on disk against
+   the raw answer text, and lookup latency p50/p99 for banked and unknown
+   questions.
+2. Warm-up job: warm_answer_bank.py runs against the stub LLM (--latency
+   seconds per call) at each --concurrency. Reported: throughput and the
+   stub calls per question.
+3. Resume: the job is stopped with SIGINT part-way through and rerun; every
+   question must be banked exactly once with no upstream call repeated.
+
+    python benchmarks/bench_answer_bank.py --sizes 10000 100000 --concurrency 1 8 32
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from _harness import BACKEND_DIR, percentile, start_server
+
+STUB_PORT = 9231
+
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+from answer_bank import AnswerBank, AnswerBankWriter  # noqa: E402
+from stub_llm_server import create_stub_app  # noqa: E402
+
+TOPICS = ["photosynthesis", "volcanoes", "the water cycle", "fractions", "the Roman empire", "magnets",
+          "the solar system", "rivers", "verbs", "ancient Egypt", "electricity", "the human heart"]
+ASKS = ["Explain {} for grade {}", "Why is {} important in grade {}", "Give me a summary of {} (grade {})",
+        "What should I know about {} in grade {}", "How would you teach {} to grade {}"]
+
+
+def curriculum(size: int, seed: int = 0):
+    """Distinct curriculum-style questions"""
+    rng = random.Random(seed)
+    questions = set()
+    while len(questions) < size:
+        ask = rng.choice(ASKS).format(rng.choice(TOPICS), rng.randint(1, 12))
+        questions.add(f"{ask}, lesson {rng.randint(1, size)}?")
+    return sorted(questions)
+
+
+def lookups(size: int, queries: int, directory: str):
+    rng = random.Random(size)
+    questions = curriculum(size, seed=size)
+    words = "the a plant sun energy water leaf light cell grows makes food because when then".split()
+    path = os.path.join(directory, f"bank-{size}.db")
+
+    started = time.perf_counter()
+    writer = AnswerBankWriter(path)
+    raw = 0
+    for number, question in enumerate(questions, 1):
+        answer = " ".join(rng.choice(words) for _ in range(300))
+        raw += len(answer) + len(question)
+        writer.add(question, None, answer)
+        if number % 10_000 == 0:
+            writer.commit()
+    writer.close()
+    write_seconds = time.perf_counter() - started
+    disk_mb = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+                  if name.startswith(f"bank-{size}.db")) / 1024 / 1024
+
+    bank = AnswerBank(path)
+    banked = rng.sample(questions, min(queries, size))
+    unknown = [question.replace("lesson", "unit") for question in banked]
+    results = []
+    for batch in (banked, unknown):
+        samples = []
+        for question in batch:
+            began = time.perf_counter()
+            answer = bank.get(question)
+            samples.append((time.perf_counter() - began) * 1000)
+            assert (answer is not None) == (batch is banked)
+        results.append(samples)
+    print(f"{size:>9,} {write_seconds:>8.1f} {disk_mb:>8.1f} {raw / 1024 / 1024:>8.1f} "
+          + " ".join(f"{percentile(samples, 50):>8.3f} {percentile(samples, 99):>8.3f}" for samples in results))
+
+
+def stub_requests() -> int:
+    with urllib.request.urlopen(f"http://127.0.0.1:{STUB_PORT}/faults") as response:
+        return json.load(response)["requests"]
+
+
+def job(questions_path: str, bank_path: str, concurrency: int, wait: bool = True, extra=()):
+    environment = dict(
+        os.environ,
+        OPENAI_API_KEY="stub",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+        ANSWER_CACHE_ENABLED="False",
+        KNOWLEDGE_BASE_ENABLED="False",
+        ANSWER_BANK_PATH=bank_path,
+    )
+    command = [sys.executable, os.path.join(BACKEND_DIR, "warm_answer_bank.py"), questions_path,
+               "--bank", bank_path, "--concurrency", str(concurrency), "--checkpoint", "10", "--progress", "2", *extra]
+    process = subprocess.Popen(command, env=environment, cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True)
+    if wait:
+        process.communicate()
+    return process
+
+
+def banked_rows(bank_path: str) -> int:
+    import sqlite3
+
+    with sqlite3.connect(bank_path) as connection:
+        return connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+def warm_up(questions: int, concurrencies: list, directory: str):
+    questions_path = os.path.join(directory, "curriculum.jsonl")
+    with open(questions_path, "w") as output:
+        for question in curriculum(questions):
+            output.write(json.dumps({"question": question, "subject": "science"}) + "\n")
+
+    print(f"{'concurrency':>11} {'seconds':>8} {'q/s':>8} {'calls/q':>8}")
+    for concurrency in concurrencies:
+        bank_path = os.path.join(directory, f"warm-{concurrency}.db")
+        before = stub_requests()
+        started = time.perf_counter()
+        job(questions_path, bank_path, concurrency)
+        elapsed = time.perf_counter() - started
+        rows = banked_rows(bank_path)
+        print(f"{concurrency:>11} {elapsed:>8.1f} {rows / elapsed:>8.1f} {(stub_requests() - before) / rows:>8.2f}")
+
+    bank_path = os.path.join(directory, "resume.db")
+    before = stub_requests()
+    process = job(questions_path, bank_path, max(concurrencies), wait=False)
+    time.sleep(max(1.0, questions / max(concurrencies) * ARGS.latency / 3))
+    process.send_signal(signal.SIGINT)
+    process.communicate()
+    first = banked_rows(bank_path)
+    job(questions_path, bank_path, max(concurrencies))
+    calls, rows = stub_requests() - before, banked_rows(bank_path)
+    status = "ok" if rows == questions and calls == questions else "FAILED"
+    print(f"\nresume: {first} banked before SIGINT, {rows}/{questions} after the rerun, "
+          f"{calls} stub calls for {questions} questions: {status}")
+    return status == "ok"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=200, help="questions for the warm-up job")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=0.2, help="stub LLM seconds per call")
+    ARGS = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="studybuddy-answer-bank")
+    try:
+        print(f"lookups, {ARGS.queries} queries (latency in ms)")
+        print(f"{'entries':>9} {'write s':>8} {'disk MB':>8} {'raw MB':>8} {'hit p50':>8} {'p99':>8} {'miss p50':>8} {'p99':>8}")
+        for size in ARGS.sizes:
+            lookups(size, ARGS.queries, directory)
+
+        start_server(create_stub_app(ARGS.latency), STUB_PORT)
+        print(f"\nwarm-up job, {ARGS.questions} questions, stub latency {ARGS.latency}s")
+        ok = warm_up(ARGS.questions, ARGS.concurrency, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Sync vs async database sessions under mixed chat/history load.
+
+Builds two minimal apps over the same SQLite database, both using the
+production query shapes: reserve a credit, simulate the AI call, save the
+message (chat), and fetch the latest 50 messages (history). The "sync" app
+uses the blocking Session inside async endpoints, the way main.py did
+before; the "async" app uses AsyncSession with credit_ledger and
+chat_history. Clients run a history-heavy mix and the script reports
+p50/p99 latency per request type.
+
+Local SQLite answers in microseconds, so --db-latency adds a simulated
+network round trip to every statement (as with PostgreSQL). The delay runs
+on the thread that executes the statement: the event loop for the sync
+driver, aiosqlite's worker thread for the async one - the same place a
+real sync or async network driver would wait.
+
+Each app runs in its own uvicorn process so the load generator doesn't
+compete with it for the GIL.
+
+    python benchmarks/bench_async_db.py --levels 16 64 --duration 10 --db-latency 2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+from sqlalchemy import event
+
+from _harness import percentile
+
+# Server processes (--serve) reuse the database the parent seeded
+if "--serve" not in sys.argv:
+    from _harness import use_temp_database
+
+    use_temp_database("studybuddy-asyncdb")
+
+from fastapi import Depends, FastAPI  # noqa: E402
+from sqlalchemy import select, update  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from chat_history import history_page  # noqa: E402
+from credit_ledger import reserve_credits  # noqa: E402
+from database import async_engine, engine, get_db, get_sync_db, init_db, write_lock  # noqa: E402
+from models import ChatMessage, Credit, User  # noqa: E402
+
+PORTS = {"sync": 9121, "async": 9122}
+
+
+def sync_app(ai_latency: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/chat/{user_id}")
+    async def chat(user_id: int, db: Session = Depends(get_sync_db)):
+        balance = db.execute(
+            update(User).where(User.id == user_id, User.credits >= 1)
+            .values(credits=User.credits - 1).returning(User.credits),
+            execution_options={"synchronize_session": False},
+        ).scalar_one_or_none()
+        db.add(Credit(user_id=user_id, amount=-1, transaction_type="usage"))
+        db.commit()
+        await asyncio.sleep(ai_latency)
+        db.add(ChatMessage(user_id=user_id, user_message="What is 2 + 2?", ai_response="4 " * 200, subject="math"))
+        db.commit()
+        return {"credits_remaining": balance}
+
+    @app.get("/history/{user_id}")
+    async def history(user_id: int, db: Session = Depends(get_sync_db)):
+        rows = db.execute(
+            select(ChatMessage.id, ChatMessage.user_message, ChatMessage.ai_response, ChatMessage.subject,
+                   ChatMessage.has_image, ChatMessage.created_at)
+            .where(ChatMessage.user_id == user_id)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(50)
+        ).all()
+        # Hand the connection back now: if it waited for the threadpool teardown,
+        # more clients than pooled connections would block the loop on checkout
+        # and deadlock it
+        db.commit()
+        return [dict(row._mapping) for row in rows]
+
+    return app
+
+
+def async_app(ai_latency: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/chat/{user_id}")
+    async def chat(user_id: int, db: AsyncSession = Depends(get_db)):
+        balance = await reserve_credits(db, user_id, 1)
+        await asyncio.sleep(ai_latency)
+        db.add(ChatMessage(user_id=user_id, user_message="What is 2 + 2?", ai_response="4 " * 200, subject="math"))
+        async with write_lock():
+            await db.commit()
+        return {"credits_remaining": balance}
+
+    @app.get("/history/{user_id}")
+    async def history(user_id: int, db: AsyncSession = Depends(get_db)):
+        messages, _ = await history_page(db, user_id)
+        return messages
+
+    return app
+
+
+def seed(users: int, messages_per_user: int):
+    init_db()
+    connection = engine.raw_connection()
+    connection.executemany(
+        "INSERT INTO users (id, email, full_name, hashed_password, credits, is_active, created_at) "
+        "VALUES (?, ?, ?, 'x', 1000000, 1, '2024-01-01 00:00:00')",
+        ((i, f"user{i}@example.com", f"User {i}") for i in range(1, users + 1)),
+    )
+    connection.executemany(
+        "INSERT INTO chat_messages (user_id, user_message, ai_response, subject, has_image, created_at) "
+        "VALUES (?, 'What is 2 + 2?', ?, 'math', 0, datetime('2024-01-01', '+' || ? || ' seconds'))",
+        ((1 + i % users, "4 " * 200, i) for i in range(users * messages_per_user)),
+    )
+    connection.commit()
+    connection.close()
+
+
+def add_round_trip_latency(seconds: float):
+    """Make every statement on new connections take `seconds` longer"""
+    def on_connect(dbapi_connection, connection_record):
+        driver = getattr(dbapi_connection, "driver_connection", dbapi_connection)
+        # aiosqlite keeps the sqlite3 connection on its worker thread
+        raw = getattr(driver, "_conn", driver)
+        raw.set_trace_callback(lambda statement: time.sleep(seconds))
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "connect", on_connect)
+    engine.dispose()
+
+
+def spawn_server(kind: str, port: int, args) -> subprocess.Popen:
+    import httpx
+
+    process = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), "--serve", kind, "--port", str(port),
+        "--ai-latency", str(args.ai_latency), "--db-latency", str(args.db_latency),
+    ])
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{kind} server on port {port} did not start")
+
+
+async def run_level(port: int, users: int, concurrency: int, duration: float, chat_share: float):
+    import httpx
+
+    latencies = {"chat": [], "history": []}
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(client, seed_value: int):
+        rng = random.Random(seed_value)
+        while time.perf_counter() < deadline:
+            user_id = rng.randint(1, users)
+            kind = "chat" if rng.random() < chat_share else "history"
+            started = time.perf_counter()
+            if kind == "chat":
+                response = await client.post(f"/chat/{user_id}")
+            else:
+                response = await client.get(f"/history/{user_id}")
+            response.raise_for_status()
+            latencies[kind].append((time.perf_counter() - started) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+        await asyncio.gather(*(client_loop(client, i) for i in range(concurrency)))
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[16, 64], help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--ai-latency", type=float, default=0.2, help="simulated AI call in seconds")
+    parser.add_argument("--chat-share", type=float, default=0.2, help="fraction of requests that are chats")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=50, help="seeded messages per user")
+    parser.add_argument("--db-latency", type=float, default=2.0, help="simulated ms per statement (0 for raw SQLite)")
+    parser.add_argument("--serve", choices=list(PORTS), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        import uvicorn
+
+        if args.db_latency:
+            add_round_trip_latency(args.db_latency / 1000)
+        app = sync_app(args.ai_latency) if args.serve == "sync" else async_app(args.ai_latency)
+        uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+        sys.exit(0)
+
+    seed(args.users, args.messages)
+    servers = [spawn_server(name, port, args) for name, port in PORTS.items()]
+    try:
+        print(f"{'sessions':>8} {'clients':>8} {'req/s':>8} {'chat p50':>9} {'chat p99':>9} {'hist p50':>9} {'hist p99':>9}")
+        for concurrency in args.levels:
+            for name, port in PORTS.items():
+                latencies = asyncio.run(run_level(port, args.users, concurrency, args.duration, args.chat_share))
+                total = len(latencies["chat"]) + len(latencies["history"])
+                print(f"{name:>8} {concurrency:>8} {total / args.duration:>8.0f} "
+                      f"{percentile(latencies['chat'], 50):>9.1f} {percentile(latencies['chat'], 99):>9.1f} "
+                      f"{percentile(latencies['history'], 50):>9.1f} {percentile(latencies['history'], 99):>9.1f}")
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Chat history full-text search benchmark.
+
+Grows one temporary SQLite database through --sizes chat messages (answers
+of about 60 words over a school vocabulary plus a long tail of rarer words).
+Typical users have --per-user messages each, so the number of users grows
+with the table; their messages are interleaved with other users' in each
+batch. One heavy user owns --heavy messages spread over the first rows.
+Rows go in with executemany through the FTS triggers, as write-behind
+inserts them. At each size it reports the insert rate, the database size,
+and /api/chat/search latency (chat_search.search_messages) p50/p99 for
+typical and heavy users, next to the same search ranked by FTS5's own
+bm25() for typical users.
+
+    python benchmarks/bench_chat_search.py --sizes 100000 1000000 3000000
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from _harness import percentile, use_temp_database
+
+DB_PATH = use_temp_database("studybuddy-search")
+
+from sqlalchemy import text  # noqa: E402
+
+from chat_search import SEARCH_TABLE, search_messages, search_terms  # noqa: E402
+from database import AsyncSessionLocal, engine, init_db  # noqa: E402
+
+HEAVY_USER = 1
+TOPICS = ("fractions denominator numerator decimal percentage equation algebra triangle angle area perimeter "
+          "multiplication division photosynthesis plant cell energy volcano earthquake magnet electricity "
+          "gravity planet orbit river continent climate apartheid mandela pyramid empire war treaty "
+          "noun verb adjective metaphor simile poem essay paragraph grammar spelling").split()
+COMMON = ("the a is to and of in that it you this for with step first then so we can our your answer "
+          "question example number great let add find work").split()
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "su", "da", "gi"]
+
+
+class Corpus:
+    def __init__(self, seed: int = 3):
+        self.rng = random.Random(seed)
+        rare = sorted({"".join(self.rng.choice(SYLLABLES) for _ in range(4)) for _ in range(20_000)})
+        self.words = COMMON + TOPICS + rare
+        # Zipf-like: common words most often, then topics, then the long tail
+        self.cum_weights = list(itertools.accumulate(1 / (rank + 1) ** 0.9 for rank in range(len(self.words))))
+
+    def message(self):
+        rng = self.rng
+        topic = rng.choice(TOPICS)
+        question = f"Can you explain {topic} and {rng.choice(TOPICS)} for my homework?"
+        answer = " ".join(rng.choices(self.words, cum_weights=self.cum_weights, k=60))
+        return question, f"Great question about {topic}! {answer}."
+
+
+def load(corpus: Corpus, start: int, stop: int, per_user: int, heavy: int, batch: int = 50_000) -> float:
+    """Insert messages start..stop-1 (through the FTS triggers); returns rows per second"""
+    began = time.perf_counter()
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    epoch = datetime(2024, 1, 1)
+    for offset in range(start, stop, batch):
+        numbers = range(offset, min(stop, offset + batch))
+        # The heavy user has every 5th of the first rows; typical users write
+        # in turn, and the users active in a batch take turns within it
+        owners = [
+            HEAVY_USER if number % 5 == 0 and number < heavy * 5
+            else 2 + (number - min((number + 4) // 5, heavy)) // per_user
+            for number in numbers
+        ]
+        typical = [owner for owner in owners if owner != HEAVY_USER]
+        corpus.rng.shuffle(typical)
+        owners = [owner if owner == HEAVY_USER else typical.pop() for owner in owners]
+        rows = []
+        for number, owner in zip(numbers, owners):
+            question, answer = corpus.message()
+            rows.append((owner, question, answer, str(epoch + timedelta(seconds=number * 30))))
+        owners = {row[0] for row in rows}
+        cursor.executemany(
+            "INSERT OR IGNORE INTO users (id, email, full_name, hashed_password, credits, is_active, created_at) "
+            "VALUES (?, ?, 'User', 'x', 5, 1, ?)",
+            ((owner, f"user{owner}@example.com", str(epoch)) for owner in owners),
+        )
+        cursor.executemany(
+            "INSERT INTO chat_messages (user_id, user_message, ai_response, subject, has_image, created_at) "
+            "VALUES (?, ?, ?, NULL, 0, ?)",
+            rows,
+        )
+        connection.commit()
+    connection.close()
+    return (stop - start) / (time.perf_counter() - began)
+
+
+def queries(rng: random.Random, count: int):
+    return [" ".join(rng.sample(TOPICS, rng.randint(1, 3))) for _ in range(count)]
+
+
+async def time_search(users, batch):
+    samples = []
+    async with AsyncSessionLocal() as db:
+        for user_id, query in zip(users, batch):
+            started = time.perf_counter()
+            await search_messages(db, user_id, query)
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+BM25_SEARCH = text(f"""
+    SELECT m.id, m.subject, m.has_image, m.created_at,
+           snippet({SEARCH_TABLE}, 1, '[', ']', '…', 16), snippet({SEARCH_TABLE}, 2, '[', ']', '…', 16)
+    FROM {SEARCH_TABLE} JOIN chat_messages AS m ON m.id = {SEARCH_TABLE}.rowid
+    WHERE {SEARCH_TABLE} MATCH :query AND rank MATCH 'bm25(0.0, 2.0, 1.0)'
+    ORDER BY rank LIMIT 20
+""")
+
+
+async def time_bm25(users, batch):
+    """The same searches ranked by FTS5's bm25(), which counts each word's matches in the whole table"""
+    samples = []
+    async with AsyncSessionLocal() as db:
+        for user_id, query in zip(users, batch):
+            words = " OR ".join(f'"{term}"' for term in search_terms(query))
+            started = time.perf_counter()
+            await db.execute(BM25_SEARCH, {"query": f'user_id : "{user_id}" AND {{user_message ai_response}} : ({words})'})
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--per-user", type=int, default=200, help="messages per typical user")
+    parser.add_argument("--heavy", type=int, default=20_000, help="messages owned by the heavy user")
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    init_db()
+    corpus = Corpus()
+    rng = random.Random(1)
+    loaded = 0
+    print(f"typical users: {args.per_user} messages each; heavy user: {args.heavy:,} messages (latency in ms)")
+    print(f"{'messages':>10} {'users':>7} {'insert/s':>9} {'DB MB':>7} {'typical p50':>11} {'p99':>7} "
+          f"{'heavy p50':>9} {'p99':>7} {'bm25() p50':>10} {'p99':>7}")
+    for size in sorted(args.sizes):
+        rate = load(corpus, loaded, size, args.per_user, args.heavy)
+        loaded = size
+        users = 1 + (size - args.heavy) // args.per_user
+        batch = queries(rng, args.queries)
+        sampled = [rng.randint(2, users) for _ in batch]
+        typical = asyncio.run(time_search(sampled, batch))
+        heavy = asyncio.run(time_search([HEAVY_USER] * len(batch), batch))
+        bm25 = asyncio.run(time_bm25(sampled[:100], batch[:100]))
+        size_mb = sum(os.path.getsize(DB_PATH + suffix) for suffix in ("", "-wal") if os.path.exists(DB_PATH + suffix)) / 1024 / 1024
+        print(f"{size:>10,} {users:>7,} {rate:>9,.0f} {size_mb:>7,.0f} "
+              + " ".join(f"{percentile(samples, 50):>{width}.2f} {percentile(samples, 99):>7.2f}"
+                         for samples, width in ((typical, 11), (heavy, 9), (bm25, 10))))
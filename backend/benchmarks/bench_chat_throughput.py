@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+/api/chat throughput benchmark.
+
+Starts the stub LLM server and the StudyBuddy API in-process, registers a
+user with plenty of credits, then fires batches of /api/chat requests at
+increasing concurrency. With a non-blocking AI client, throughput should
+grow roughly linearly with concurrency until AI_MAX_CONCURRENCY is reached.
+
+    python benchmarks/bench_chat_throughput.py --latency 0.5 --levels 1 4 16 64
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from _harness import percentile, start_server, use_temp_database
+
+STUB_PORT = 9101
+API_PORT = 9102
+
+
+async def run_level(client, token: str, concurrency: int, requests_per_worker: int):
+    latencies = []
+
+    async def worker(worker_id: int):
+        for i in range(requests_per_worker):
+            started = time.perf_counter()
+            response = await client.post(
+                "/api/chat",
+                json={"message": f"What is {worker_id} + {i}?", "subject": "math"},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+
+async def main(args):
+    import httpx
+    from database import SessionLocal
+    from models import User
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{API_PORT}", timeout=120) as client:
+        response = await client.post(
+            "/api/auth/register",
+            json={"email": "bench@example.com", "full_name": "Bench User", "password": "bench-password"},
+        )
+        response.raise_for_status()
+        token = response.json()["access_token"]
+
+        # Top up directly so the benchmark never runs out of credits
+        db = SessionLocal()
+        db.query(User).filter(User.email == "bench@example.com").update({User.credits: 10_000_000})
+        db.commit()
+        db.close()
+
+        print(f"stub latency {args.latency:.3f}s, {args.requests} requests per worker")
+        print(f"{'concurrency':>12} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+        for level in args.levels:
+            throughput, p50, p99 = await run_level(client, token, level, args.requests)
+            print(f"{level:>12} {throughput:>10.1f} {p50 * 1000:>10.1f} {p99 * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM seconds per completion")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=4, help="requests per concurrent worker")
+    args = parser.parse_args()
+
+    use_temp_database()
+    os.environ["OPENAI_API_KEY"] = "stub-key"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{STUB_PORT}/v1"
+    # One account on purpose: measures the pipeline, not the per-user limits
+    os.environ["RATE_LIMIT_ENABLED"] = "False"
+
+    from stub_llm_server import create_stub_app
+    import main as api
+
+    start_server(create_stub_app(args.latency), STUB_PORT)
+    start_server(api.app, API_PORT)
+    asyncio.run(main(args))
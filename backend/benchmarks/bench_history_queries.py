@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Chat history / credit query benchmark at production-like table sizes.
+
+Loads N chat messages and N credit transactions (default 1M each) spread
+over many users into a temporary SQLite database, then times the queries
+the API runs with and without the composite (user_id, created_at) indexes.
+Also measures single-row commit throughput with the default journal vs
+the WAL + synchronous=NORMAL settings from database.py, and deep paging
+for one heavy user: OFFSET paging vs the keyset cursor in chat_history.py,
+plus the JSON size of a full page vs a preview page.
+
+    python benchmarks/bench_history_queries.py --rows 1000000 --users 20000 --heavy 20000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from _harness import percentile, use_temp_database
+
+DB_PATH = use_temp_database("studybuddy-history")
+
+from sqlalchemy import func, select  # noqa: E402
+
+from chat_history import FULL_COLUMNS, history_page  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, engine, init_db  # noqa: E402
+from models import ChatMessage, Credit  # noqa: E402
+
+INDEXES = {
+    "ix_chat_messages_user_id_created_at_id": "chat_messages (user_id, created_at, id)",
+    "ix_credits_user_id_created_at": "credits (user_id, created_at)",
+}
+
+
+HEAVY_USER = 1
+
+
+def load(rows: int, users: int, heavy: int, batch: int = 50_000):
+    """Bulk-load users, chat messages and credit rows with raw executemany
+
+    Every `rows // heavy`-th message belongs to HEAVY_USER, the rest are random.
+    """
+    random.seed(7)
+    start = datetime(2024, 1, 1)
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.executemany(
+        "INSERT INTO users (id, email, full_name, hashed_password, credits, is_active, created_at) "
+        "VALUES (?, ?, ?, 'x', 5, 1, ?)",
+        ((i, f"user{i}@example.com", f"User {i}", str(start)) for i in range(1, users + 1)),
+    )
+    answer = "Great question! 🌟 " + "Here is a step-by-step explanation. " * 12
+    for offset in range(0, rows, batch):
+        count = min(batch, rows - offset)
+        stamps = [str(start + timedelta(seconds=(offset + i) * 30)) for i in range(count)]
+        stride = rows // heavy if heavy else 0
+        owners = [
+            HEAVY_USER if stride and (offset + i) % stride == 0 else random.randint(2, users)
+            for i in range(count)
+        ]
+        cursor.executemany(
+            "INSERT INTO chat_messages (user_id, user_message, ai_response, subject, has_image, created_at) "
+            "VALUES (?, ?, ?, 'math', 0, ?)",
+            ((owners[i], f"What is {offset + i} + 17?", answer, stamps[i]) for i in range(count)),
+        )
+        cursor.executemany(
+            "INSERT INTO credits (user_id, amount, transaction_type, description, created_at) "
+            "VALUES (?, -1, 'usage', 'AI chat question', ?)",
+            ((owners[i], stamps[i]) for i in range(count)),
+        )
+        connection.commit()
+    cursor.execute("ANALYZE")
+    connection.commit()
+    connection.close()
+
+
+def set_indexes(enabled: bool):
+    connection = engine.raw_connection()
+    for name, target in INDEXES.items():
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}" if enabled else f"DROP INDEX IF EXISTS {name}")
+    connection.execute("ANALYZE")
+    connection.commit()
+    connection.close()
+
+
+def query_plan(sql: str) -> str:
+    connection = engine.raw_connection()
+    rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    connection.close()
+    return "; ".join(row[-1] for row in rows)
+
+
+QUERIES = {
+    "history (latest 50)": lambda db, uid: db.query(ChatMessage)
+    .filter(ChatMessage.user_id == uid).order_by(ChatMessage.created_at.desc()).limit(50).all(),
+    "credit transactions (latest 50)": lambda db, uid: db.query(Credit)
+    .filter(Credit.user_id == uid).order_by(Credit.created_at.desc()).limit(50).all(),
+    "credit usage total": lambda db, uid: db.query(func.sum(Credit.amount))
+    .filter(Credit.user_id == uid).scalar(),
+}
+
+
+def time_queries(users: int, samples: int):
+    db = SessionLocal()
+    results = {}
+    for name, run in QUERIES.items():
+        timings = []
+        for _ in range(samples):
+            uid = random.randint(1, users)
+            started = time.perf_counter()
+            run(db, uid)
+            timings.append((time.perf_counter() - started) * 1000)
+            db.expunge_all()
+        results[name] = timings
+    db.close()
+    return results
+
+
+async def deep_paging(depths):
+    """Latency of fetching page N for the heavy user: OFFSET vs keyset cursor"""
+    page_size = 50
+    async with AsyncSessionLocal() as db:
+        # Walk the cursors once so each depth has the cursor a client would hold
+        cursors, cursor = {0: None}, None
+        for page in range(1, max(depths) + 1):
+            _, cursor = await history_page(db, HEAVY_USER, limit=page_size, cursor=cursor)
+            if cursor is None:
+                break
+            cursors[page] = cursor
+
+        results = []
+        for depth in depths:
+            if depth not in cursors:
+                break
+            started = time.perf_counter()
+            await db.execute(
+                select(*FULL_COLUMNS).where(ChatMessage.user_id == HEAVY_USER)
+                .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                .offset(depth * page_size).limit(page_size)
+            )
+            offset_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            await history_page(db, HEAVY_USER, limit=page_size, cursor=cursors[depth])
+            keyset_ms = (time.perf_counter() - started) * 1000
+            results.append((depth, offset_ms, keyset_ms))
+
+        full, _ = await history_page(db, HEAVY_USER, limit=page_size)
+        preview, _ = await history_page(db, HEAVY_USER, limit=page_size, preview=True)
+    sizes = tuple(len(json.dumps(items, default=str)) for items in (full, preview))
+    return results, sizes
+
+
+def commit_rate(tuned: bool, commits: int) -> float:
+    """Single-row INSERT + COMMIT per second on a scratch database"""
+    path = DB_PATH + (".tuned" if tuned else ".default")
+    connection = sqlite3.connect(path)
+    if tuned:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS t (id INTEGER PRIMARY KEY, body TEXT)")
+    started = time.perf_counter()
+    for i in range(commits):
+        connection.execute("INSERT INTO t (body) VALUES (?)", (f"row {i}",))
+        connection.commit()
+    elapsed = time.perf_counter() - started
+    connection.close()
+    return commits / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="chat messages (and credit rows) to load")
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--heavy", type=int, default=20_000, help="messages owned by one heavy user")
+    parser.add_argument("--samples", type=int, default=200, help="queries timed per variant")
+    parser.add_argument("--commits", type=int, default=2_000)
+    args = parser.parse_args()
+
+    init_db()
+    started = time.perf_counter()
+    load(args.rows, args.users, args.heavy)
+    size_mb = os.path.getsize(DB_PATH) / 1024 / 1024
+    print(f"Loaded {args.rows:,} messages + {args.rows:,} credit rows for {args.users:,} users "
+          f"in {time.perf_counter() - started:.1f}s ({size_mb:.0f} MB)\n")
+
+    history_sql = "SELECT * FROM chat_messages WHERE user_id = 1 ORDER BY created_at DESC LIMIT 50"
+    print(f"{'query':<34} {'indexes':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for enabled in (False, True):
+        set_indexes(enabled)
+        plan = query_plan(history_sql)
+        for name, timings in time_queries(args.users, args.samples).items():
+            label = "yes" if enabled else "no"
+            print(f"{name:<34} {label:>8} {percentile(timings, 50):>9.2f} {percentile(timings, 99):>9.2f}")
+        print(f"  history plan: {plan}")
+
+    print(f"\nDeep paging for a user with {args.heavy:,} messages (50 per page)")
+    print(f"{'page':>8} {'OFFSET ms':>10} {'keyset ms':>10}")
+    paging, (full_bytes, preview_bytes) = asyncio.run(deep_paging([0, 10, 100, 200, 399]))
+    for depth, offset_ms, keyset_ms in paging:
+        print(f"{depth:>8} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+    print(f"Page payload: full {full_bytes / 1024:.1f} KB, preview {preview_bytes / 1024:.1f} KB")
+
+    print(f"\nCommit throughput ({args.commits:,} single-row transactions)")
+    print(f"  rollback journal, synchronous=FULL : {commit_rate(False, args.commits):>8.0f}/s")
+    print(f"  WAL, synchronous=NORMAL            : {commit_rate(True, args.commits):>8.0f}/s")
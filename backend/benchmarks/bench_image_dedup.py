@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate image lookup benchmark.
+
+1. Fingerprint quality on synthetic worksheets that share one layout:
+   bit distances for re-sent copies (resized, recompressed), gentle
+   re-photos (slight rotation, crop, lighting), the same worksheet with
+   different numbers and different worksheets, and the share of each
+   within IMAGE_CACHE_MAX_DISTANCE.
+2. A class uploading worksheets, some with different numbers, through
+   ImageAnswerCache (the worksheet text stands in for OCR): hit rate,
+   analyses saved and wrong analyses served.
+3. Lookup speed at --sizes stored fingerprints (1M by default), NumPy
+   scan vs a pure-Python scan, and the index's memory.
+
+    python benchmarks/bench_image_dedup.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import io
+import os
+import random
+import time
+
+from _harness import percentile  # puts the backend on sys.path
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont  # noqa: E402
+
+from image_fingerprint import (HASH_BYTES, IMAGE_CACHE_MAX_DISTANCE, FingerprintIndex, ImageAnswerCache,  # noqa: E402
+                               dhash, hamming)
+from image_pipeline import preprocess_image  # noqa: E402
+
+WORDS = ["add", "the", "numbers", "carefully", "show", "your", "work", "then", "check"]
+
+
+def make_worksheet(seed: int, numbers: int = 0):
+    """An A4 maths worksheet and its text; every seed has the same layout with different questions,
+    and other numbers gives the seed's worksheet with only the numbers changed"""
+    rng, digits = random.Random(seed), random.Random(seed * 1000 + numbers)
+    page = Image.new("L", (1240, 1754), 255)
+    draw = ImageDraw.Draw(page)
+    lines = [f"Grade 4 Maths Worksheet {rng.randint(1, 20)}"]
+    draw.text((80, 60), lines[0], fill=0, font=ImageFont.load_default(size=44))
+    font = ImageFont.load_default(size=28)
+    for number in range(12):
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 8)))
+        lines.append(f"{number + 1}. {digits.randint(10, 999)} {rng.choice('+-x')} {digits.randint(2, 99)} = ______   {words}")
+        draw.text((80, 180 + number * 120), lines[-1], fill=0, font=font)
+    return page.convert("RGB"), "\n".join(lines)
+
+
+def encode(image: Image.Image, quality: int) -> bytes:
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def resent(page: Image.Image, rng: random.Random) -> bytes:
+    """Forwarded through a chat app: downscaled and recompressed"""
+    copy = page.copy()
+    copy.thumbnail((rng.choice([640, 800, 1200, 1600]),) * 2)
+    return encode(Image.open(io.BytesIO(encode(copy, rng.randint(40, 90)))), 60)
+
+
+def rephotographed(page: Image.Image, rng: random.Random) -> bytes:
+    """Photographed again: slightly rotated, cropped and lit differently"""
+    photo = ImageEnhance.Brightness(page).enhance(rng.uniform(0.85, 1.15))
+    photo = photo.rotate(rng.uniform(-0.5, 0.5), fillcolor=(255, 255, 255), resample=Image.BILINEAR)
+    width, height = photo.size
+    margin = 0.01
+    photo = photo.crop((int(width * margin * rng.random()), int(height * margin * rng.random()),
+                        width - int(width * margin * rng.random()), height - int(height * margin * rng.random())))
+    return encode(photo, rng.randint(40, 90))
+
+
+def fingerprint_of(data: bytes) -> bytes:
+    return preprocess_image(data).fingerprint
+
+
+def quality(pages: int, variants: int):
+    rng = random.Random(1)
+    sheets = [make_worksheet(seed)[0] for seed in range(pages)]
+    originals = [fingerprint_of(encode(sheet, 90)) for sheet in sheets]
+
+    started = time.perf_counter()
+    resent_distances = [hamming(originals[i], fingerprint_of(resent(sheets[i], rng)))
+                        for i in range(pages) for _ in range(variants)]
+    preprocess_ms = (time.perf_counter() - started) / len(resent_distances) * 1000
+    rephoto_distances = [hamming(originals[i], fingerprint_of(rephotographed(sheets[i], rng)))
+                         for i in range(pages) for _ in range(variants)]
+    renumbered = [hamming(originals[i], fingerprint_of(encode(make_worksheet(i, numbers)[0], 90)))
+                  for i in range(pages) for numbers in range(1, variants + 1)]
+    different = [hamming(originals[i], originals[j]) for i in range(pages) for j in range(i + 1, pages)]
+
+    limit = IMAGE_CACHE_MAX_DISTANCE
+    print(f"fingerprint distance out of {HASH_BYTES * 8} bits, matched at <= {limit}")
+    print(f"{'pair':<22} {'pairs':>6} {'min':>5} {'p50':>5} {'max':>5} {'matched':>8}")
+    for label, distances in (("re-sent copy", resent_distances), ("re-photographed", rephoto_distances),
+                             ("other numbers", renumbered), ("different worksheets", different)):
+        matched = sum(distance <= limit for distance in distances) / len(distances)
+        print(f"{label:<22} {len(distances):>6} {min(distances):>5} {percentile(distances, 50):>5} "
+              f"{max(distances):>5} {matched:>8.1%}")
+
+    image = Image.open(io.BytesIO(encode(sheets[0], 90)))
+    image.thumbnail((1600, 1600))
+    rounds = 200
+    started = time.perf_counter()
+    for _ in range(rounds):
+        dhash(image)
+    print(f"\ndhash of a 1600px image: {(time.perf_counter() - started) / rounds * 1000:.2f} ms "
+          f"(whole preprocessing: {preprocess_ms:.1f} ms)")
+    return sheets
+
+
+def classroom(templates: int, students: int):
+    """Every student uploads one of the worksheets, a third of them re-photographed; each template
+    comes with two sets of numbers"""
+    worksheets = [make_worksheet(seed, numbers) for seed in range(templates) for numbers in range(2)]
+    for label, read in (("text read", True), ("no text", False)):
+        rng = random.Random(2)
+        cache = ImageAnswerCache()
+        analyses = wrong = 0
+        for student in range(students):
+            page = rng.randrange(len(worksheets))
+            sheet, text = worksheets[page]
+            data = rephotographed(sheet, rng) if student % 3 == 0 else resent(sheet, rng)
+            message = rng.choice(["", "help with question 3"])
+            fingerprint = fingerprint_of(data)
+            answer = cache.get(fingerprint, message, text if read else None)
+            if answer is None:
+                analyses += 1
+                cache.put(fingerprint, message, f"analysis of worksheet {page}", text if read else None)
+            elif answer != f"analysis of worksheet {page}":
+                wrong += 1
+        stats = cache.stats()
+        print(f"{label + ':':<11} {students} uploads of {len(worksheets)} worksheets x 2 messages: {analyses} analyses, "
+              f"hit rate {stats['hit_rate']:.1%} ({stats['exact_hits']} exact, {stats['near_hits']} near), {wrong} wrong")
+
+
+def python_scan(fingerprints: list, query: bytes, max_distance: int) -> list:
+    query_bits = int.from_bytes(query, "big")
+    return [i for i, bits in enumerate(fingerprints) if (bits ^ query_bits).bit_count() <= max_distance]
+
+
+def lookup_speed(size: int, queries: int):
+    rng = random.Random(size)
+    index = FingerprintIndex(size)
+    stored = [os.urandom(HASH_BYTES) for _ in range(size)]
+    for slot, fingerprint in enumerate(stored):
+        index.set(slot, fingerprint)
+
+    def near(fingerprint: bytes) -> bytes:
+        bits = int.from_bytes(fingerprint, "big")
+        for bit in rng.sample(range(HASH_BYTES * 8), IMAGE_CACHE_MAX_DISTANCE // 2):
+            bits ^= 1 << bit
+        return bits.to_bytes(HASH_BYTES, "big")
+
+    hits = [near(rng.choice(stored)) for _ in range(queries)]
+    misses = [os.urandom(HASH_BYTES) for _ in range(queries)]
+    timings = {}
+    for label, batch in (("hit", hits), ("miss", misses)):
+        samples = []
+        for query in batch:
+            started = time.perf_counter()
+            matches = index.search(query, IMAGE_CACHE_MAX_DISTANCE)
+            samples.append((time.perf_counter() - started) * 1000)
+            assert (label == "hit") == bool(matches)
+        timings[label] = samples
+
+    as_ints = [int.from_bytes(fingerprint, "big") for fingerprint in stored]
+    started = time.perf_counter()
+    python_scan(as_ints, hits[0], IMAGE_CACHE_MAX_DISTANCE)
+    python_ms = (time.perf_counter() - started) * 1000
+
+    memory_mb = (index._words.nbytes + index._live.nbytes) / 1024 / 1024
+    print(f"{size:>10,} {percentile(timings['hit'], 50):>9.2f} {percentile(timings['hit'], 99):>9.2f} "
+          f"{percentile(timings['miss'], 50):>9.2f} {percentile(timings['miss'], 99):>9.2f} {python_ms:>11.1f} "
+          f"{memory_mb:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20, help="distinct worksheets")
+    parser.add_argument("--variants", type=int, default=3, help="copies of each worksheet per kind")
+    parser.add_argument("--students", type=int, default=90)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    sheets = quality(args.pages, args.variants)
+    print()
+    classroom(3, args.students)
+
+    print(f"\nlookup (ms), max distance {IMAGE_CACHE_MAX_DISTANCE}")
+    print(f"{'stored':>10} {'hit p50':>9} {'hit p99':>9} {'miss p50':>9} {'miss p99':>9} {'python scan':>11} {'index MB':>8}")
+    for size in args.sizes:
+        lookup_speed(size, args.queries)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Image preprocessing benchmark.
+
+Generates synthetic phone-style JPEG photos at several resolutions and
+compares the original /api/chat/image handling (decode, lossless PNG,
+base64) with image_pipeline.preprocess_image for JPEG and WebP output.
+Reports per-image latency and base64 bytes sent to the AI service.
+
+    python benchmarks/bench_image_pipeline.py --sizes 1 3 12 24 --repeat 3
+"""
+
+import argparse
+import base64
+import io
+import time
+
+import _harness  # noqa: F401  (puts the backend on sys.path)
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from image_pipeline import preprocess_image  # noqa: E402
+
+
+def make_photo(megapixels: float) -> bytes:
+    """A 4:3 photo-like JPEG (gradient + sensor noise + text-like lines) with an EXIF rotation tag"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    paper = Image.blend(gradient, noise, 0.35)
+    draw = ImageDraw.Draw(paper)
+    for row in range(height // 12, height, max(height // 30, 8)):
+        draw.line([(width // 10, row), (width * 9 // 10, row)], fill=30, width=max(height // 300, 1))
+    image = Image.merge("RGB", (paper, gradient, noise))
+
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees, like a portrait phone photo
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=90, exif=exif)
+    return buffered.getvalue()
+
+
+def legacy(data: bytes) -> int:
+    image = Image.open(io.BytesIO(data))
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return len(base64.b64encode(buffered.getvalue()))
+
+
+def timed(fn, data: bytes, repeat: int):
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = fn(data)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 3, 12, 24], help="megapixels")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-edge", type=int, default=1600)
+    args = parser.parse_args()
+
+    variants = [
+        ("legacy PNG", legacy),
+        ("JPEG q80", lambda d: len(preprocess_image(d, max_edge=args.max_edge, output_format="JPEG").base64)),
+        ("WebP q80", lambda d: len(preprocess_image(d, max_edge=args.max_edge, output_format="WEBP").base64)),
+        ("JPEG gray", lambda d: len(preprocess_image(d, max_edge=args.max_edge, output_format="JPEG", grayscale=True).base64)),
+    ]
+
+    print(f"{'input':>14} {'variant':>10} {'ms':>9} {'base64 KB out':>14}")
+    for megapixels in args.sizes:
+        photo = make_photo(megapixels)
+        label = f"{megapixels:g}MP/{len(photo) // 1024}KB"
+        for name, fn in variants:
+            ms, size = timed(fn, photo, args.repeat)
+            print(f"{label:>14} {name:>10} {ms:>9.1f} {size / 1024:>14.1f}")
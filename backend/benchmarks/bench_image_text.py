@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Image text path benchmark (needs pytesseract and the tesseract binary).
+
+Synthetic maths worksheets are uploaded as clean scans, re-sent copies and
+re-photos. For each kind it reports the time per stage in the image worker
+(preprocessing without OCR, OCR) and subject detection on the text, the word
+recall of the OCR against the printed text, the mean confidence, and the
+share of uploads that take the text path instead of image analysis.
+
+    python benchmarks/bench_image_text.py --pages 20
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+from _harness import percentile  # puts the backend on sys.path
+
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from ai_service import detect_subject  # noqa: E402
+from bench_image_dedup import encode, rephotographed, resent  # noqa: E402
+from image_pipeline import preprocess_image  # noqa: E402
+from image_text import OCR_MIN_CONFIDENCE, OCR_MIN_WORDS, ocr_available, vision_reason  # noqa: E402
+
+PROMPTS = ["Add the numbers and show your work", "Subtract and check your answer", "Multiply then divide the total"]
+
+
+def make_worksheet(seed: int):
+    """A printed maths worksheet and the words printed on it"""
+    rng = random.Random(seed)
+    page = Image.new("L", (1240, 1754), 255)
+    draw = ImageDraw.Draw(page)
+    lines = [f"Grade 4 Maths Worksheet {rng.randint(1, 20)}", rng.choice(PROMPTS)]
+    draw.text((80, 60), lines[0], fill=0, font=ImageFont.load_default(size=44))
+    draw.text((80, 130), lines[1], fill=0, font=ImageFont.load_default(size=32))
+    font = ImageFont.load_default(size=30)
+    for number in range(10):
+        line = f"{number + 1}. {rng.randint(10, 999)} {rng.choice('+-')} {rng.randint(2, 99)} ="
+        draw.text((80, 240 + number * 130), line, fill=0, font=font)
+        lines.append(line)
+    return page.convert("RGB"), lines
+
+
+def words_of(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+
+def recall(expected: list, text: str) -> float:
+    """Share of the printed words that were read"""
+    read = words_of(text)
+    found = 0
+    for word in words_of(" ".join(expected)):
+        if word in read:
+            read.remove(word)
+            found += 1
+    return found / max(1, len(words_of(" ".join(expected))))
+
+
+def run(kind: str, sheets: list, variants: int):
+    rng = random.Random(kind)
+    preprocess_ms, ocr_ms, subject_ms, recalls, confidences, paths = [], [], [], [], [], []
+    for page, expected in sheets:
+        for _ in range(variants):
+            if kind == "scan":
+                data = encode(page, 90)
+            elif kind == "re-sent":
+                data = resent(page, rng)
+            else:
+                data = rephotographed(page, rng)
+
+            started = time.perf_counter()
+            prepared = preprocess_image(data, ocr=True)
+            elapsed = time.perf_counter() - started
+            extracted = prepared.text
+            if extracted is None:
+                paths.append("ocr_error")
+                continue
+            preprocess_ms.append((elapsed - extracted.seconds) * 1000)
+            ocr_ms.append(extracted.seconds * 1000)
+
+            started = time.perf_counter()
+            detect_subject(extracted.text)
+            subject_ms.append((time.perf_counter() - started) * 1000)
+
+            recalls.append(recall(expected, extracted.text))
+            confidences.append(extracted.confidence)
+            paths.append(vision_reason(extracted) or "text")
+
+    text_share = paths.count("text") / len(paths)
+    vision = ", ".join(f"{reason} {paths.count(reason)}" for reason in sorted(set(paths) - {"text"})) or "-"
+    print(f"{kind:<16} {percentile(preprocess_ms, 50):>10.1f} {percentile(ocr_ms, 50):>8.0f} {percentile(ocr_ms, 99):>8.0f} "
+          f"{percentile(subject_ms, 50):>9.3f} {sum(recalls) / len(recalls):>7.1%} {sum(confidences) / len(confidences):>6.1f} "
+          f"{text_share:>10.1%}  {vision}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20, help="distinct worksheets")
+    parser.add_argument("--variants", type=int, default=2, help="uploads of each worksheet per kind")
+    args = parser.parse_args()
+
+    if not ocr_available():
+        print("OCR is unavailable: install pytesseract and the tesseract binary (apt-get install tesseract-ocr), "
+              "and leave OCR_ENABLED on")
+        sys.exit(1)
+
+    sheets = [make_worksheet(seed) for seed in range(args.pages)]
+    print(f"{args.pages} worksheets x {args.variants} uploads per kind; text path at >= {OCR_MIN_WORDS} words "
+          f"and confidence >= {OCR_MIN_CONFIDENCE:g}")
+    print(f"{'upload':<16} {'prep p50ms':>10} {'ocr p50':>8} {'ocr p99':>8} {'subj p50':>9} {'recall':>7} {'conf':>6} "
+          f"{'text path':>10}  vision path")
+    for kind in ("scan", "re-sent", "re-photographed"):
+        run(kind, sheets, args.variants)
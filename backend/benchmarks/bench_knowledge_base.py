@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Knowledge base benchmark.
+
+1. Answer quality on the bundled index (training data + curated Q&A):
+   paraphrased, misspelt and unrelated questions, BM25 alone and with the
+   trigram vectors. Reported: top-1 accuracy, direct answers (and wrong
+   ones, which should be 0), fallback examples and examples shown for
+   unrelated questions.
+2. Scale: synthetic corpora of --sizes documents are built, saved and
+   memory-mapped back. Reported: build time, size on disk, open time,
+   query latency p50/p99 for stored and unseen questions (BM25 alone and
+   with vectors), and how often a stored question finds its own document.
+
+    python benchmarks/bench_knowledge_base.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from _harness import percentile  # puts the backend on sys.path
+
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+from ai_service import SUBJECT_TRAINING_DATA  # noqa: E402
+from knowledge_base import (BUNDLED_CORPUS, KNOWLEDGE_BASE_ANSWER_CONFIDENCE, KNOWLEDGE_BASE_EXAMPLE_CONFIDENCE,  # noqa: E402
+                            KNOWLEDGE_BASE_VECTOR_DIM, KnowledgeBase, load_corpus, training_documents)
+
+# (question, stored question it should match, or None when nothing stored fits)
+PROBES = [
+    ("Who was Nelson Mandela?", "Who was Nelson Mandela?"),
+    ("tell me about nelson mandela", "Who was Nelson Mandela?"),
+    ("who was nelson mandella", "Who was Nelson Mandela?"),
+    ("when did apartheid end", "When did apartheid end in South Africa?"),
+    ("Why is the sky blue?", "Why is the sky blue?"),
+    ("why is the sky bleu", "Why is the sky blue?"),
+    ("what is the capital of south africa", "What is the capital city of South Africa?"),
+    ("what is the captial of south africa", "What is the capital city of South Africa?"),
+    ("How does photosynthesis work?", "How does photosynthesis work?"),
+    ("explain photosynthesis", "How does photosynthesis work?"),
+    ("what is 25 + 17", "What is 25 + 17?"),
+    ("what is 25 + 18", "What is 25 + 17?"),
+    ("solve 3x + 2 = 11", "Solve for x: 2x + 5 = 13"),
+    ("what causes an earthquake", "What causes earthquakes?"),
+    ("why did ww1 start", "Why did World War 1 start?"),
+    ("when did world war two end", "When did World War 2 start and end?"),
+    ("there their theyre difference", "What's the difference between there, their, and they're?"),
+    ("difference between a metaphor and a simile", "What is the difference between a simile and a metaphor?"),
+    ("metaphers and similies", "What is the difference between a simile and a metaphor?"),
+    ("what is a verb", "What is a noun and what is a verb?"),
+    ("how do you add fractions", "How do I add fractions with different denominators?"),
+    ("area of a rectangle", "How do I find the area of a rectangle?"),
+    ("how do I calculate 15% of 80", "How do I work out a percentage of a number?"),
+    ("what is the longest river", "What is the longest river in the world?"),
+    ("name the seven continents", "How many continents are there?"),
+    ("latitude vs longitude", "What is the difference between latitude and longitude?"),
+    ("what are solids liquids and gases", "What are the three states of matter?"),
+    ("explain the water cycle", "How does the water cycle work?"),
+    ("why did the egyptians build pyramids", "Why were the pyramids of Egypt built?"),
+    ("write me a poem about cats", None),
+    ("how many legs does a spider have", None),
+    ("what is the capital of france", None),
+    ("who invented the telephone", None),
+    ("what is 7 x 8", None),
+]
+# Questions close to a stored one that it doesn't answer: a direct answer to them is wrong
+NOT_ANSWERED_BY = [
+    ("Why did World War 2 start?", "When did World War 2 start and end?"),
+    ("what is the capital city of south africa's neighbour", "What is the capital city of South Africa?"),
+    ("how did apartheid end", "When did apartheid end in South Africa?"),
+    ("how do I find the area of a triangle", "How do I find the area of a rectangle?"),
+]
+
+
+def quality(knowledge_base: KnowledgeBase, label: str):
+    correct = answered = wrong_answers = examples = unrelated_examples = 0
+    for question, expected in PROBES:
+        matches = knowledge_base.search(question, limit=1)
+        match = matches[0] if matches else None
+        if match and expected and match.document.question == expected:
+            correct += 1
+        stored = knowledge_base.answer(question, None)
+        if stored is not None:
+            answered += 1
+            wrong_answers += match is None or match.document.question != expected
+        if match and match.confidence >= KNOWLEDGE_BASE_EXAMPLE_CONFIDENCE:
+            examples += 1
+            unrelated_examples += expected is None
+    for question, _ in NOT_ANSWERED_BY:
+        if knowledge_base.answer(question, None) is not None:
+            answered += 1
+            wrong_answers += 1
+    related = sum(expected is not None for _, expected in PROBES)
+    print(f"{label:<18} {correct / related:>8.0%} {answered:>9} {wrong_answers:>6} {examples:>9} {unrelated_examples:>10}")
+
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "su", "da", "gi", "ho", "be", "fa", "wu"]
+
+
+def synthetic_corpus(size: int, vocabulary: int = 50_000):
+    """Questions and answers over a Zipf-distributed vocabulary of made-up words"""
+    rng = random.Random(size)
+    words = sorted({"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(vocabulary)})
+    rng.shuffle(words)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    stems = ["What is", "How does", "Why do", "Explain", "When did", "Describe"]
+    documents = []
+    for _ in range(size):
+        drawn = rng.choices(words, weights=weights, k=70)
+        question = f"{rng.choice(stems)} {' '.join(drawn[:rng.randint(3, 7)])}?"
+        documents.append((question, " ".join(drawn[7:])))
+    return documents
+
+
+def scale(size: int, queries: int, vector_dim: int):
+    from knowledge_base import KnowledgeDocument
+
+    corpus = synthetic_corpus(size)
+    documents = [KnowledgeDocument(question, answer, None, "synthetic") for question, answer in corpus]
+    directory = os.path.join(tempfile.mkdtemp(prefix="studybuddy-kb"), "index")
+    try:
+        started = time.perf_counter()
+        KnowledgeBase.build(documents, vector_dim=vector_dim).save(directory)
+        build_seconds = time.perf_counter() - started
+        disk_mb = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1024 / 1024
+
+        started = time.perf_counter()
+        knowledge_base = KnowledgeBase.open(directory)
+        open_ms = (time.perf_counter() - started) * 1000
+
+        rng = random.Random(1)
+        stored = [question for question, _ in rng.sample(corpus, min(queries, size))]
+        unseen = [question for question, _ in synthetic_corpus(queries)]
+
+        found = []
+
+        def timed(batch, vectors):
+            knowledge_base._vectors = vectors
+            samples = []
+            for question in batch:
+                began = time.perf_counter()
+                matches = knowledge_base.search(question)
+                samples.append((time.perf_counter() - began) * 1000)
+                if batch is stored and vectors is None:
+                    found.append(bool(matches) and matches[0].document.question == question)
+            return samples
+
+        vectors = knowledge_base._vectors
+        results = [timed(stored, None), timed(unseen, None), timed(unseen, vectors)]
+        print(f"{size:>9,} {build_seconds:>8.1f} {disk_mb:>8.1f} {open_ms:>8.1f} "
+              + " ".join(f"{percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}" for samples in results)
+              + f" {sum(found) / len(found):>7.1%}")
+    finally:
+        shutil.rmtree(os.path.dirname(directory), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--vector-dim", type=int, default=KNOWLEDGE_BASE_VECTOR_DIM)
+    args = parser.parse_args()
+
+    bundled = training_documents(SUBJECT_TRAINING_DATA) + list(load_corpus(BUNDLED_CORPUS))
+    print(f"{len(PROBES) + len(NOT_ANSWERED_BY)} probe questions over {len(bundled)} worked examples; direct answers at confidence >= "
+          f"{KNOWLEDGE_BASE_ANSWER_CONFIDENCE:g}, examples at >= {KNOWLEDGE_BASE_EXAMPLE_CONFIDENCE:g}")
+    print(f"{'index':<18} {'top-1':>8} {'answered':>9} {'wrong':>6} {'examples':>9} {'unrelated':>10}")
+    quality(KnowledgeBase.build(bundled, vector_dim=0), "BM25")
+    quality(KnowledgeBase.build(bundled, vector_dim=args.vector_dim), f"BM25 + vectors {args.vector_dim}")
+
+    print(f"\nsynthetic corpora, {args.queries} queries, vectors {args.vector_dim} (latency in ms)")
+    print(f"{'documents':>9} {'build s':>8} {'disk MB':>8} {'open ms':>8} {'stored p50':>8} {'p99':>8} "
+          f"{'unseen p50':>8} {'p99':>8} {'+vec p50':>8} {'p99':>8} {'found':>7}")
+    for size in args.sizes:
+        scale(size, args.queries, args.vector_dim)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Metrics overhead micro-benchmark.
+
+Cost of the hot-path operations (Counter.inc, Histogram.observe, a stage
+timer block), of MetricsMiddleware around a trivial ASGI app, and of
+rendering a scrape.
+
+    python benchmarks/bench_metrics.py --rounds 200000
+"""
+
+import argparse
+import asyncio
+import time
+
+import _harness  # noqa: F401  (puts the backend on sys.path)
+
+from metrics import Counter, Histogram, MetricsMiddleware, render_metrics, stage
+
+
+def ns_per_call(fn, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = time.perf_counter() - started
+    baseline = time.perf_counter()
+    for _ in range(rounds):
+        pass
+    return (elapsed - (time.perf_counter() - baseline)) / rounds * 1e9
+
+
+async def asgi_ns_per_request(app, rounds: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / rounds * 1e9
+
+
+async def hello(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200000)
+    args = parser.parse_args()
+
+    counter = Counter("bench_events_total", "benchmark counter", ("kind",)).labels("a")
+    histogram = Histogram("bench_duration_seconds", "benchmark histogram", ("kind",)).labels("a")
+    timer = stage("bench")
+
+    def timed_block():
+        with timer.time():
+            pass
+
+    print(f"{'Counter.inc()':<28} {ns_per_call(counter.inc, args.rounds):>8.0f} ns")
+    print(f"{'Histogram.observe()':<28} {ns_per_call(lambda: histogram.observe(0.003), args.rounds):>8.0f} ns")
+    print(f"{'with stage(...).time()':<28} {ns_per_call(timed_block, args.rounds):>8.0f} ns")
+
+    rounds = args.rounds // 10
+    bare = asyncio.run(asgi_ns_per_request(hello, rounds))
+    wrapped = asyncio.run(asgi_ns_per_request(MetricsMiddleware(hello), rounds))
+    print(f"{'MetricsMiddleware':<28} {wrapped - bare:>8.0f} ns per request ({bare:.0f} -> {wrapped:.0f})")
+
+    started = time.perf_counter()
+    text = render_metrics()
+    print(f"{'render_metrics()':<28} {(time.perf_counter() - started) * 1e3:>8.2f} ms, {len(text)} bytes")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Model router benchmark.
+
+1. Routes for the subject-detection corpus: which questions the local
+   solver takes, which count as complex.
+2. Local solver correctness and speed on seeded random arithmetic and
+   linear equations, checked against exact Fraction arithmetic (exits 1
+   on any wrong answer).
+3. A mixed workload through process_homework_question against the stub
+   LLM server: latency and estimated cost per route.
+
+    python benchmarks/bench_model_router.py --problems 5000 --questions 200 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from fractions import Fraction
+
+from _harness import percentile, start_server
+
+STUB_PORT = 9151
+
+os.environ.update(
+    OPENAI_API_KEY="stub",
+    OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+    ANSWER_CACHE_ENABLED="False",
+)
+
+from ai_service import detect_subject_advanced, model_router, process_homework_question  # noqa: E402
+from bench_subject_detection import CORPUS  # noqa: E402
+from local_solver import solve  # noqa: E402
+from stub_llm_server import create_stub_app  # noqa: E402
+
+
+def random_problem(rng: random.Random):
+    """A question and its exact answer"""
+    a, b, c, d = (rng.randint(1, 999) for _ in range(4))
+    kind = rng.randrange(7)
+    if kind == 0:
+        return f"What is {a} + {b}?", Fraction(a + b)
+    if kind == 1:
+        return f"What is {a} - {b}?", Fraction(a - b)
+    if kind == 2:
+        return f"Calculate {a} × {b % 99 + 1}", Fraction(a * (b % 99 + 1))
+    if kind == 3:
+        return f"{a} ÷ {b % 12 + 1}", Fraction(a, b % 12 + 1)
+    if kind == 4:
+        return f"({a} + {b}) × {c % 9 + 2} - {d}", Fraction((a + b) * (c % 9 + 2) - d)
+    x, k = rng.randint(-50, 50), rng.randint(2, 12)
+    if kind == 5:
+        # kx + a = k*x + a
+        return f"Solve for x: {k}x + {a} = {k * x + a}", Fraction(x)
+    # k(x + a) = (k - 1)x + d has x = d - ka
+    return f"{k}(x + {a}) = {'' if k == 2 else k - 1}x + {x + k * a}", Fraction(x)
+
+
+def answer_value(answer: str) -> Fraction:
+    return Fraction(answer.split(" = ")[-1].split(" (")[0])
+
+
+def check_solver(problems: int, seed: int) -> int:
+    rng = random.Random(seed)
+    cases = [random_problem(rng) for _ in range(problems)]
+    started = time.perf_counter()
+    solutions = [solve(question) for question, _ in cases]
+    per_solve = (time.perf_counter() - started) / problems * 1e6
+
+    wrong = 0
+    for (question, expected), solution in zip(cases, solutions):
+        if solution is None or answer_value(solution.answer) != expected:
+            wrong += 1
+            if wrong <= 5:
+                print(f"  WRONG: {question} -> {solution and solution.answer} (expected {expected})")
+    print(f"\nlocal solver: {problems} problems, {per_solve:.1f} µs per solve, {wrong} wrong or unsolved")
+    return wrong
+
+
+async def mixed_workload(questions: int, concurrency: int, seed: int):
+    rng = random.Random(seed)
+    # Roughly the share of quick sums and equations in real traffic
+    workload = [random_problem(rng)[0] if rng.random() < 0.3 else f"{rng.choice(CORPUS)} (#{i})"
+                for i in range(questions)]
+    pending = iter(workload)
+    latencies = {}
+
+    async def worker():
+        for question in pending:
+            route = model_router.route(question, detect_subject_advanced(question)).name
+            started = time.perf_counter()
+            await process_homework_question(question)
+            latencies.setdefault(route, []).append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats = model_router.stats()
+    print(f"\n{'route':>10} {'model':>14} {'questions':>10} {'p50 ms':>9} {'p95 ms':>9} {'cost USD':>10}")
+    for name, route in stats["routes"].items():
+        samples = latencies.get(name, [])
+        print(f"{name:>10} {route['model']:>14} {len(samples):>10} {percentile(samples, 50) * 1000:>9.2f} "
+              f"{percentile(samples, 95) * 1000:>9.2f} {route['cost_usd']:>10.5f}")
+    print(f"estimated saving from local answers: ${stats['est_saved_usd']:.5f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--problems", type=int, default=5000)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM latency in seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'route':>10}  question")
+    for question in CORPUS:
+        route = model_router.route(question, detect_subject_advanced(question))
+        print(f"{route.name:>10}  {question[:70]}")
+
+    wrong = check_solver(args.problems, args.seed)
+
+    start_server(create_stub_app(args.latency), STUB_PORT)
+    asyncio.run(mixed_workload(args.questions, args.concurrency, args.seed))
+    sys.exit(1 if wrong else 0)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Prompt builder micro-benchmark.
+
+Compares the precomputed PromptBuilder against the original per-call
+prompt assembly (rebuild the subject-context dict and format the system
+prompt every time): time per prompt, input tokens per subject with 0-2
+few-shot examples, and the max_tokens each corpus question is given
+instead of a flat 1000. A pasted 20k-character passage shows the input
+budget at work.
+
+    python benchmarks/bench_prompt_builder.py --rounds 2000
+"""
+
+import argparse
+import os
+import time
+
+import _harness  # noqa: F401  (puts the backend on sys.path)
+
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+from ai_service import SUBJECT_CONTEXT, SUBJECT_TRAINING_DATA, detect_subject_advanced, prompt_builder  # noqa: E402
+from bench_subject_detection import CORPUS  # noqa: E402
+from prompt_builder import TOKENIZER, PromptBuilder, count_tokens  # noqa: E402
+
+DEFAULT_CONTEXT = "Provide educational support appropriate for the student's level."
+
+
+def original_build_chat_messages(question, subject):
+    """The assembly ai_service did on every call before PromptBuilder"""
+    training_data = SUBJECT_TRAINING_DATA.get(subject, SUBJECT_TRAINING_DATA["math"])
+    system_prompt = training_data["system_prompt"]
+    subject_context = {
+        "math": "Focus on step-by-step mathematical problem solving with clear calculations.",
+        "science": "Emphasize scientific understanding, experiments, and real-world applications.",
+        "english": "Help with language, grammar, writing, and reading comprehension.",
+        "history": "Provide historical context, timelines, and engaging storytelling.",
+        "geography": "Explain geographical concepts with visual descriptions and real-world examples."
+    }
+    context = subject_context.get(subject, DEFAULT_CONTEXT)
+    return [
+        {
+            "role": "system",
+            "content": f"{system_prompt}\n\nAdditional context: {context}\n\nAlways format your response with clear "
+                       "sections, emojis, and practical examples. Include specific steps and encourage further learning."
+        },
+        {"role": "user", "content": question}
+    ]
+
+
+def time_per_call(build, questions, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for question, subject in questions:
+            build(question, subject)
+    return (time.perf_counter() - started) / (rounds * len(questions)) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    questions = [(question, detect_subject_advanced(question)) for question in CORPUS]
+    print(f"tokenizer: {TOKENIZER}, {len(questions)} questions")
+
+    # Time only the assembly; the original sent no token counts, so don't charge it for ours
+    original = time_per_call(original_build_chat_messages, questions, args.rounds)
+    precomputed = time_per_call(prompt_builder.build, questions, args.rounds)
+    print(f"\nper prompt: original {original:.2f} µs, precomputed + token count {precomputed:.2f} µs")
+
+    print(f"\n{'subject':>10} {'system':>8} {'+1 example':>11} {'+2 examples':>12}")
+    builders = [PromptBuilder(SUBJECT_TRAINING_DATA, SUBJECT_CONTEXT, "math", DEFAULT_CONTEXT, few_shot=n)
+                for n in (0, 1, 2)]
+    for subject in (*SUBJECT_TRAINING_DATA, None):
+        sizes = [builder.build("", subject).input_tokens for builder in builders]
+        print(f"{str(subject):>10} {sizes[0]:>8} {sizes[1]:>11} {sizes[2]:>12}")
+
+    print(f"\n{'max_tokens':>10}  question")
+    total = 0
+    for question, subject in questions:
+        prompt = prompt_builder.build(question, subject)
+        total += prompt.max_tokens
+        print(f"{prompt.max_tokens:>10}  [{subject}] {question[:60]}")
+    print(f"mean max_tokens {total / len(questions):.0f} (was 1000 for every question)")
+
+    passage = "The learners read the passage about the Great Trek and answered questions. " * 270
+    prompt = prompt_builder.build(passage + "\nWhy did the Voortrekkers leave the Cape?", "history")
+    kept = prompt.messages[-1]["content"]
+    print(f"\n{len(passage)}-char passage ({count_tokens(passage)} tokens): prompt {prompt.input_tokens} tokens "
+          f"(budget {prompt_builder.max_input_tokens}), question kept: {kept.endswith('Cape?')}")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Subject detection micro-benchmark.
+
+Compares the precompiled single-pass classifier in ai_service against the
+original per-call keyword scan on a corpus of realistic homework questions,
+and lists the questions where the two disagree.
+
+    python benchmarks/bench_subject_detection.py --rounds 2000
+"""
+
+import argparse
+import os
+import time
+
+import _harness  # noqa: F401  (puts the backend on sys.path)
+
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+
+from ai_service import SUBJECT_KEYWORDS, detect_subject_advanced  # noqa: E402
+
+CORPUS = [
+    "What is 25 + 17?",
+    "Solve for x: 2x + 5 = 13",
+    "How do I add fractions with different denominators?",
+    "Can you help me multiply 234 by 12?",
+    "What is the area of a triangle with base 6cm and height 4cm?",
+    "How do I calculate the average of 4, 8 and 15?",
+    "What is 15% of R250?",
+    "Explain the Pythagorean theorem with an example",
+    "How does photosynthesis work?",
+    "What is the difference between an atom and a molecule?",
+    "Why do objects fall because of gravity?",
+    "What happens in the digestive system after we eat?",
+    "How do plants and animals depend on each other in an ecosystem?",
+    "What is the pH of lemon juice and is it an acid or a base?",
+    "Explain how electricity flows in a circuit",
+    "What's the difference between there, their, and they're?",
+    "How do I write a persuasive essay about school uniforms?",
+    "What is a metaphor? Give me three examples",
+    "Can you check the grammar in this sentence: me and him goes to school",
+    "What is the theme of the poem 'Still I Rise'?",
+    "Help me identify the verb and adjective in this sentence",
+    "How should I structure a paragraph for my composition?",
+    "Why did World War 1 start?",
+    "Who was Nelson Mandela and why is he important?",
+    "What was apartheid and when did it end?",
+    "Explain the causes of the French Revolution",
+    "What was daily life like in ancient Egypt?",
+    "Which king ruled the Zulu empire in the 1820s?",
+    "What causes earthquakes?",
+    "Name the capital city of each South African province",
+    "How does erosion shape mountains and rivers?",
+    "What is the climate like in the Karoo desert?",
+    "Explain latitude and longitude on a map",
+    "Why is the population of Gauteng growing so fast?",
+    "Please write my home address on the envelope",
+    "Generate a list of revision tips for my exams",
+    "My teacher said to operate carefully in the lab",
+    "What should I pack for the school camp?",
+]
+
+
+def detect_subject_legacy(question: str):
+    """The original implementation: rebuilds nothing precompiled, one substring scan per keyword"""
+    question_lower = question.lower()
+    subject_keywords = {subject: list(keywords) for subject, keywords in SUBJECT_KEYWORDS.items()}
+    subject_scores = {}
+    for subject, keywords in subject_keywords.items():
+        score = sum(1 for keyword in keywords if keyword in question_lower)
+        if score > 0:
+            subject_scores[subject] = score
+    if subject_scores:
+        return max(subject_scores, key=subject_scores.get)
+    return None
+
+
+def time_per_call(fn, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for question in CORPUS:
+            fn(question)
+    return (time.perf_counter() - started) / (rounds * len(CORPUS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    uncached = detect_subject_advanced.__wrapped__
+    legacy_us = time_per_call(detect_subject_legacy, args.rounds) * 1e6
+    compiled_us = time_per_call(uncached, args.rounds) * 1e6
+    detect_subject_advanced.cache_clear()
+    memoized_us = time_per_call(detect_subject_advanced, args.rounds) * 1e6
+
+    print(f"{len(CORPUS)} questions x {args.rounds} rounds")
+    print(f"{'legacy substring scan':<28} {legacy_us:>8.2f} us/call")
+    print(f"{'precompiled single pass':<28} {compiled_us:>8.2f} us/call  ({legacy_us / compiled_us:.1f}x)")
+    print(f"{'memoized (repeat call)':<28} {memoized_us:>8.2f} us/call  ({legacy_us / memoized_us:.1f}x)")
+
+    print("\nQuestions where the classifiers disagree:")
+    for question in CORPUS:
+        old, new = detect_subject_legacy(question), uncached(question)
+        if old != new:
+            print(f"  {question!r}: {old} -> {new}")
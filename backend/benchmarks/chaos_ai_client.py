@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Resilience checks for the AI client against the fault-injecting stub.
+
+Runs process_homework_question through a series of upstream conditions set
+on the stub at runtime and checks how the client copes:
+
+    healthy     every question answered, no fallbacks
+    flaky       30% of requests fail with 503; jittered retries absorb most
+    slow tail   3% of requests take 1.5 s; p99 without and with hedging
+                (hedges fire at the p95, so the slow share must stay under 5%)
+    outage      every request fails; the circuit opens and fallbacks are instant
+    recovery    after the cooldown one probe closes the circuit, then no fallbacks
+    hang        upstream never answers; every question ends by its deadline
+
+Finally a /api/chat call during an outage must return a fallback without
+charging a credit. Exits 1 if any check fails.
+
+    python benchmarks/chaos_ai_client.py --questions 200 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from _harness import percentile, start_server, use_temp_database
+
+STUB_PORT = 9141
+API_PORT = 9142
+
+use_temp_database("studybuddy-chaos")
+os.environ.update(
+    OPENAI_API_KEY="stub",
+    OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+    ANSWER_CACHE_ENABLED="False",
+    AI_REQUEST_TIMEOUT="2",
+    AI_DEADLINE_SECONDS="4",
+    AI_MAX_RETRIES="2",
+    AI_BREAKER_COOLDOWN_SECONDS="2",
+    AI_HEDGE_MIN_MS="100",
+)
+
+import httpx  # noqa: E402
+
+from ai_service import ai_upstream, process_homework_question  # noqa: E402
+from stub_llm_server import DEFAULT_FAULTS, create_stub_app  # noqa: E402
+
+stub = create_stub_app(0.1)
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+        print(f"  FAILED: {message}")
+
+
+async def run_scenario(name: str, questions: int, concurrency: int, **faults):
+    async with httpx.AsyncClient() as client:
+        await client.post(f"http://127.0.0.1:{STUB_PORT}/faults", json={**DEFAULT_FAULTS, **faults})
+    before = dict(ai_upstream._counters)
+    requests_before = stub.state.requests
+
+    latencies, fallbacks = [], 0
+    pending = iter(range(questions))
+
+    async def worker():
+        nonlocal fallbacks
+        for i in pending:
+            started = time.perf_counter()
+            # Unique questions: nothing is cached or coalesced
+            answer = await process_homework_question(f"{name} question {i}: what is {i} + 17?", "math")
+            latencies.append(time.perf_counter() - started)
+            fallbacks += answer.fallback
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    delta = {key: ai_upstream._counters[key] - before.get(key, 0) for key in ("retries", "hedged", "hedge_wins")}
+    result = {
+        "fallbacks": fallbacks,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "max": max(latencies) * 1000,
+        "upstream": stub.state.requests - requests_before,
+        **delta,
+    }
+    print(f"{name:>16} {questions - fallbacks:>5} {fallbacks:>9} {result['p50']:>8.0f} {result['p99']:>8.0f} "
+          f"{result['upstream']:>9} {delta['retries']:>8} {delta['hedged']:>7} {ai_upstream.breaker.state:>10}")
+    return result
+
+
+async def check_fallback_is_free():
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{API_PORT}", timeout=30) as client:
+        await client.post(f"http://127.0.0.1:{STUB_PORT}/faults", json={**DEFAULT_FAULTS, "down": True})
+        response = await client.post(
+            "/api/auth/register",
+            json={"email": "chaos@example.com", "full_name": "Chaos Test", "password": "chaos-password"},
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        before = (await client.get("/api/credits", headers=headers)).json()["credits"]
+        response = (await client.post("/api/chat", json={"message": "What is 6 x 7?"}, headers=headers)).json()
+        after = (await client.get("/api/credits", headers=headers)).json()["credits"]
+        print(f"\n/api/chat during outage: fallback={response['fallback']}, credits {before} -> {after}")
+        check(response["fallback"] and after == before, "fallback answer was charged")
+
+
+async def main(args):
+    q, c = args.questions, args.concurrency
+    print(f"{'scenario':>16} {'ok':>5} {'fallback':>9} {'p50 ms':>8} {'p99 ms':>8} {'upstream':>9} "
+          f"{'retries':>8} {'hedged':>7} {'circuit':>10}")
+
+    healthy = await run_scenario("healthy", q, c)
+    check(healthy["fallbacks"] == 0, "healthy upstream produced fallbacks")
+
+    flaky = await run_scenario("flaky 30% 503", q, c, error_rate=0.3)
+    check(flaky["retries"] > 0, "no retries under 30% errors")
+    check(flaky["fallbacks"] < q * 0.1, "retries did not absorb a 30% error rate")
+
+    ai_upstream.hedge_enabled = False
+    slow = await run_scenario("slow 3%", q, c, slow_rate=0.03, slow_latency=1.5)
+    ai_upstream.hedge_enabled = True
+    hedged = await run_scenario("slow 3% +hedge", q, c, slow_rate=0.03, slow_latency=1.5)
+    check(hedged["hedged"] > 0 and hedged["p99"] < slow["p99"], "hedging did not cut the slow tail")
+    ai_upstream.hedge_enabled = False
+
+    outage = await run_scenario("outage", q, c, down=True)
+    check(outage["fallbacks"] == q, "outage answered questions it could not have")
+    check(ai_upstream.breaker.state == "open", "circuit did not open during the outage")
+    check(outage["upstream"] < q, "open circuit still sent every question upstream")
+
+    await asyncio.sleep(ai_upstream.breaker.cooldown_seconds)
+    probe = await run_scenario("probe", 1, 1)
+    check(probe["fallbacks"] == 0 and ai_upstream.breaker.state == "closed", "probe did not close the circuit")
+    recovery = await run_scenario("recovered", q, c)
+    check(recovery["fallbacks"] == 0, "fallbacks after the circuit closed")
+
+    hang = await run_scenario("hang", c * 2, c, hang=True)
+    check(hang["max"] <= (ai_upstream.deadline + 0.5) * 1000, "a question outlived its deadline")
+
+    await asyncio.sleep(ai_upstream.breaker.cooldown_seconds)
+    await check_fallback_is_free()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    import main as api
+
+    start_server(stub, STUB_PORT)
+    start_server(api.app, API_PORT)
+    asyncio.run(main(args))
+    print("\nall checks passed" if not failures else f"\n{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
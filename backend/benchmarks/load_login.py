@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Login throughput and its effect on chat latency.
+
+Runs the real API (uvicorn subprocess) against the stub LLM server once
+per PASSWORD_HASH_WORKERS setting (0 hashes on the event loop, as before
+the hashing pool). For each, one client asks chat questions back to back,
+first alone and then while --clients clients log in as fast as they can.
+Reported: logins per second, login p50/p99, and the chat p50/p99 without
+and with the login storm.
+
+Finally it stores a cheaper hash for one user (as if BCRYPT_ROUNDS had been
+raised since they registered), logs in and checks the stored hash was
+upgraded to the current cost. Exits 1 if that check or any login fails.
+
+    python benchmarks/load_login.py --workers 0 1 2 --clients 16 --seconds 5
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+from _harness import BACKEND_DIR, percentile, start_server, use_temp_database
+
+STUB_PORT = 9201
+API_PORT = 9202
+PASSWORD = "login-password"
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+        print(f"  FAILED: {message}")
+
+
+def spawn_api(database_url: str, workers: int, rounds: int) -> subprocess.Popen:
+    import httpx
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        OPENAI_API_KEY="stub",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+        ANSWER_CACHE_ENABLED="False",
+        RATE_LIMIT_ENABLED="False",
+        BCRYPT_ROUNDS=str(rounds),
+        PASSWORD_HASH_WORKERS=str(workers),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(API_PORT), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{API_PORT}/")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("API server did not start")
+
+
+async def chat_probe(client, headers: dict, stop: asyncio.Event, label: str) -> list:
+    latencies = []
+    i = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.post("/api/chat", headers=headers,
+                                     json={"message": f"{label}: why do leaves change colour? ({i})"})
+        latencies.append((time.perf_counter() - started) * 1000)
+        check(response.status_code == 200, f"chat returned {response.status_code}")
+        i += 1
+    return latencies
+
+
+async def drive(args) -> tuple:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{API_PORT}", timeout=120,
+                                 limits=httpx.Limits(max_connections=args.clients + 10)) as client:
+        emails = [f"login{i}@example.com" for i in range(args.clients)]
+        for email in emails:
+            await client.post("/api/auth/register", json={"email": email, "full_name": "Login Test", "password": PASSWORD})
+        response = await client.post("/api/auth/register",
+                                     json={"email": "chat@example.com", "full_name": "Chat Test", "password": PASSWORD})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for _ in range(3):
+            await client.post("/api/credits/purchase", data={"amount": 100}, headers=headers)
+
+        stop = asyncio.Event()
+        probe = asyncio.create_task(chat_probe(client, headers, stop, "quiet"))
+        await asyncio.sleep(args.seconds)
+        stop.set()
+        quiet = await probe
+
+        login_ms = []
+
+        async def log_in(email: str):
+            while not stop.is_set():
+                started = time.perf_counter()
+                response = await client.post("/api/auth/login", data={"email": email, "password": PASSWORD})
+                login_ms.append((time.perf_counter() - started) * 1000)
+                check(response.status_code == 200, f"login returned {response.status_code}")
+
+        stop = asyncio.Event()
+        probe = asyncio.create_task(chat_probe(client, headers, stop, "storm"))
+        storm = [asyncio.create_task(log_in(email)) for email in emails]
+        started = time.perf_counter()
+        await asyncio.sleep(args.seconds)
+        stop.set()
+        busy = await probe
+        await asyncio.gather(*storm)
+        elapsed = time.perf_counter() - started
+    return quiet, busy, login_ms, elapsed
+
+
+async def login_once(email: str) -> int:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{API_PORT}", timeout=60) as client:
+        response = await client.post("/api/auth/login", data={"email": email, "password": PASSWORD})
+        return response.status_code
+
+
+def check_rehash(database_path: str, rounds: int):
+    from passlib.context import CryptContext
+
+    cheaper = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds - 2).hash(PASSWORD)
+    with sqlite3.connect(database_path) as connection:
+        connection.execute("UPDATE users SET hashed_password = ? WHERE email = 'login0@example.com'", (cheaper,))
+    status = asyncio.run(login_once("login0@example.com"))
+    with sqlite3.connect(database_path) as connection:
+        stored = connection.execute("SELECT hashed_password FROM users WHERE email = 'login0@example.com'").fetchone()[0]
+    print(f"\nrehash on login: {cheaper[:7]} -> {stored[:7]} (login {status})")
+    check(status == 200 and stored.startswith(f"$2b${rounds:02d}$"), "the cheaper hash was not upgraded on login")
+
+
+def run(workers: int, args, last: bool):
+    database_path = use_temp_database("studybuddy-login")
+    server = spawn_api(f"sqlite:///{database_path}", workers, args.rounds)
+    try:
+        quiet, busy, login_ms, elapsed = asyncio.run(drive(args))
+        label = "event loop" if workers <= 0 else f"{workers} thread(s)"
+        print(f"{label:>12} {len(login_ms) / elapsed:>9.1f} {percentile(login_ms, 50):>9.0f} {percentile(login_ms, 99):>9.0f} "
+              f"{percentile(quiet, 50):>10.1f} {percentile(quiet, 99):>10.1f} "
+              f"{percentile(busy, 50):>10.1f} {percentile(busy, 99):>10.1f}")
+        if last:
+            check_rehash(database_path, args.rounds)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2], help="PASSWORD_HASH_WORKERS settings")
+    parser.add_argument("--clients", type=int, default=16, help="clients logging in concurrently")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each phase")
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_ROUNDS")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub LLM latency in seconds")
+    args = parser.parse_args()
+
+    from stub_llm_server import create_stub_app
+
+    start_server(create_stub_app(args.latency), STUB_PORT)
+    print(f"{args.clients} clients logging in, bcrypt cost {args.rounds}, stub latency {args.latency}s, "
+          f"{os.cpu_count()} CPU(s)")
+    print(f"{'hashing':>12} {'logins/s':>9} {'login p50':>9} {'login p99':>9} "
+          f"{'chat p50':>10} {'chat p99':>10} {'+logins p50':>10} {'+logins p99':>10}")
+    for i, workers in enumerate(args.workers):
+        run(workers, args, last=i == len(args.workers) - 1)
+    print("\nall checks passed" if not failures else f"\n{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Rate limiting under a flood from one account.
+
+First the cost of the limiter itself: RateLimiter.check() and
+RateLimitMiddleware around a trivial ASGI app, anonymous and with a bearer
+token (the token check moves from current_user into the middleware, so it
+is not extra work for authenticated endpoints).
+
+Then one account fires --flood parallel /api/chat requests while a
+well-behaved student keeps asking questions, with limiting off and on.
+Reported: answered and 429 responses, upstream calls, latency of the
+429s as the client sees it (client and server share this process, so
+this includes queueing behind the whole flood), the well-behaved
+student's p50 and the wall time of the flood. Checks that the flood is
+cut to roughly the chat burst, every 429 carries Retry-After, rejected
+requests never reach the upstream, the other student is never limited
+and the limited flood finishes sooner. Exits 1 if any check fails.
+
+    python benchmarks/load_rate_limit.py --flood 200 --latency 0.5
+    python benchmarks/load_rate_limit.py --redis-url redis://127.0.0.1:6379/0   # shared buckets
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from _harness import percentile, start_server, use_temp_database
+
+STUB_PORT = 9191
+API_PORT = 9192
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+        print(f"  FAILED: {message}")
+
+
+async def asgi_us_per_request(app, scope: dict, rounds: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+async def hello(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def limiter_overhead(rounds: int):
+    from auth import create_access_token
+    from rate_limit import RateLimiter, RateLimitMiddleware, parse_limit
+
+    # Limits far above what the loop can use: every call is an allowed one
+    limits = {"default": parse_limit(f"{rounds * 10}/1")}
+    limiter = RateLimiter(limits, {})
+    started = time.perf_counter()
+    for i in range(rounds):
+        await limiter.check("default", f"uid:{i % 1000}", f"10.0.{i % 250}.1")
+    check_us = (time.perf_counter() - started) / rounds * 1e6
+
+    scope = {"type": "http", "method": "GET", "path": "/api/credits", "client": ("10.0.0.1", 5000), "headers": []}
+    token = create_access_token({"sub": "bench@example.com", "uid": 1})
+    with_token = {**scope, "headers": [(b"authorization", f"Bearer {token}".encode())]}
+    middleware = RateLimitMiddleware(hello, limiter)
+    bare = await asgi_us_per_request(hello, scope, rounds)
+    anonymous = await asgi_us_per_request(middleware, scope, rounds)
+    authenticated = await asgi_us_per_request(middleware, with_token, rounds)
+    print(f"{'RateLimiter.check()':<32} {check_us:>8.2f} us")
+    print(f"{'middleware, anonymous':<32} {anonymous - bare:>8.2f} us per request")
+    print(f"{'middleware, bearer token':<32} {authenticated - bare:>8.2f} us per request (JWT check included)")
+
+
+async def register(client, email: str, credits: int = 0) -> dict:
+    response = await client.post("/api/auth/register",
+                                 json={"email": email, "full_name": "Load Test", "password": "load-password"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    while credits > 0:
+        await client.post("/api/credits/purchase", data={"amount": 100}, headers=headers)
+        credits -= 100
+    return headers
+
+
+async def run_phase(name: str, limited: bool, flood: int, stub, limiter):
+    import httpx
+
+    limiter.enabled = limited
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{API_PORT}", timeout=120,
+                                 limits=httpx.Limits(max_connections=flood + 10)) as client:
+        flooder = await register(client, f"flood-{name}@example.com", credits=flood + 10)
+        student = await register(client, f"student-{name}@example.com")
+        upstream_before = stub.state.requests
+
+        statuses, rejected_ms, retry_after_missing = [], [], 0
+
+        async def flood_one(i: int):
+            nonlocal retry_after_missing
+            started = time.perf_counter()
+            response = await client.post("/api/chat", headers=flooder,
+                                         json={"message": f"{name}: explain photosynthesis, part {i}"})
+            statuses.append(response.status_code)
+            if response.status_code == 429:
+                rejected_ms.append((time.perf_counter() - started) * 1000)
+                retry_after_missing += "retry-after" not in response.headers
+
+        student_ms, student_statuses = [], []
+
+        async def student_questions():
+            for i in range(5):
+                started = time.perf_counter()
+                response = await client.post("/api/chat", headers=student,
+                                             json={"message": f"{name}: why is the sky blue? ({i})"})
+                student_ms.append((time.perf_counter() - started) * 1000)
+                student_statuses.append(response.status_code)
+
+        started = time.perf_counter()
+        await asyncio.gather(student_questions(), *(flood_one(i) for i in range(flood)))
+        wall = time.perf_counter() - started
+
+    result = {
+        "answered": statuses.count(200),
+        "rejected": statuses.count(429),
+        "upstream": stub.state.requests - upstream_before,
+        "rejected_p50": percentile(rejected_ms, 50),
+        "rejected_p99": percentile(rejected_ms, 99),
+        "student_p50": percentile(student_ms, 50),
+        "student_limited": student_statuses.count(429),
+        "retry_after_missing": retry_after_missing,
+        "wall": wall,
+    }
+    print(f"{name:>8} {result['answered']:>9} {result['rejected']:>6} {result['upstream']:>9} "
+          f"{result['rejected_p50']:>9.1f} {result['rejected_p99']:>9.1f} {result['student_p50']:>12.0f} "
+          f"{result['student_limited']:>13} {wall:>7.2f}")
+    return result
+
+
+async def flood_test(args, stub):
+    from rate_limit import rate_limiter
+
+    print(f"\n{args.flood} parallel /api/chat from one account + 5 questions from another "
+          f"(stub {args.latency}s, {rate_limiter.stats()['backend']} buckets)")
+    print(f"{'limits':>8} {'answered':>9} {'429':>6} {'upstream':>9} {'429 p50':>9} {'429 p99':>9} "
+          f"{'student p50':>12} {'student 429s':>13} {'wall s':>7}")
+    off = await run_phase("off", False, args.flood, stub, rate_limiter)
+    on = await run_phase("on", True, args.flood, stub, rate_limiter)
+
+    burst = rate_limiter.limits["chat"].burst
+    check(off["rejected"] == 0, "requests were limited with limiting off")
+    check(on["answered"] <= burst + 2, f"flood answered {on['answered']} questions, chat burst is {burst:.0f}")
+    check(on["upstream"] <= on["answered"] + 5, "rejected requests reached the upstream")
+    check(on["retry_after_missing"] == 0, "429 without Retry-After")
+    check(on["student_limited"] == 0, "the well-behaved student was limited")
+    check(on["wall"] < off["wall"], "the limited flood took as long as the unlimited one")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flood", type=int, default=200, help="parallel requests from the flooding account")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM seconds per completion")
+    parser.add_argument("--rounds", type=int, default=20000, help="rounds for the overhead measurements")
+    parser.add_argument("--redis-url", default="", help="share buckets through this Redis-protocol server")
+    args = parser.parse_args()
+
+    use_temp_database("studybuddy-ratelimit")
+    os.environ.update(
+        OPENAI_API_KEY="stub",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+        ANSWER_CACHE_ENABLED="False",
+        RATE_LIMIT_ENABLED="True",
+        RATE_LIMIT_REDIS_URL=args.redis_url,
+    )
+
+    from stub_llm_server import create_stub_app
+    import main as api
+
+    asyncio.run(limiter_overhead(args.rounds))
+
+    stub = create_stub_app(args.latency)
+    start_server(stub, STUB_PORT)
+    start_server(api.app, API_PORT)
+    asyncio.run(flood_test(args, stub))
+    print("\nall checks passed" if not failures else f"\n{len(failures)} check(s) failed")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Write-behind load generator.
+
+Runs the real API (uvicorn subprocess) against the stub LLM server twice,
+with WRITE_BEHIND_ENABLED off and on, and drives unique /api/chat questions
+at a fixed concurrency. Reports throughput, p50/p99 latency and the
+database transactions used for chat-log/ledger rows. It then stops the
+server with SIGTERM and checks that every answered question has its
+ChatMessage and Credit row on disk (the lifespan shutdown flush).
+
+    python benchmarks/load_write_behind.py --requests 2000 --concurrency 64
+    python benchmarks/load_write_behind.py --no-wal   # fsync on every commit
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from _harness import BACKEND_DIR, percentile, start_server, use_temp_database
+
+STUB_PORT = 9131
+API_PORT = 9132
+
+
+def spawn_api(database_url: str, write_behind: bool, wal: bool) -> subprocess.Popen:
+    import httpx
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        OPENAI_API_KEY="stub",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{STUB_PORT}/v1",
+        ANSWER_CACHE_ENABLED="False",
+        WRITE_BEHIND_ENABLED=str(write_behind),
+        SQLITE_WAL=str(wal),
+        RATE_LIMIT_ENABLED="False",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(API_PORT), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{API_PORT}/")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("API server did not start")
+
+
+async def drive(total: int, concurrency: int):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{API_PORT}", timeout=120) as client:
+        response = await client.post(
+            "/api/auth/register",
+            json={"email": "load@example.com", "full_name": "Load Test", "password": "load-password"},
+        )
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for _ in range(total // 100 + 1):
+            await client.post("/api/credits/purchase", data={"amount": 100}, headers=headers)
+
+        latencies, failures = [], 0
+        queue = iter(range(total))
+
+        async def worker():
+            nonlocal failures
+            for i in queue:
+                started = time.perf_counter()
+                response = await client.post("/api/chat", json={"message": f"What is {i} + 17?"}, headers=headers)
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stats = (await client.get("/api/ai/stats")).json()["write_behind"]
+    return latencies, failures, elapsed, stats
+
+
+def count_rows(database_url: str):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        messages = connection.execute(text("SELECT COUNT(*) FROM chat_messages")).scalar()
+        usage = connection.execute(text(
+            "SELECT COUNT(*) FROM credits WHERE transaction_type = 'usage' AND description LIKE 'Chat question%'"
+        )).scalar()
+    engine.dispose()
+    return messages, usage
+
+
+def run(label: str, write_behind: bool, args):
+    database_url = f"sqlite:///{use_temp_database('studybuddy-writebehind')}"
+    server = spawn_api(database_url, write_behind, wal=not args.no_wal)
+    try:
+        latencies, failures, elapsed, stats = asyncio.run(drive(args.requests, args.concurrency))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    answered = len(latencies)
+    messages, usage = count_rows(database_url)
+    durable = messages == answered and usage == answered
+    # With write-behind off every row is written through, one transaction each
+    print(f"{label:>13} {answered / elapsed:>8.0f} {percentile(latencies, 50):>8.1f} {percentile(latencies, 99):>8.1f} "
+          f"{stats['flushes']:>10} {stats['rows_per_flush']:>9} {failures:>6}  "
+          f"{'durable' if durable else f'LOST ROWS ({messages} msgs / {usage} ledger for {answered})'}")
+    return durable
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub LLM latency in seconds")
+    parser.add_argument("--no-wal", action="store_true", help="rollback journal + synchronous=FULL (fsync per commit)")
+    args = parser.parse_args()
+
+    from stub_llm_server import create_stub_app
+
+    start_server(create_stub_app(args.latency), STUB_PORT)
+    print(f"{args.requests} chats, {args.concurrency} clients, stub latency {args.latency}s, "
+          f"{'rollback journal' if args.no_wal else 'WAL'}")
+    print(f"{'persistence':>13} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'log txns':>10} {'rows/txn':>9} {'errors':>6}  shutdown")
+    ok = run("per-request", False, args) & run("write-behind", True, args)
+    sys.exit(0 if ok else 1)
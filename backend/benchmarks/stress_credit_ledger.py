@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Credit ledger concurrency stress test.
+
+Hammers one account from many concurrent tasks, each with its own database session.
+Every worker reserves credits, simulates an AI call, then either keeps the
+credit or refunds it; a few workers also buy credits in the middle. At the
+end the stored balance must equal the starting balance plus the sum of the
+Credit ledger rows, and must never have gone negative.
+
+The --naive flag runs the same workload with the old read-modify-write
+pattern (load user, check, user.credits -= 1) to show the lost updates the
+ledger prevents. Exits non-zero if the ledger run doesn't balance exactly.
+
+    python benchmarks/stress_credit_ledger.py --workers 32 --operations 200
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from _harness import use_temp_database
+
+
+async def run(workers: int, operations: int, start_balance: int, naive: bool) -> bool:
+    from sqlalchemy import func, select
+    from database import AsyncSessionLocal, SessionLocal, close_db, engine
+    from models import Base, Credit, User
+    from credit_ledger import grant_credits, refund_credits, reserve_credits
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(email="stress@example.com", full_name="Stress Test", hashed_password="x", credits=start_balance)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+
+    outcomes = {"reserved": 0, "rejected": 0, "refunded": 0, "granted": 0, "errors": 0}
+
+    async def naive_change(db, delta: int, transaction_type: str) -> bool:
+        row = await db.get(User, user_id)
+        await db.refresh(row)
+        if delta < 0 and row.credits < -delta:
+            return False
+        await asyncio.sleep(random.random() * 0.001)
+        row.credits += delta
+        db.add(Credit(user_id=user_id, amount=delta, transaction_type=transaction_type))
+        await db.commit()
+        return True
+
+    async def worker(seed: int):
+        rng = random.Random(seed)
+        async with AsyncSessionLocal() as db:
+            for _ in range(operations):
+                try:
+                    if rng.random() < 0.02:
+                        if naive:
+                            await naive_change(db, 10, "purchase")
+                        else:
+                            await grant_credits(db, user_id, 10, "purchase", "stress purchase")
+                        outcomes["granted"] += 10
+                        continue
+
+                    if naive:
+                        ok = await naive_change(db, -1, "usage")
+                    else:
+                        ok = await reserve_credits(db, user_id, 1, "stress usage") is not None
+                    if not ok:
+                        outcomes["rejected"] += 1
+                        continue
+                    outcomes["reserved"] += 1
+
+                    await asyncio.sleep(rng.random() * 0.002)  # the "AI call"
+                    if rng.random() < 0.2:
+                        if naive:
+                            await naive_change(db, 1, "refund")
+                        else:
+                            await refund_credits(db, user_id, 1, "stress refund")
+                        outcomes["refunded"] += 1
+                except Exception as e:
+                    await db.rollback()
+                    outcomes["errors"] += 1
+                    print(f"  worker {seed}: {type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(seed) for seed in range(workers)))
+    elapsed = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as db:
+        balance = (await db.get(User, user_id)).credits
+        ledger_sum = (await db.execute(
+            select(func.coalesce(func.sum(Credit.amount), 0)).where(Credit.user_id == user_id)
+        )).scalar()
+    # Pooled connections belong to this event loop; the next run starts a new one
+    await close_db()
+
+    expected = start_balance + outcomes["granted"] - outcomes["reserved"] + outcomes["refunded"]
+    exact = balance == expected == start_balance + ledger_sum and balance >= 0
+
+    label = "naive read-modify-write" if naive else "atomic ledger"
+    print(f"{label}: {workers} workers x {operations} ops in {elapsed:.2f}s")
+    print(f"  outcomes: {outcomes}")
+    print(f"  balance {balance}, expected {expected}, start + ledger rows {start_balance + ledger_sum}"
+          f" -> {'EXACT' if exact else 'MISMATCH'}")
+    return exact
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--operations", type=int, default=200, help="operations per worker")
+    parser.add_argument("--start-balance", type=int, default=500)
+    parser.add_argument("--naive", action="store_true", help="also run the old read-modify-write pattern")
+    args = parser.parse_args()
+
+    use_temp_database("studybuddy-stress")
+
+    if args.naive:
+        asyncio.run(run(args.workers, args.operations, args.start_balance, naive=True))
+    ok = asyncio.run(run(args.workers, args.operations, args.start_balance, naive=False))
+    sys.exit(0 if ok else 1)
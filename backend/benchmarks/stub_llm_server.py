@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Answers POST /v1/chat/completions after a configurable delay so the backend
+can be load-tested without network access or API spend. Streaming requests
+(stream=true) get the answer word by word, spread over the same delay. Point the backend at
+it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Faults can be injected for resilience testing, at startup (--error-rate,
+--slow-rate, ...) or at runtime with POST /faults {"error_rate": 0.3, ...}:
+
+- error_rate: share of requests answered with error_status (default 503)
+- slow_rate: share of requests delayed by slow_latency seconds instead
+- down: answer every request with error_status
+- hang: never answer (until the client gives up)
+
+GET /faults returns the current faults and request/fault counters.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_FAULTS = {
+    "error_rate": 0.0,
+    "error_status": 503,
+    "slow_rate": 0.0,
+    "slow_latency": 5.0,
+    "down": False,
+    "hang": False,
+}
+
+STUB_ANSWER = """🔢 Great question! Here is a step-by-step answer from the stub model.
+
+**🎯 Step-by-Step Solution:**
+
+1️⃣ **Read the question carefully**
+2️⃣ **Work through each step**
+3️⃣ **Check your answer**
+
+**🌟 Keep going - you're doing great!**"""
+
+
+def create_stub_app(latency: float = 0.5, seed: int = 0, **faults) -> FastAPI:
+    """Build the stub app; latency is seconds to wait before answering, faults override DEFAULT_FAULTS"""
+    app = FastAPI(title="Stub LLM")
+    app.state.latency = latency
+    app.state.requests = 0
+    app.state.faults = {**DEFAULT_FAULTS, **faults}
+    app.state.injected = {"errors": 0, "slow": 0, "hangs": 0}
+    rng = random.Random(seed)
+
+    @app.get("/faults")
+    async def get_faults():
+        return {"faults": app.state.faults, "requests": app.state.requests, "injected": app.state.injected}
+
+    @app.post("/faults")
+    async def set_faults(request: Request):
+        app.state.faults.update(await request.json())
+        return app.state.faults
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        faults = app.state.faults
+        if faults["hang"]:
+            app.state.injected["hangs"] += 1
+            await asyncio.sleep(3600)
+        if faults["down"] or rng.random() < faults["error_rate"]:
+            app.state.injected["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Injected fault", "type": "server_error", "code": None}},
+                status_code=faults["error_status"],
+            )
+        delay = app.state.latency
+        if rng.random() < faults["slow_rate"]:
+            app.state.injected["slow"] += 1
+            delay = faults["slow_latency"]
+        if body.get("stream"):
+            return StreamingResponse(stream_chunks(body, delay), media_type="text/event-stream")
+        await asyncio.sleep(delay)
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+        completion_tokens = len(STUB_ANSWER) // 4
+        return {
+            "id": f"chatcmpl-stub-{app.state.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": STUB_ANSWER},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    async def stream_chunks(body: dict, latency: float):
+        words = STUB_ANSWER.split(" ")
+        delay = latency / len(words)
+        for index, word in enumerate(words):
+            await asyncio.sleep(delay)
+            chunk = {
+                "id": f"chatcmpl-stub-{app.state.requests}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if index == 0 else " " + word},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests that are slow")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="seconds for a slow request")
+    args = parser.parse_args()
+
+    app = create_stub_app(args.latency, error_rate=args.error_rate, error_status=args.error_status,
+                          slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Build the knowledge base index (see knowledge_base.py).
+
+Indexes the few-shot examples in SUBJECT_TRAINING_DATA, the bundled
+curated Q&A (knowledge/curated_qa.jsonl) and any JSONL corpora given,
+one {"question", "answer", "subject", "source"} record per line (subject
+and source are optional; a missing subject is detected from the question).
+Point KNOWLEDGE_BASE_PATH at the output directory to use it.
+
+    python build_knowledge_base.py --output knowledge_index extra_qa.jsonl
+    python build_knowledge_base.py --output knowledge_index --query "why is the sky blue"
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "build-key")
+
+from ai_service import SUBJECT_TRAINING_DATA, detect_subject_advanced  # noqa: E402
+from knowledge_base import BUNDLED_CORPUS, KNOWLEDGE_BASE_VECTOR_DIM, KnowledgeBase, load_corpus, training_documents  # noqa: E402
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpora", nargs="*", help="JSONL Q&A files to index")
+    parser.add_argument("--output", required=True, help="index directory (an existing index there is replaced)")
+    parser.add_argument("--vector-dim", type=int, default=KNOWLEDGE_BASE_VECTOR_DIM, help="trigram vector size, 0 for BM25 only")
+    parser.add_argument("--no-training-data", action="store_true", help="skip SUBJECT_TRAINING_DATA")
+    parser.add_argument("--no-bundled", action="store_true", help="skip the bundled curated corpus")
+    parser.add_argument("--query", action="append", default=[], help="question to look up in the new index")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    documents = [] if args.no_training_data else training_documents(SUBJECT_TRAINING_DATA)
+    corpora = ([] if args.no_bundled else [BUNDLED_CORPUS]) + args.corpora
+    for path in corpora:
+        try:
+            documents.extend(
+                document if document.subject else document._replace(subject=detect_subject_advanced(document.question))
+                for document in load_corpus(path)
+            )
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return 1
+    if not documents:
+        print("Error: nothing to index")
+        return 1
+
+    knowledge_base = KnowledgeBase.build(documents, vector_dim=args.vector_dim)
+    try:
+        knowledge_base.save(args.output)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+
+    knowledge_base = KnowledgeBase.open(args.output)
+    stats = knowledge_base.stats()
+    print(f"Indexed {stats['documents']} documents ({stats['terms']} terms, vectors: {stats['vector_dim'] or 'off'}) "
+          f"into {args.output} in {elapsed:.1f}s, {directory_size(args.output) / 1024 / 1024:.1f} MB")
+    for question in args.query:
+        print(f"\n{question}")
+        for match in knowledge_base.search(question):
+            print(f"  {match.confidence:.2f}  {match.score:7.2f}  [{match.document.subject or '-'}] {match.document.question}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
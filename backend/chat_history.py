@@ -0,0 +1,135 @@
+"""
+Chat history queries.
+
+History is paged with a keyset cursor on (created_at, id) rather than
+OFFSET, so the 500th page costs the same as the first: each page is one
+range scan on the (user_id, created_at, id) index. Listing queries select
+only the columns they return and build dicts straight from row tuples, so
+no ChatMessage objects are created.
+"""
+
+import base64
+import binascii
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ChatMessage
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+HISTORY_PREVIEW_CHARS = int(os.getenv("HISTORY_PREVIEW_CHARS", "120"))
+
+FULL_COLUMNS = (
+    ChatMessage.id,
+    ChatMessage.user_message,
+    ChatMessage.ai_response,
+    ChatMessage.subject,
+    ChatMessage.has_image,
+    ChatMessage.created_at,
+)
+
+
+class InvalidCursor(ValueError):
+    """A history cursor that wasn't produced by encode_cursor"""
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    """Opaque cursor pointing just past the given message"""
+    raw = f"{created_at.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid history cursor")
+
+
+def _preview(text: Optional[str]) -> Optional[str]:
+    if text is not None and len(text) > HISTORY_PREVIEW_CHARS:
+        return text[:HISTORY_PREVIEW_CHARS].rstrip() + "…"
+    return text
+
+
+async def history_page(db: AsyncSession, user_id: int, limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None,
+                 preview: bool = False) -> Tuple[List[dict], Optional[str]]:
+    """One page of a user's messages, newest first, plus the cursor for the next page (None on the last)"""
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+    if preview:
+        # Truncate in SQL so the full answer text never leaves the database;
+        # one extra character tells us whether to add an ellipsis
+        columns = (
+            ChatMessage.id,
+            ChatMessage.subject,
+            ChatMessage.has_image,
+            ChatMessage.created_at,
+            func.substr(ChatMessage.user_message, 1, HISTORY_PREVIEW_CHARS + 1),
+            func.substr(ChatMessage.ai_response, 1, HISTORY_PREVIEW_CHARS + 1),
+        )
+    else:
+        columns = FULL_COLUMNS
+
+    statement = select(*columns).where(ChatMessage.user_id == user_id)
+    if cursor:
+        created_at, message_id = decode_cursor(cursor)
+        # The redundant upper bound lets the planner seek straight into the
+        # index; with bound parameters it can't derive one from the OR alone
+        statement = statement.where(
+            ChatMessage.created_at <= created_at,
+            or_(ChatMessage.created_at < created_at, ChatMessage.id < message_id),
+        )
+    statement = statement.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(statement)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if preview:
+        items = [
+            {
+                "id": id_,
+                "subject": subject,
+                "has_image": has_image,
+                "created_at": created_at,
+                "question_preview": _preview(question),
+                "answer_preview": _preview(answer),
+            }
+            for id_, subject, has_image, created_at, question, answer in rows
+        ]
+    else:
+        items = [
+            {
+                "id": id_,
+                "user_message": user_message,
+                "ai_response": ai_response,
+                "subject": subject,
+                "has_image": has_image,
+                "created_at": created_at,
+            }
+            for id_, user_message, ai_response, subject, has_image, created_at in rows
+        ]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return items, next_cursor
+
+
+async def get_message(db: AsyncSession, user_id: int, message_id: int) -> Optional[dict]:
+    """A single full message, or None if it doesn't exist or belongs to someone else"""
+    result = await db.execute(
+        select(*FULL_COLUMNS).where(ChatMessage.id == message_id, ChatMessage.user_id == user_id)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    return dict(row._mapping)
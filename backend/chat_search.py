@@ -0,0 +1,230 @@
+"""
+Full-text search over a user's chat history.
+
+SQLite keeps an FTS5 index (chat_messages_fts) over the question and the
+answer of each message, with the content read from chat_messages itself;
+PostgreSQL gets a generated tsvector column (search_vector) with a GIN
+index. Both are maintained by the database on every insert, update and
+delete (triggers / the generated column), so write-behind's bulk INSERTs
+are indexed as they are committed and nothing else has to keep them in
+sync.
+
+A query matches messages containing any of its words (stopwords aside).
+Messages with more of them, and rarer ones, come first, and questions
+weigh more than answers: ts_rank_cd on PostgreSQL, which reads only the
+row's own tsvector. On SQLite the FTS5 index also holds the user id, so
+each word is matched against the user's own messages only; the ranking is
+done here with IDF over the user's history, because FTS5's bm25() counts
+every word's matches across the whole table and slows down as it grows.
+Snippets are built for the returned rows only, so latency follows the
+size of the user's history rather than the table.
+"""
+
+import heapq
+import html
+import math
+import os
+import re
+from collections import defaultdict
+from typing import List, Tuple
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, String, bindparam, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+SEARCH_RESULTS = int(os.getenv("CHAT_SEARCH_RESULTS", "20"))
+SEARCH_MAX_RESULTS = int(os.getenv("CHAT_SEARCH_MAX_RESULTS", "50"))
+SEARCH_SNIPPET_WORDS = int(os.getenv("CHAT_SEARCH_SNIPPET_WORDS", "16"))
+SEARCH_MAX_TERMS = int(os.getenv("CHAT_SEARCH_MAX_TERMS", "8"))
+
+# Database objects that aren't in models.py (skipped by alembic autogenerate)
+SEARCH_TABLE = "chat_messages_fts"
+SEARCH_COLUMN = "search_vector"
+
+# Highlight markers in the database's snippets, turned into <mark> tags after escaping
+_START, _STOP = "\x02", "\x03"
+_WORD = re.compile(r"\w+")
+# A word in the question counts this many times a word in the answer
+QUESTION_WEIGHT = 2.0
+# Words that say nothing about the message ("that ... from last week")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or "
+    "that the this to was what when where which who why with you last week yesterday today".split()
+)
+
+_SQLITE_DDL = (
+    # porter: "fractions" finds "fraction"; remove_diacritics: "naive" finds "naïve"
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "user_id, user_message, ai_response, content='chat_messages', content_rowid='id', "
+    "tokenize='porter unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, user_id, user_message, ai_response) "
+    "VALUES (new.id, new.user_id, new.user_message, new.ai_response); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, user_id, user_message, ai_response) "
+    "VALUES ('delete', old.id, old.user_id, old.user_message, old.ai_response); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE ON chat_messages BEGIN "
+    f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, user_id, user_message, ai_response) "
+    "VALUES ('delete', old.id, old.user_id, old.user_message, old.ai_response); "
+    f"INSERT INTO {SEARCH_TABLE} (rowid, user_id, user_message, ai_response) "
+    "VALUES (new.id, new.user_id, new.user_message, new.ai_response); END",
+)
+
+_POSTGRES_DDL = (
+    f"ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS {SEARCH_COLUMN} tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(user_message, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(ai_response, '')), 'B')) STORED",
+    f"CREATE INDEX IF NOT EXISTS ix_chat_messages_{SEARCH_COLUMN} ON chat_messages USING GIN ({SEARCH_COLUMN})",
+)
+
+_SQLITE_SNIPPETS = f"""
+    SELECT m.id, m.subject, m.has_image, m.created_at,
+           snippet({SEARCH_TABLE}, 1, :start, :stop, '…', :words) AS question_snippet,
+           snippet({SEARCH_TABLE}, 2, :start, :stop, '…', :words) AS answer_snippet
+    FROM {SEARCH_TABLE} JOIN chat_messages AS m ON m.id = {SEARCH_TABLE}.rowid
+    WHERE {SEARCH_TABLE} MATCH :query AND """
+# Each id in an IN list is a separate index lookup; one rowid range is a
+# single one, but builds snippets for every match of the user inside it
+_SQLITE_SNIPPETS_IN = text(_SQLITE_SNIPPETS + f"{SEARCH_TABLE}.rowid IN :ids").bindparams(bindparam("ids", expanding=True))
+_SQLITE_SNIPPETS_RANGE = text(_SQLITE_SNIPPETS + f"{SEARCH_TABLE}.rowid BETWEEN :low AND :high")
+# Use the range while it holds at most this many matches per result
+_RANGE_MATCHES_PER_RESULT = 3
+
+_POSTGRES_SEARCH = text(f"""
+    WITH query AS (SELECT to_tsquery('english', :query) AS q),
+    top AS (
+        SELECT m.id, m.subject, m.has_image, m.created_at, m.user_message, m.ai_response,
+               ts_rank_cd(m.{SEARCH_COLUMN}, query.q) AS score
+        FROM chat_messages AS m, query
+        WHERE m.user_id = :user_id AND m.{SEARCH_COLUMN} @@ query.q
+        ORDER BY score DESC, m.created_at DESC
+        LIMIT :limit
+    )
+    SELECT top.id, top.subject, top.has_image, top.created_at,
+           ts_headline('english', top.user_message, query.q, :options) AS question_snippet,
+           ts_headline('english', top.ai_response, query.q, :options) AS answer_snippet,
+           top.score
+    FROM top, query
+    ORDER BY top.score DESC, top.created_at DESC
+""")
+
+_RESULT_TYPES = dict(id=Integer, subject=String, has_image=Boolean, created_at=DateTime,
+                     question_snippet=String, answer_snippet=String)
+
+
+class InvalidSearch(ValueError):
+    """A search query without any words to look for"""
+
+
+def create_search_index(connection: Connection):
+    """Create the full-text index and its triggers if missing, indexing the existing messages"""
+    if connection.dialect.name == "sqlite":
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": SEARCH_TABLE}
+        ).first()
+        for statement in _SQLITE_DDL:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"))
+    elif connection.dialect.name == "postgresql":
+        for statement in _POSTGRES_DDL:
+            connection.execute(text(statement))
+
+
+def drop_search_index(connection: Connection):
+    if connection.dialect.name == "sqlite":
+        for suffix in ("_insert", "_delete", "_update"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}{suffix}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+    elif connection.dialect.name == "postgresql":
+        connection.execute(text(f"DROP INDEX IF EXISTS ix_chat_messages_{SEARCH_COLUMN}"))
+        connection.execute(text(f"ALTER TABLE chat_messages DROP COLUMN IF EXISTS {SEARCH_COLUMN}"))
+
+
+def search_terms(query: str) -> List[str]:
+    """The words of a search query to look for, lowercased, without stopwords unless that leaves none"""
+    words = list(dict.fromkeys(word.lower() for word in _WORD.findall(query)))
+    if not words:
+        raise InvalidSearch("Search query needs at least one word")
+    return ([word for word in words if word not in _STOPWORDS] or words)[:SEARCH_MAX_TERMS]
+
+
+def _highlighted(snippet) -> str:
+    """HTML-escaped snippet with the matches in <mark> tags"""
+    return html.escape(snippet or "").replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+async def _sqlite_ranking(db: AsyncSession, user_id: int, terms: List[str], limit: int) -> Tuple[List[Tuple[int, float]], List[int]]:
+    """(message id, score) of the user's best matches, best first, and the ids of all their matches"""
+    # One statement: the user's messages containing each term, per column,
+    # plus the size of the user's history for the IDF
+    user = f'user_id : "{int(user_id)}"'
+    parts, parameters = ["SELECT -1, 0, COUNT(*) FROM chat_messages WHERE user_id = :user_id"], {"user_id": user_id}
+    for index, term in enumerate(terms):
+        # Terms are quoted, so no query syntax gets through
+        for column, name in ((1, "user_message"), (0, "ai_response")):
+            parameters[f"q{index}_{column}"] = f'{user} AND {name} : "{term}"'
+            parts.append(f"SELECT {index}, {column}, rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :q{index}_{column}")
+    rows = (await db.execute(text(" UNION ALL ".join(parts)), parameters)).all()
+
+    messages = 0
+    weights = defaultdict(lambda: defaultdict(float))  # term -> message id -> weight
+    for term, in_question, value in rows:
+        if term < 0:
+            messages = value
+        else:
+            weights[term][value] += QUESTION_WEIGHT if in_question else 1.0
+
+    scores = defaultdict(float)
+    for matches in weights.values():
+        idf = math.log(1 + (messages - len(matches) + 0.5) / (len(matches) + 0.5))
+        for message_id, weight in matches.items():
+            scores[message_id] += idf * weight
+    # Ties go to the newest message
+    return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0])), list(scores)
+
+
+async def search_messages(db: AsyncSession, user_id: int, query: str, limit: int = SEARCH_RESULTS) -> List[dict]:
+    """A user's messages matching any word of the query, best match first, with highlighted snippets"""
+    terms = search_terms(query)
+    limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+
+    if db.bind.dialect.name == "postgresql":
+        options = (f"StartSel={_START}, StopSel={_STOP}, MaxWords={SEARCH_SNIPPET_WORDS}, "
+                   f"MinWords={max(1, SEARCH_SNIPPET_WORDS // 2)}, MaxFragments=1")
+        statement = _POSTGRES_SEARCH.columns(**_RESULT_TYPES, score=Float)
+        parameters = {"query": " | ".join(terms), "user_id": user_id, "limit": limit, "options": options}
+        rows = (await db.execute(statement, parameters)).all()
+    else:
+        ranking, matched = await _sqlite_ranking(db, user_id, terms, limit)
+        if not ranking:
+            return []
+        ids = [message_id for message_id, _ in ranking]
+        low, high = min(ids), max(ids)
+        words = " OR ".join(f'"{term}"' for term in terms)
+        parameters = {
+            "query": f"{{user_message ai_response}} : ({words})",
+            "start": _START, "stop": _STOP, "words": SEARCH_SNIPPET_WORDS,
+        }
+        if sum(low <= message_id <= high for message_id in matched) <= _RANGE_MATCHES_PER_RESULT * len(ids):
+            # Only the user's own matches in the range
+            statement = _SQLITE_SNIPPETS_RANGE
+            parameters.update(query=f'user_id : "{int(user_id)}" AND {parameters["query"]}', low=low, high=high)
+        else:
+            statement = _SQLITE_SNIPPETS_IN
+            parameters["ids"] = ids
+        found = {row.id: row for row in (await db.execute(statement.columns(**_RESULT_TYPES), parameters)).all()}
+        rows = [(*found[message_id], score) for message_id, score in ranking if message_id in found]
+
+    return [
+        {
+            "id": id_,
+            "subject": subject,
+            "has_image": has_image,
+            "created_at": created_at,
+            "question_snippet": _highlighted(question),
+            "answer_snippet": _highlighted(answer),
+            "score": round(score, 4),
+        }
+        for id_, subject, has_image, created_at, question, answer, score in rows
+    ]
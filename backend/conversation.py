@@ -0,0 +1,247 @@
+"""
+Per-user conversation context for follow-up questions.
+
+Each user's recent turns are kept in memory in a ring buffer of
+CONTEXT_MAX_TURNS question/answer pairs, so follow-ups ("explain step 3
+again") don't need a database query. The buffer is filled from the
+user's latest ChatMessage rows the first time it's needed and then kept up
+to date as answers are produced. Turns that fall out of the buffer are
+folded into a short rolling summary (what was asked, and the final answer
+when one can be picked out) capped at CONTEXT_SUMMARY_TOKENS.
+
+Context is only attached to questions that look like follow-ups (or when
+the client asks for it): stand-alone questions stay cheap, cacheable and
+coalescable. Each worker keeps its own buffers; a follow-up that lands on
+another worker rebuilds them from the database.
+"""
+
+import os
+import re
+import time
+from collections import Counter, OrderedDict, deque
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ChatMessage
+from prompt_builder import count_tokens, trim_to_tokens
+from write_behind import write_behind
+
+# Context configuration (override via environment)
+CONTEXT_ENABLED = os.getenv("CONTEXT_ENABLED", "True").lower() == "true"
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "6"))
+CONTEXT_ANSWER_TOKENS = int(os.getenv("CONTEXT_ANSWER_TOKENS", "350"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "150"))
+CONTEXT_MAX_USERS = int(os.getenv("CONTEXT_MAX_USERS", "10000"))
+CONTEXT_TTL_SECONDS = float(os.getenv("CONTEXT_TTL_SECONDS", "3600"))
+
+# Questions that open with a continuation, name an earlier turn, or use a pronoun with
+# nothing after it to refer to ("explain it again", "why does that work?"). A pronoun
+# followed by a noun phrase ("the derivative of this function: x^2") or used as a dummy
+# subject ("is it true that 2+2=4") doesn't make a question a follow-up.
+_FOLLOW_UP_MAX_WORDS = 15
+_FOLLOW_UP_START = re.compile(r"^(and|but|so|also|then|now|ok|okay|what about|how about)\b", re.IGNORECASE)
+_FOLLOW_UP_REFERENCE = re.compile(
+    r"\b(step \d+|again|above|previous|earlier|you said|your (answer|explanation|example|working)|last one|"
+    r"another one|one more|(tell me|explain|say) more|more (about|detail|details|examples?|practice)|"
+    r"the same (way|method|steps?|thing|kind)|(a different|another) way)\b",
+    re.IGNORECASE,
+)
+_PRONOUN = re.compile(r"\b(it|this|that|these|those|they|them)\b(?!['’])", re.IGNORECASE)
+# Words that can follow a pronoun to the end of its clause when it stands on its own
+# ("why does that work for 5?"); a noun among them ("how do they make chocolate?") means it doesn't
+_AFTER_PRONOUN = frozenset("""
+is was are were be been mean means meant work works worked happen happens happened come comes came
+do does did has have had can could will would should get gets go goes look looks right wrong correct
+again too also please more differently simpler step for to in into with from by on at as a an the me you us
+i we so much now up out like one ones part bit
+""".split())
+# A "that" only refers back after these ("explain that", "why is that?"), not after a noun ("a number that is even")
+_BEFORE_THAT = frozenset("""
+explain about is was does did do mean means why how what and but so like with of on to for understand
+get check solve show repeat redo simplify use
+""".split())
+_FINAL_ANSWER = re.compile(r"final answer\W*(.+)", re.IGNORECASE)
+
+
+class Turn(NamedTuple):
+    question: str
+    answer: str  # trimmed to CONTEXT_ANSWER_TOKENS
+    subject: Optional[str]
+    tokens: int
+
+
+class ConversationContext(NamedTuple):
+    """A snapshot of one user's context, oldest turn first"""
+    summary: str
+    summary_tokens: int
+    turns: tuple
+
+    @property
+    def subject(self) -> Optional[str]:
+        """Subject of the latest turn, for follow-ups that don't name one"""
+        for turn in reversed(self.turns):
+            if turn.subject:
+                return turn.subject
+        return None
+
+
+def _refers_back(text: str, match: re.Match) -> bool:
+    """Whether a pronoun stands for something said earlier rather than a noun phrase after it"""
+    clause = re.split(r"[.?!;:]", text[match.end():], maxsplit=1)[0]
+    if any(word.lower() not in _AFTER_PRONOUN and not word.isdigit() for word in re.findall(r"\w+", clause)):
+        return False
+    if match.group(1).lower() == "that":
+        before = re.findall(r"\w+", text[:match.start()])
+        return not before or before[-1].lower() in _BEFORE_THAT
+    return True
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether a question seems to depend on the previous answers"""
+    text = question.strip()
+    if _FOLLOW_UP_START.match(text):
+        return True
+    if len(text.split()) > _FOLLOW_UP_MAX_WORDS:
+        return False
+    if _FOLLOW_UP_REFERENCE.search(text):
+        return True
+    return any(_refers_back(text, match) for match in _PRONOUN.finditer(text))
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    """First words of text on one line, within max_tokens"""
+    words = text.split()
+    clipped = " ".join(words)
+    while len(words) > 1 and count_tokens(clipped) > max_tokens:
+        words = words[:len(words) * 3 // 4]
+        clipped = " ".join(words) + "…"
+    return clipped
+
+
+def _summarize(turn: Turn) -> str:
+    line = f"- ({turn.subject or 'general'}) asked: {_clip(turn.question, 40)}"
+    match = _FINAL_ANSWER.search(turn.answer)
+    if match:
+        line += f" - answer: {_clip(match.group(1).strip('* '), 20)}"
+    return line
+
+
+class _Conversation:
+    __slots__ = ("turns", "summary_lines", "summary_tokens", "expires_at")
+
+    def __init__(self, max_turns: int):
+        self.turns = deque(maxlen=max_turns)
+        self.summary_lines = deque()
+        self.summary_tokens = 0
+        self.expires_at = 0.0
+
+
+class ConversationStore:
+    """Per-user ring buffers of recent turns plus a rolling summary"""
+
+    def __init__(self, max_turns: int = CONTEXT_MAX_TURNS, max_users: int = CONTEXT_MAX_USERS,
+                 ttl_seconds: float = CONTEXT_TTL_SECONDS):
+        self.max_turns = max_turns
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._conversations: "OrderedDict[int, _Conversation]" = OrderedDict()
+        self._counters = Counter()
+
+    def _get(self, user_id: int) -> Optional[_Conversation]:
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            return None
+        if conversation.expires_at <= time.monotonic():
+            del self._conversations[user_id]
+            return None
+        self._conversations.move_to_end(user_id)
+        conversation.expires_at = time.monotonic() + self.ttl_seconds
+        return conversation
+
+    def _create(self, user_id: int) -> _Conversation:
+        while len(self._conversations) >= self.max_users:
+            self._conversations.popitem(last=False)
+            self._counters["evicted_users"] += 1
+        conversation = self._conversations[user_id] = _Conversation(self.max_turns)
+        conversation.expires_at = time.monotonic() + self.ttl_seconds
+        return conversation
+
+    def _append(self, conversation: _Conversation, question: str, answer: str, subject: Optional[str]):
+        if len(conversation.turns) == conversation.turns.maxlen:
+            # The oldest turn leaves the buffer: keep a one-line summary of it
+            line = _summarize(conversation.turns[0])
+            conversation.summary_lines.append(line)
+            conversation.summary_tokens += count_tokens(line) + 1
+            while conversation.summary_tokens > CONTEXT_SUMMARY_TOKENS and conversation.summary_lines:
+                conversation.summary_tokens -= count_tokens(conversation.summary_lines.popleft()) + 1
+            self._counters["summarized_turns"] += 1
+        answer = trim_to_tokens(answer, CONTEXT_ANSWER_TOKENS)
+        conversation.turns.append(Turn(question, answer, subject, count_tokens(question) + count_tokens(answer)))
+
+    def record(self, user_id: int, question: str, answer: str, subject: Optional[str] = None):
+        """Add an answered question to the user's context"""
+        if not CONTEXT_ENABLED or not answer:
+            return
+        conversation = self._get(user_id) or self._create(user_id)
+        self._append(conversation, question, answer, subject)
+
+    async def context_for(self, db: AsyncSession, user_id: int, question: str,
+                          use_context: Optional[bool] = None) -> Optional[ConversationContext]:
+        """Context to send with a question, or None to answer it stand-alone.
+
+        use_context=None decides with is_follow_up(); True/False force it.
+        """
+        if not CONTEXT_ENABLED or use_context is False or (use_context is None and not is_follow_up(question)):
+            return None
+
+        conversation = self._get(user_id)
+        if conversation is None:
+            conversation = await self._load(db, user_id)
+        else:
+            self._counters["hits"] += 1
+        if not conversation.turns:
+            return None
+        return ConversationContext(
+            summary="\n".join(conversation.summary_lines),
+            summary_tokens=conversation.summary_tokens,
+            turns=tuple(conversation.turns),
+        )
+
+    async def _load(self, db: AsyncSession, user_id: int) -> _Conversation:
+        """Rebuild a user's buffer and summary from their latest messages"""
+        if write_behind.has_pending(user_id):
+            await write_behind.flush()
+        result = await db.execute(
+            select(ChatMessage.user_message, ChatMessage.ai_response, ChatMessage.subject)
+            .where(ChatMessage.user_id == user_id)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+            .limit(self.max_turns * 2)
+        )
+        rows = result.all()
+        self._counters["loads"] += 1
+
+        # Another request may have built it while we were waiting on the database
+        conversation = self._get(user_id)
+        if conversation is not None:
+            return conversation
+        conversation = self._create(user_id)
+        for question, answer, subject in reversed(rows):
+            self._append(conversation, question, answer or "", subject)
+        return conversation
+
+    def stats(self) -> dict:
+        """Buffer counts and load/hit counters"""
+        return {
+            "enabled": CONTEXT_ENABLED,
+            "users": len(self._conversations),
+            "max_turns": self.max_turns,
+            "hits": self._counters["hits"],
+            "loads": self._counters["loads"],
+            "summarized_turns": self._counters["summarized_turns"],
+            "evicted_users": self._counters["evicted_users"],
+        }
+
+
+conversations = ConversationStore()
@@ -0,0 +1,67 @@
+"""
+Atomic credit ledger.
+
+Every balance change is one conditional UPDATE ... RETURNING on the users
+row plus the matching Credit row. There is no read-modify-write in Python,
+so concurrent requests can't lose updates and a balance can never go below
+zero. When the write-behind queue is running, the UPDATE commits on its own
+and the Credit row is written with the next batch; otherwise both commit
+together.
+
+Chat handlers reserve a credit before the AI call (which also releases the
+connection for the slow part) and refund it if no answer is produced.
+"""
+
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import write_lock
+from models import User, Credit
+from user_cache import user_cache
+from write_behind import write_behind
+
+
+async def _apply(db: AsyncSession, user_id: int, delta: int, transaction_type: str, description: str,
+           require_balance: bool) -> Optional[int]:
+    statement = update(User).where(User.id == user_id)
+    if require_balance:
+        statement = statement.where(User.credits >= -delta)
+    statement = statement.values(credits=User.credits + delta).returning(User.credits)
+
+    deferred = write_behind.active
+    try:
+        async with write_lock():
+            result = await db.execute(statement, execution_options={"synchronize_session": False})
+            new_balance = result.scalar_one_or_none()
+            if new_balance is None:
+                await db.rollback()
+                return None
+            if not deferred:
+                db.add(Credit(user_id=user_id, amount=delta, transaction_type=transaction_type, description=description))
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+    if deferred:
+        await write_behind.add_credit(user_id, delta, transaction_type, description)
+    user_cache.update_credits(user_id, new_balance)
+    return new_balance
+
+
+async def reserve_credits(db: AsyncSession, user_id: int, amount: int = 1, description: str = "Chat question") -> Optional[int]:
+    """Take credits if the balance covers them; returns the new balance or None"""
+    return await _apply(db, user_id, -amount, "usage", description, require_balance=True)
+
+
+async def refund_credits(db: AsyncSession, user_id: int, amount: int = 1, description: str = "Refund for unanswered question") -> int:
+    """Give back reserved credits for work that didn't produce an answer"""
+    return await _apply(db, user_id, amount, "refund", description, require_balance=False)
+
+
+async def grant_credits(db: AsyncSession, user_id: int, amount: int, transaction_type: str = "purchase",
+                  description: Optional[str] = None) -> Optional[int]:
+    """Add purchased or bonus credits; returns the new balance or None if the user is gone"""
+    return await _apply(db, user_id, amount, transaction_type, description, require_balance=False)
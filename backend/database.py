@@ -1,26 +1,143 @@
-from sqlalchemy import create_engine
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from chat_search import create_search_index
+from metrics import stage
 from models import Base
 import os
 
 # Database URL - using SQLite for development, can be changed to PostgreSQL for production
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./studybuddy.db")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+def _async_url(url: str) -> str:
+    """The same database through an asyncio driver (aiosqlite / asyncpg)"""
+    scheme, rest = url.split("://", 1)
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    if scheme.startswith("postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+
+# The API uses the async engine; scripts, migrations and init_db use the sync one
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# Connection pool (PostgreSQL / file-backed SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# SQLite tuning
+SQLITE_WAL = os.getenv("SQLITE_WAL", "True").lower() == "true"
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _engine_options() -> dict:
+    if not IS_SQLITE:
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+    options = {"connect_args": {"check_same_thread": False}}
+    if ":memory:" not in DATABASE_URL and DATABASE_URL != "sqlite://":
+        # With WAL, readers don't block the writer, so more than the default
+        # 5 + 10 connections is useful; a new SQLite connection is cheap anyway
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+engine = create_engine(DATABASE_URL, **_engine_options())
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options())
+
 
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Per-connection SQLite settings for a many-readers, one-writer workload"""
+        cursor = dbapi_connection.cursor()
+        if SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            # Durable at checkpoints; safe with WAL and much cheaper per commit
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_query_stage = stage("db_query")
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """Time every API query, driver round trip included"""
+    _query_stage.observe(time.perf_counter() - context._metrics_started)
+
+# Keep loaded attributes after commit so handlers don't re-check out a
+# connection (and block the event loop) just to read values they already have
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 def init_db():
-    """Initialize database tables"""
+    """Initialize database tables and the chat search index"""
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        create_search_index(connection)
+
+_write_locks = weakref.WeakKeyDictionary()
 
-def get_db():
-    """Get database session"""
+
+@asynccontextmanager
+async def write_lock():
+    """Serialize this process's write transactions on SQLite (no-op elsewhere).
+
+    SQLite has one database-wide write lock. Async writers that collide fall
+    into its busy handler, which backs off in sleeps of up to 100 ms; queueing
+    on an asyncio lock instead hands the lock straight to the next writer.
+    Wrap the statements from the first write through commit.
+    """
+    if not IS_SQLITE:
+        yield
+        return
+    loop = asyncio.get_running_loop()
+    lock = _write_locks.get(loop)
+    if lock is None:
+        lock = _write_locks[loop] = asyncio.Lock()
+    async with lock:
+        yield
+
+async def get_db():
+    """Get async database session (FastAPI dependency)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_sync_db():
+    """Get synchronous database session (scripts and sync code paths)"""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def close_db():
+    """Dispose of the async connection pool (called on application shutdown)"""
+    await async_engine.dispose()
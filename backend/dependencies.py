@@ -0,0 +1,57 @@
+"""Shared FastAPI dependencies"""
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth import decode_access_token
+from database import get_db
+from metrics import stage
+from models import User
+from rate_limit import VERIFIED_TOKEN_KEY
+from user_cache import CachedUser, user_cache
+
+security = HTTPBearer()
+
+_jwt_stage = stage("jwt")
+
+
+async def resolve_user(claims: dict, db: AsyncSession) -> CachedUser:
+    """Resolve verified token claims to a user record, from the cache when possible"""
+    user_id = claims.get("uid")
+    if user_id is not None:
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        user = await db.get(User, user_id)
+    else:
+        # Tokens issued before the uid claim existed only carry the email
+        result = await db.execute(select(User).where(User.email == claims["sub"]))
+        user = result.scalars().first()
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_cache.store(user)
+
+
+def verified_claims(request: Request, token: str) -> dict:
+    """Claims of a bearer token, reusing the rate limiter's verification when it did one"""
+    verified = request.scope.get("state", {}).get(VERIFIED_TOKEN_KEY)
+    if verified is not None and verified[0] == token:
+        return verified[1]
+    with _jwt_stage.time():
+        return decode_access_token(token)
+
+
+async def current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+) -> CachedUser:
+    """Authenticate the bearer token and return the caller's user record"""
+    claims = verified_claims(request, credentials.credentials)
+    user = await resolve_user(claims, db)
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Account is disabled")
+    return user
@@ -0,0 +1,257 @@
+"""
+Near-duplicate detection for homework photos.
+
+When a class gets the same printed worksheet, many students upload the same
+page: forwarded copies, rescans, re-photos. Each upload gets a 256-bit
+difference hash (dHash) of its downscaled image in the image worker: the
+image is shrunk to 17x16 grey pixels and every bit records whether a pixel
+is brighter than its left neighbour. Re-encoding, resizing, brightness and
+small crops flip a few bits; a different page flips about half. Pages of
+one template that differ only in their numbers can be as close as 2-3 bits,
+closer than two photos of the same page, so the fingerprint alone can't
+tell them apart.
+
+ImageAnswerCache keeps the analysis of recent images in a fixed-size NumPy
+ring of fingerprints. An upload reuses an analysis when its message
+normalizes the same and the text read from it (OCR) is the same, within
+IMAGE_CACHE_MAX_DISTANCE bits; an image without readable text only reuses
+one within IMAGE_CACHE_UNREAD_MAX_DISTANCE bits (by default the same
+fingerprint). A lookup is a vectorized XOR + popcount scan: the first
+64-bit word filters the candidates (a match can't differ in more than
+max_distance bits there either), the other three words are only compared
+for those. Near-duplicate uploads in flight at the same moment share one
+analysis.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import Counter
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from answer_cache import normalize_question
+from metrics import stage
+
+# Image answer cache configuration (override via environment)
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "True").lower() == "true"
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "20000"))
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "64"))
+IMAGE_CACHE_TTL_SECONDS = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Out of 256 bits: re-sent copies of a page land within ~20 and most re-photos too, but the same template
+# with other numbers can be just 2-3 apart, so reuse beyond the same fingerprint needs the same text
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "20"))
+IMAGE_CACHE_UNREAD_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_UNREAD_MAX_DISTANCE", "0"))
+
+HASH_SIZE = 16
+HASH_BYTES = HASH_SIZE * HASH_SIZE // 8
+_WORDS = HASH_BYTES // 8
+
+# Per-entry overhead (slot arrays, list slots, string headers) on top of the texts
+_ENTRY_OVERHEAD_BYTES = 256
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    # NumPy < 2.0: count through a byte table
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        return _BYTE_BITS[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+def dhash(image: Image.Image) -> bytes:
+    """256-bit difference hash of an image"""
+    pixels = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX), dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes()
+
+
+def text_key(text: Optional[str]) -> Optional[bytes]:
+    """Checksum of the text read from an image (case and spacing ignored), or None without text"""
+    words = " ".join(text.lower().split()) if text else ""
+    return hashlib.blake2b(words.encode(), digest_size=16).digest() if words else None
+
+
+def hamming(a: bytes, b: bytes) -> int:
+    """Number of differing bits between two fingerprints"""
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).bit_count()
+
+
+class FingerprintIndex:
+    """Fixed-capacity slots of fingerprints with a vectorized Hamming-distance scan"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        # One row per 64-bit word, so each word of every fingerprint is contiguous for the scan
+        self._words = np.zeros((_WORDS, self.capacity), dtype=np.uint64)
+        self._live = np.zeros(self.capacity, dtype=bool)
+        # Slots past the highest one ever used are never scanned
+        self._filled = 0
+
+    def __len__(self) -> int:
+        return int(self._live[:self._filled].sum())
+
+    def set(self, slot: int, fingerprint: bytes):
+        self._words[:, slot] = np.frombuffer(fingerprint, dtype=np.uint64)
+        self._live[slot] = True
+        self._filled = max(self._filled, slot + 1)
+
+    def discard(self, slot: int):
+        self._live[slot] = False
+
+    def search(self, fingerprint: bytes, max_distance: int) -> List[Tuple[int, int]]:
+        """(distance, slot) of every live fingerprint within max_distance bits, nearest first"""
+        query = np.frombuffer(fingerprint, dtype=np.uint64)
+        distance = _popcount(self._words[0, :self._filled] ^ query[0])
+        slots = np.flatnonzero(distance <= max_distance)
+        if not slots.size:
+            return []
+        distance = distance[slots].astype(np.int32)
+        for word in range(1, _WORDS):
+            distance += _popcount(self._words[word, slots] ^ query[word])
+        keep = (distance <= max_distance) & self._live[slots]
+        slots, distance = slots[keep], distance[keep]
+        order = np.argsort(distance, kind="stable")
+        return list(zip(distance[order].tolist(), slots[order].tolist()))
+
+
+class ImageAnswerCache:
+    """Analyses of recent homework images, reused for near-duplicate uploads with the same message and text"""
+
+    def __init__(
+        self,
+        max_entries: int = IMAGE_CACHE_MAX_ENTRIES,
+        max_bytes: int = int(IMAGE_CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds: int = IMAGE_CACHE_TTL_SECONDS,
+        max_distance: int = IMAGE_CACHE_MAX_DISTANCE,
+        unread_max_distance: int = IMAGE_CACHE_UNREAD_MAX_DISTANCE,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.unread_max_distance = unread_max_distance
+        self.max_entries = max(1, max_entries)
+        # (fingerprint, message, text key, task)
+        self._in_flight: List[Tuple[bytes, str, Optional[bytes], asyncio.Future]] = []
+        self._counters = Counter()
+        self._lookup_stage = stage("image_dedup_lookup")
+        self.clear()
+
+    def clear(self):
+        """Drop every entry"""
+        self.index = FingerprintIndex(self.max_entries)
+        # Slots are filled in ring order, so the oldest entries follow the next slot to fill
+        self._next = 0
+        self._messages: List[Optional[str]] = [None] * self.max_entries
+        self._texts: List[Optional[bytes]] = [None] * self.max_entries
+        self._answers: List[Optional[str]] = [None] * self.max_entries
+        self._expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._sizes = np.zeros(self.max_entries, dtype=np.int64)
+        self._bytes = 0
+
+    def _distance_limit(self, key: Optional[bytes]) -> int:
+        return self.max_distance if key is not None else self.unread_max_distance
+
+    def get(self, fingerprint: bytes, message: Optional[str], text: Optional[str] = None) -> Optional[str]:
+        """Analysis stored for a near-duplicate image with the same message and text, or None"""
+        normalized = normalize_question(message or "")
+        key = text_key(text)
+        now = time.time()
+        with self._lookup_stage.time():
+            matches = self.index.search(fingerprint, self._distance_limit(key))
+        for distance, slot in matches:
+            if self._messages[slot] != normalized or self._texts[slot] != key:
+                continue
+            if self._expires[slot] <= now:
+                self._evict(slot)
+                self._counters["expired"] += 1
+                continue
+            self._counters["exact_hits" if distance == 0 else "near_hits"] += 1
+            return self._answers[slot]
+        self._counters["misses"] += 1
+        return None
+
+    def put(self, fingerprint: bytes, message: Optional[str], answer: str, text: Optional[str] = None):
+        """Store the analysis of an image"""
+        normalized = normalize_question(message or "")
+        size = len(answer.encode()) + len(normalized.encode()) + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        slot = self._next
+        # The slot's own entry goes first, then the next oldest until the new one fits the byte budget
+        oldest = slot
+        while self._answers[slot] is not None or self._bytes + size > self.max_bytes:
+            if self._answers[oldest] is not None:
+                self._evict(oldest)
+                self._counters["evictions"] += 1
+            oldest = (oldest + 1) % self.max_entries
+
+        self.index.set(slot, fingerprint)
+        self._next = (slot + 1) % self.max_entries
+        self._messages[slot] = normalized
+        self._texts[slot] = text_key(text)
+        self._answers[slot] = answer
+        self._expires[slot] = time.time() + self.ttl_seconds
+        self._sizes[slot] = size
+        self._bytes += size
+        self._counters["stores"] += 1
+
+    def _evict(self, slot: int):
+        self.index.discard(slot)
+        self._bytes -= int(self._sizes[slot])
+        self._sizes[slot] = 0
+        self._messages[slot] = None
+        self._texts[slot] = None
+        self._answers[slot] = None
+
+    async def share(self, fingerprint: bytes, message: Optional[str],
+                    analyze: Callable[[], Awaitable[Tuple[str, bool]]], text: Optional[str] = None) -> Tuple[str, bool]:
+        """Run analyze(), or join a running analysis of a near-duplicate with the same message and text.
+
+        analyze returns (answer, fallback), and so does share; fallback answers aren't stored.
+        """
+        normalized = normalize_question(message or "")
+        key = text_key(text)
+        for other, other_message, other_key, task in self._in_flight:
+            if (other_message == normalized and other_key == key
+                    and hamming(fingerprint, other) <= self._distance_limit(key)):
+                self._counters["shared"] += 1
+                return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(analyze())
+        flight = (fingerprint, normalized, key, task)
+        self._in_flight.append(flight)
+        try:
+            answer, fallback = await asyncio.shield(task)
+        finally:
+            if flight in self._in_flight:
+                self._in_flight.remove(flight)
+        if not fallback:
+            self.put(fingerprint, message, answer, text)
+        return answer, fallback
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size; misses include uploads that then shared an in-flight analysis"""
+        hits = self._counters["exact_hits"] + self._counters["near_hits"] + self._counters["shared"]
+        lookups = self._counters["exact_hits"] + self._counters["near_hits"] + self._counters["misses"]
+        return {
+            "enabled": IMAGE_CACHE_ENABLED,
+            "entries": len(self.index),
+            "bytes": self._bytes,
+            "max_distance": self.max_distance,
+            "unread_max_distance": self.unread_max_distance,
+            "exact_hits": self._counters["exact_hits"],
+            "near_hits": self._counters["near_hits"],
+            "shared": self._counters["shared"],
+            "misses": self._counters["misses"],
+            "stores": self._counters["stores"],
+            "evictions": self._counters["evictions"],
+            "expired": self._counters["expired"],
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+image_cache = ImageAnswerCache()
@@ -0,0 +1,175 @@
+"""
+Homework image preprocessing.
+
+Uploads are validated, EXIF-rotated, downscaled and re-encoded to a compact
+JPEG or WebP before they go to the AI service. The CPU-heavy work runs in a
+process pool so a 12 MP phone photo never blocks the event loop.
+"""
+
+import asyncio
+import base64
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+from image_fingerprint import dhash
+from image_text import ExtractedText, extract_text, ocr_available
+from metrics import stage
+
+# Image pipeline configuration (override via environment)
+IMAGE_MAX_UPLOAD_MB = float(os.getenv("IMAGE_MAX_UPLOAD_MB", "10"))
+IMAGE_MAX_UPLOAD_BYTES = int(IMAGE_MAX_UPLOAD_MB * 1024 * 1024)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "False").lower() == "true"
+# 0 runs preprocessing in the default thread pool instead of worker processes
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF", "MPO"}
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+class ImageValidationError(ValueError):
+    """An upload that can't be processed; status_code is the HTTP status to return"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PreparedImage(NamedTuple):
+    base64: str
+    mime_type: str
+    width: int
+    height: int
+    original_width: int
+    original_height: int
+    bytes_in: int
+    bytes_out: int
+    fingerprint: bytes  # dHash of the downscaled image, for near-duplicate lookups
+    text: Optional[ExtractedText] = None  # OCR result, when requested and available
+
+
+def preprocess_image(
+    data: bytes,
+    max_edge: int = IMAGE_MAX_EDGE,
+    output_format: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+    grayscale: bool = IMAGE_GRAYSCALE,
+    max_pixels: int = IMAGE_MAX_PIXELS,
+    ocr: bool = False,
+) -> PreparedImage:
+    """Validate, orient, downscale and re-encode one uploaded image; ocr=True also extracts its text"""
+    if len(data) > IMAGE_MAX_UPLOAD_BYTES:
+        raise ImageValidationError(f"Image is larger than {IMAGE_MAX_UPLOAD_MB:g} MB", status_code=413)
+
+    try:
+        # Opening only parses the header, so the pixel limit is checked before decoding
+        image = Image.open(io.BytesIO(data))
+    except Exception:
+        raise ImageValidationError("Unsupported or corrupt image file")
+
+    if image.format not in ALLOWED_FORMATS:
+        raise ImageValidationError(f"Unsupported image format: {image.format}")
+
+    original_width, original_height = image.size
+    if original_width * original_height > max_pixels:
+        raise ImageValidationError(
+            f"Image has {original_width * original_height:,} pixels; the limit is {max_pixels:,}",
+            status_code=413,
+        )
+
+    try:
+        # JPEG can decode straight to a reduced size, which skips most of the work
+        image.draft("L" if grayscale else "RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+
+        if grayscale:
+            image = image.convert("L")
+        elif image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        fingerprint = dhash(image)
+
+        buffered = io.BytesIO()
+        if output_format == "WEBP":
+            image.save(buffered, format="WEBP", quality=quality, method=4)
+        else:
+            output_format = "JPEG"
+            image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        raise ImageValidationError(f"Could not process image: {e}")
+
+    text = None
+    if ocr:
+        try:
+            text = extract_text(image)
+        except Exception as e:
+            # The image can still be answered by the vision path
+            print(f"OCR error: {e}")
+
+    encoded = buffered.getvalue()
+    return PreparedImage(
+        base64=base64.b64encode(encoded).decode(),
+        mime_type=MIME_TYPES[output_format],
+        width=image.width,
+        height=image.height,
+        original_width=original_width,
+        original_height=original_height,
+        bytes_in=len(data),
+        bytes_out=len(encoded),
+        fingerprint=fingerprint,
+        text=text,
+    )
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_preprocess_stage = stage("image_preprocessing")
+_ocr_stage = stage("ocr")
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if IMAGE_WORKERS <= 0:
+        return None
+    if _executor is None:
+        # spawn avoids forking a process that already runs the event loop's threads
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def prepare_image(data: bytes, grayscale: Optional[bool] = None) -> PreparedImage:
+    """Preprocess an upload off the event loop, with OCR when it is available"""
+    job = partial(preprocess_image, data, grayscale=IMAGE_GRAYSCALE if grayscale is None else grayscale,
+                  ocr=ocr_available())
+    started = time.perf_counter()
+    prepared = await asyncio.get_running_loop().run_in_executor(_get_executor(), job)
+    # Preprocessing includes any wait for a free worker; OCR is timed in the worker and reported apart
+    elapsed = time.perf_counter() - started
+    if prepared.text is not None:
+        _ocr_stage.observe(prepared.text.seconds)
+        elapsed -= prepared.text.seconds
+    _preprocess_stage.observe(elapsed)
+    return prepared
+
+
+def shutdown_image_pool():
+    """Stop the worker processes (called on application shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
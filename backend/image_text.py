@@ -0,0 +1,148 @@
+"""
+Local text extraction (OCR) for homework photos.
+
+Printed worksheets are mostly text, so an upload whose text can be read
+with confidence is answered as a text question: subject detection, the
+local solver, the answer cache and the text model all work on it, and the
+image-analysis (vision) path is only needed for handwriting, diagrams and
+unreadable photos.
+
+OCR runs with Tesseract (the optional pytesseract package plus the
+tesseract binary) in the image worker pool, on the preprocessed image.
+Without them, every image takes the vision path as before.
+"""
+
+import os
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+# OCR configuration (override via environment)
+OCR_ENABLED = os.getenv("OCR_ENABLED", "True").lower() == "true"
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Mean word confidence (0-100) needed to answer from the text alone
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "75"))
+OCR_MIN_WORDS = int(os.getenv("OCR_MIN_WORDS", "4"))
+# Text longer than this is cut before it becomes the question (the prompt budget trims further)
+OCR_MAX_CHARS = int(os.getenv("OCR_MAX_CHARS", "2000"))
+
+# Lines of the extracted text echoed back to the student
+_QUOTED_LINES = 8
+_WORD = re.compile(r"\w", re.UNICODE)
+
+
+class ExtractedText(NamedTuple):
+    text: str
+    confidence: float  # mean word confidence, 0-100
+    words: int
+    seconds: float     # OCR time in the worker
+
+
+@lru_cache(maxsize=1)
+def ocr_available() -> bool:
+    """Whether pytesseract and the tesseract binary are installed"""
+    if not OCR_ENABLED:
+        return False
+    try:
+        import pytesseract
+
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        # Not installed, or the binary isn't on PATH
+        return False
+
+
+def extract_text(image: Image.Image) -> ExtractedText:
+    """OCR an image (runs in the image worker); lines are kept in reading order"""
+    import pytesseract
+
+    started = time.perf_counter()
+    gray = ImageOps.autocontrast(image.convert("L"))
+    # psm 6: a single uniform block of text, the usual worksheet layout
+    data = pytesseract.image_to_data(gray, lang=OCR_LANG, config="--psm 6", output_type=pytesseract.Output.DICT)
+
+    lines = {}
+    confidences = []
+    for word, confidence, block, paragraph, line in zip(
+        data["text"], data["conf"], data["block_num"], data["par_num"], data["line_num"]
+    ):
+        word = word.strip()
+        confidence = float(confidence)
+        if not word or confidence < 0:
+            continue
+        lines.setdefault((block, paragraph, line), []).append(word)
+        # Punctuation-only tokens carry little information either way
+        if _WORD.search(word):
+            confidences.append(confidence)
+
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return ExtractedText(
+        text=text[:OCR_MAX_CHARS],
+        confidence=sum(confidences) / len(confidences) if confidences else 0.0,
+        words=len(confidences),
+        seconds=time.perf_counter() - started,
+    )
+
+
+def vision_reason(extracted: Optional[ExtractedText]) -> Optional[str]:
+    """Why an image needs the vision path, or None if it can be answered from its text"""
+    if extracted is None:
+        return "ocr_unavailable"
+    if extracted.words < OCR_MIN_WORDS:
+        return "no_text"
+    if extracted.confidence < OCR_MIN_CONFIDENCE:
+        return "low_confidence"
+    return None
+
+
+def text_question(extracted: ExtractedText, message: Optional[str]) -> str:
+    """The text question for an image: the student's message plus what was read"""
+    if message:
+        return f"{message}\n\nFrom my homework photo:\n{extracted.text}"
+    return f"Please help me with this homework question:\n{extracted.text}"
+
+
+def quote_text(extracted: ExtractedText) -> str:
+    """The start of the extracted text as a Markdown quote, so students can spot misreadings"""
+    lines = [line for line in extracted.text.splitlines() if line.strip()]
+    quoted = "\n".join(f"> {line}" for line in lines[:_QUOTED_LINES])
+    if len(lines) > _QUOTED_LINES:
+        quoted += "\n> ..."
+    return quoted
+
+
+class ImageTextStats:
+    """How images were answered: from their text, or by the vision path and why"""
+
+    def __init__(self):
+        self._counters = Counter()
+        self._confidence_sum = 0.0
+
+    def record(self, path: str, extracted: Optional[ExtractedText]):
+        """path is "text", or the vision_reason() the image went to the vision path for"""
+        self._counters[path] += 1
+        if extracted is not None:
+            self._counters["extracted"] += 1
+            self._confidence_sum += extracted.confidence
+
+    def stats(self) -> dict:
+        """Images per path, the share answered from text, and the mean OCR confidence"""
+        vision = {reason: self._counters[reason] for reason in ("low_confidence", "no_text", "ocr_unavailable")}
+        images = self._counters["text"] + sum(vision.values())
+        extracted = self._counters["extracted"]
+        return {
+            "ocr_available": ocr_available(),
+            "images": images,
+            "text_path": self._counters["text"],
+            "vision_path": vision,
+            "text_share": round(self._counters["text"] / images, 4) if images else 0.0,
+            "avg_confidence": round(self._confidence_sum / extracted, 1) if extracted else 0.0,
+        }
+
+
+image_text_stats = ImageTextStats()
@@ -0,0 +1,454 @@
+"""
+Local knowledge base of worked examples.
+
+Built over the few-shot examples in SUBJECT_TRAINING_DATA plus curated
+Q&A corpora (JSONL, see build_knowledge_base.py). A question is matched
+against it in milliseconds with no upstream call:
+
+- a near-identical question (KNOWLEDGE_BASE_ANSWER_CONFIDENCE, same
+  numbers and operators, compatible subject, every term and question word
+  of it in the stored question) is answered with the stored worked example
+  directly;
+- when the AI service is unreachable, the best example above
+  KNOWLEDGE_BASE_EXAMPLE_CONFIDENCE is shown with the fallback text.
+
+Ranking is BM25 over the question (weighted QUESTION_WEIGHT times) and
+answer text. Term weights are computed at build time and each term's postings
+are stored highest weight first, so a query only sums the leading postings
+of its terms. An optional vector index of hashed character
+trigrams of each question catches misspellings and word forms BM25 misses;
+the two rankings are merged by reciprocal rank fusion. Confidence is the
+IDF-weighted overlap between the question and a stored question, or their
+vector cosine.
+
+On disk an index is a directory: meta.json (settings and vocabulary), .npy
+arrays opened with mmap_mode="r" and documents.jsonl read through mmap,
+so opening is instant, workers share the page cache, and only the pages a
+query touches are read.
+"""
+
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import zlib
+from array import array
+from collections import Counter
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+from answer_cache import normalize_question
+from metrics import stage
+
+# Knowledge base configuration (override via environment)
+KNOWLEDGE_BASE_ENABLED = os.getenv("KNOWLEDGE_BASE_ENABLED", "True").lower() == "true"
+# Index directory written by build_knowledge_base.py; without one the index is built in memory at startup
+KNOWLEDGE_BASE_PATH = os.getenv("KNOWLEDGE_BASE_PATH", "")
+# Confidence (0-1) to answer from the knowledge base instead of the AI service
+KNOWLEDGE_BASE_ANSWER_CONFIDENCE = float(os.getenv("KNOWLEDGE_BASE_ANSWER_CONFIDENCE", "0.85"))
+# Confidence (0-1) to show a worked example when the AI service is unavailable
+KNOWLEDGE_BASE_EXAMPLE_CONFIDENCE = float(os.getenv("KNOWLEDGE_BASE_EXAMPLE_CONFIDENCE", "0.3"))
+# Dimensions of the trigram vectors of an in-memory index (0 disables them)
+KNOWLEDGE_BASE_VECTOR_DIM = int(os.getenv("KNOWLEDGE_BASE_VECTOR_DIM", "128"))
+
+# Curated Q&A shipped with the backend, indexed when no KNOWLEDGE_BASE_PATH is set
+BUNDLED_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "curated_qa.jsonl")
+
+FORMAT_VERSION = 1
+K1 = 1.2
+B = 0.75
+QUESTION_WEIGHT = 3
+# Candidates taken from each ranking before fusion, and the fusion constant
+_CANDIDATES = 20
+_RRF_K = 60
+# Postings read per query term; the rest of a very common term's postings barely move a score
+_MAX_POSTINGS_PER_TERM = 10_000
+
+_STOPWORDS = frozenset("""
+a an the is are was were be been am do does did i me my you your we our it its this that these those
+of to in on at by for with from and or but so if as what whats which who whom how why when where can could
+would should will shall please help tell explain show give about into than then there many much have has had s t
+""".split())
+_NUMBER_OR_OPERATOR = re.compile(r"\d|[+\-*/=×÷^%<>()\[\]{}]")
+# Stopwords for ranking, but "why did ..." isn't answered by "when did ..."
+_QUESTION_WORDS = frozenset("what whats which who whom whose how why when where".split())
+
+
+class KnowledgeDocument(NamedTuple):
+    question: str
+    answer: str
+    subject: Optional[str] = None
+    source: str = ""
+
+
+class KnowledgeMatch(NamedTuple):
+    document: KnowledgeDocument
+    score: float       # BM25 score (0 for a match found by the vector index alone)
+    confidence: float  # 0-1, see module docstring
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def terms(text: str) -> List[str]:
+    """Index terms of a text: normalized words (stemmed, no stopwords), numbers and operators"""
+    return [_stem(token) for token in normalize_question(text).split() if token not in _STOPWORDS]
+
+
+def signature(text: str) -> tuple:
+    """The numbers and operators of a text, in order; a stored answer only fits the same ones"""
+    return tuple(token for token in normalize_question(text).split() if _NUMBER_OR_OPERATOR.match(token))
+
+
+def covers(stored: str, question: str) -> bool:
+    """Whether a stored question asks everything the question does: all its terms and question words"""
+    asked = set(terms(question)) | (set(normalize_question(question).split()) & _QUESTION_WORDS)
+    return asked <= set(terms(stored)) | set(normalize_question(stored).split())
+
+
+def embed(text: str, dim: int) -> np.ndarray:
+    """Unit vector of the hashed, signed character trigrams of a question's terms"""
+    vector = np.zeros(dim, dtype=np.float32)
+    # Trigrams of stopwords ("what is the") would make unrelated questions look alike
+    padded = f"  {' '.join(terms(text))} "
+    for i in range(len(padded) - 2):
+        bucket = zlib.crc32(padded[i:i + 3].encode())
+        vector[bucket % dim] += 1.0 if bucket & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def training_documents(training_data: dict) -> List[KnowledgeDocument]:
+    """The few-shot examples of SUBJECT_TRAINING_DATA as documents"""
+    return [
+        KnowledgeDocument(example["question"], example["response"], subject, "training_data")
+        for subject, data in training_data.items()
+        for example in data["examples"]
+    ]
+
+
+def load_corpus(path: str) -> Iterator[KnowledgeDocument]:
+    """Documents of a JSONL corpus: {"question", "answer", optional "subject" and "source"} per line"""
+    with open(path, encoding="utf-8") as corpus:
+        for number, line in enumerate(corpus, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield KnowledgeDocument(
+                    record["question"], record["answer"], record.get("subject") or None,
+                    record.get("source") or os.path.basename(path),
+                )
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"{path}:{number}: invalid Q&A record ({e})")
+
+
+def _top(scores: np.ndarray, count: int) -> np.ndarray:
+    """Indexes of the count highest scores, highest first"""
+    if len(scores) > count:
+        top = np.argpartition(-scores, count - 1)[:count]
+        return top[np.argsort(-scores[top], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+
+def _check_replaceable(path: str):
+    """Refuse to overwrite a directory that isn't a knowledge base index"""
+    if not os.path.exists(path):
+        return
+    if not os.path.isdir(path):
+        raise ValueError(f"{path}: not a directory")
+    if not os.listdir(path):
+        return
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        meta = None
+    if not isinstance(meta, dict) or meta.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{path}: not a knowledge base index (format {FORMAT_VERSION}), refusing to replace it")
+
+
+def _idf(document_frequency: int, documents: int) -> float:
+    return math.log(1 + (documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+class KnowledgeBase:
+    """BM25 (+ optional vector) index of worked examples, in memory or memory-mapped from disk"""
+
+    def __init__(self, meta: dict, arrays: dict, documents):
+        self.meta = meta
+        self.vocabulary = meta["vocabulary"]  # term -> [first posting, end posting, idf]
+        self.subjects = meta["subjects"]
+        self.size = meta["documents"]
+        self.path = meta.get("path")
+        self._postings_docs = arrays["postings_docs"]
+        self._postings_weights = arrays["postings_weights"]
+        self._doc_offsets = arrays["doc_offsets"]
+        self._vectors = arrays.get("vectors")
+        self._documents = documents  # documents.jsonl contents (bytes or mmap)
+        self._unknown_idf = _idf(0, max(1, self.size))
+        self._counters = Counter()
+        self._lookup_stage = stage("knowledge_base_lookup")
+        # Why KNOWLEDGE_BASE_PATH couldn't be opened, when this index was built in memory instead
+        self.open_error: Optional[str] = None
+
+    @classmethod
+    def build(cls, documents: Iterable[KnowledgeDocument], vector_dim: int = KNOWLEDGE_BASE_VECTOR_DIM) -> "KnowledgeBase":
+        """Index documents in memory"""
+        documents = list(documents)
+        count = len(documents)
+        subjects = sorted({document.subject for document in documents if document.subject})
+
+        # One posting per (document, term), kept in flat typed arrays so large corpora fit in memory
+        term_ids = {}
+        posting_docs, posting_terms = array("I"), array("I")
+        posting_frequencies = array("f")
+        lengths = np.zeros(count, dtype=np.float32)
+        for number, document in enumerate(documents):
+            question_terms = Counter(terms(document.question))
+            frequencies = Counter(terms(document.answer))
+            for term, occurrences in question_terms.items():
+                frequencies[term] += QUESTION_WEIGHT * occurrences
+            lengths[number] = sum(frequencies.values())
+            for term, frequency in frequencies.items():
+                posting_docs.append(number)
+                posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                posting_frequencies.append(frequency)
+
+        docs = np.frombuffer(posting_docs, dtype=np.uint32)
+        term_of = np.frombuffer(posting_terms, dtype=np.uint32)
+        frequency = np.frombuffer(posting_frequencies, dtype=np.float32)
+
+        # BM25 weight of every posting, then postings grouped by term, highest weight first
+        document_frequency = np.bincount(term_of, minlength=len(term_ids))
+        idf = np.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if count else 1.0
+        weights = idf[term_of] * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * lengths[docs] / average_length))
+        order = np.lexsort((-weights, term_of))
+        ends = np.cumsum(document_frequency)
+        vocabulary = {
+            term: [int(ends[term_id] - document_frequency[term_id]), int(ends[term_id]), float(idf[term_id])]
+            for term, term_id in term_ids.items()
+        }
+
+        lines = [json.dumps(document._asdict(), ensure_ascii=False).encode() + b"\n" for document in documents]
+        arrays = {
+            "postings_docs": docs[order],
+            "postings_weights": weights[order].astype(np.float32),
+            "doc_offsets": np.cumsum([0] + [len(line) for line in lines], dtype=np.uint64),
+        }
+        if vector_dim > 0:
+            # float32: NumPy has no BLAS path for float16, which scans over 10x slower
+            vectors = np.zeros((count, vector_dim), dtype=np.float32)
+            for number, document in enumerate(documents):
+                vectors[number] = embed(document.question, vector_dim)
+            arrays["vectors"] = vectors
+        meta = {
+            "format": FORMAT_VERSION,
+            "documents": count,
+            "k1": K1,
+            "b": B,
+            "question_weight": QUESTION_WEIGHT,
+            "vector_dim": max(0, vector_dim),
+            "subjects": subjects,
+            "vocabulary": vocabulary,
+        }
+        return cls(meta, arrays, b"".join(lines))
+
+    def save(self, path: str):
+        """Write the index to a directory, swapped in as a whole once complete; an existing
+        directory is only replaced if it is empty or holds an index of this format"""
+        _check_replaceable(path)
+        path = os.path.normpath(path)
+        staging, old = f"{path}.tmp-{os.getpid()}", f"{path}.old-{os.getpid()}"
+        os.makedirs(staging)
+        try:
+            self._write(staging)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if not os.path.exists(path):
+            os.rename(staging, path)
+            return
+        # Rename the old index aside, then the new one in: workers that opened the old one keep
+        # reading its (unlinked) files through their maps, and the path never holds a partial index
+        os.rename(path, old)
+        try:
+            os.rename(staging, path)
+        except Exception:
+            os.rename(old, path)
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _write(self, staging: str):
+        """Write the arrays, documents and meta.json into an empty directory"""
+        arrays = {
+            "postings_docs": self._postings_docs,
+            "postings_weights": self._postings_weights,
+            "doc_offsets": self._doc_offsets,
+        }
+        if self._vectors is not None:
+            arrays["vectors"] = self._vectors
+        for name, values in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(values))
+        with open(os.path.join(staging, "documents.jsonl"), "wb") as documents:
+            documents.write(self._documents[:])
+        meta = {key: value for key, value in self.meta.items() if key != "path"}
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file, ensure_ascii=False)
+
+    @classmethod
+    def open(cls, path: str) -> "KnowledgeBase":
+        """Memory-map an index written by save()"""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported knowledge base format {meta.get('format')}")
+        meta["path"] = path
+        arrays = {}
+        for name in ("postings_docs", "postings_weights", "doc_offsets", "vectors"):
+            file = os.path.join(path, f"{name}.npy")
+            if os.path.exists(file):
+                arrays[name] = np.load(file, mmap_mode="r")
+        documents = b""
+        with open(os.path.join(path, "documents.jsonl"), "rb") as documents_file:
+            if os.fstat(documents_file.fileno()).st_size:
+                documents = mmap.mmap(documents_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(meta, arrays, documents)
+
+    def document(self, number: int) -> KnowledgeDocument:
+        start, end = int(self._doc_offsets[number]), int(self._doc_offsets[number + 1])
+        return KnowledgeDocument(**json.loads(self._documents[start:end]))
+
+    def search(self, question: str, limit: int = 3) -> List[KnowledgeMatch]:
+        """Best matches for a question, best first"""
+        if not self.size:
+            return []
+        with self._lookup_stage.time():
+            return self._search(question, limit)
+
+    def _search(self, question: str, limit: int) -> List[KnowledgeMatch]:
+        query_terms = set(terms(question))
+        parts = []
+        for term in query_terms:
+            entry = self.vocabulary.get(term)
+            if entry is not None:
+                start, end, _ = entry
+                # Postings are highest weight first: past the cap only weak matches of a common term are left
+                parts.append(slice(start, min(end, start + _MAX_POSTINGS_PER_TERM)))
+
+        # BM25: sum each query term's precomputed weights per document
+        candidates = {}  # document -> [fused rank score, BM25 score]
+        if parts:
+            docs = np.concatenate([self._postings_docs[part] for part in parts])
+            weights = np.concatenate([self._postings_weights[part] for part in parts])
+            if len(docs) * 16 < self.size:
+                matched, inverse = np.unique(docs, return_inverse=True)
+                scores = np.bincount(inverse, weights=weights)
+            else:
+                # Many postings: accumulating over every document beats sorting them
+                scores = np.bincount(docs, weights=weights, minlength=self.size)
+                matched = np.flatnonzero(scores)
+                scores = scores[matched]
+            top = _top(scores, _CANDIDATES)
+            for rank, (number, score) in enumerate(zip(matched[top].tolist(), scores[top].tolist())):
+                candidates[number] = [1 / (_RRF_K + rank), score]
+
+        # Vectors: nearest questions by cosine, fused with the BM25 ranking by rank. Skipped when
+        # the best BM25 match is already confident, so answerable questions never scan every vector.
+        cosines = {}
+        best = next(iter(candidates), None)
+        confident = best is not None and self._overlap(query_terms, self.document(best)) >= KNOWLEDGE_BASE_ANSWER_CONFIDENCE
+        if self._vectors is not None and len(self._vectors) and not confident:
+            query = embed(question, self._vectors.shape[1])
+            similarity = self._vectors @ query
+            for rank, number in enumerate(_top(similarity, _CANDIDATES).tolist()):
+                cosines[number] = float(similarity[number])
+                candidates.setdefault(number, [0.0, 0.0])[0] += 1 / (_RRF_K + rank)
+            for number in candidates.keys() - cosines.keys():
+                cosines[number] = float(np.dot(self._vectors[number], query))
+
+        matches = []
+        for number, (_, score) in sorted(candidates.items(), key=lambda item: item[1][0], reverse=True)[:limit]:
+            document = self.document(number)
+            confidence = max(self._overlap(query_terms, document), cosines.get(number, 0.0))
+            matches.append(KnowledgeMatch(document, round(score, 4), round(min(1.0, confidence), 4)))
+        return matches
+
+    def _overlap(self, query_terms: set, document: KnowledgeDocument) -> float:
+        """IDF-weighted Dice overlap of a question's terms and a stored question's"""
+        stored = set(terms(document.question))
+
+        def mass(selected) -> float:
+            return sum(self.vocabulary[term][2] if term in self.vocabulary else self._unknown_idf for term in selected)
+
+        total = mass(query_terms) + mass(stored)
+        return 2 * mass(query_terms & stored) / total if total else 0.0
+
+    def answer(self, question: str, subject: Optional[str]) -> Optional[str]:
+        """A stored answer to a near-identical question, if confident enough to skip the AI service"""
+        self._counters["lookups"] += 1
+        for match in self.search(question, limit=1):
+            document = match.document
+            if (match.confidence >= KNOWLEDGE_BASE_ANSWER_CONFIDENCE
+                    and (not subject or not document.subject or subject == document.subject)
+                    and signature(question) == signature(document.question)
+                    and covers(document.question, question)):
+                self._counters["answered"] += 1
+                return document.answer
+        return None
+
+    def example(self, question: str) -> Optional[KnowledgeMatch]:
+        """The best worked example for a question the AI service couldn't answer"""
+        for match in self.search(question, limit=1):
+            if match.confidence >= KNOWLEDGE_BASE_EXAMPLE_CONFIDENCE:
+                self._counters["examples"] += 1
+                return match
+        self._counters["no_example"] += 1
+        return None
+
+    def stats(self) -> dict:
+        """Index size and how often it answered or supplied a fallback example"""
+        lookups = self._counters["lookups"]
+        return {
+            "enabled": KNOWLEDGE_BASE_ENABLED,
+            "path": self.path,
+            "open_error": self.open_error,
+            "documents": self.size,
+            "terms": len(self.vocabulary),
+            "vector_dim": self.meta["vector_dim"],
+            "lookups": lookups,
+            "answered": self._counters["answered"],
+            "answer_rate": round(self._counters["answered"] / lookups, 4) if lookups else 0.0,
+            "fallback_examples": self._counters["examples"],
+            "fallbacks_without_example": self._counters["no_example"],
+        }
+
+
+def open_knowledge_base(default_documents: List[KnowledgeDocument]) -> KnowledgeBase:
+    """The index at KNOWLEDGE_BASE_PATH, or one built in memory from default_documents and the bundled corpus"""
+    if not KNOWLEDGE_BASE_ENABLED:
+        return KnowledgeBase.build([], vector_dim=0)
+    open_error = None
+    if KNOWLEDGE_BASE_PATH:
+        try:
+            return KnowledgeBase.open(KNOWLEDGE_BASE_PATH)
+        except Exception as e:
+            # Kept in stats() and /metrics so a broken KNOWLEDGE_BASE_PATH isn't silently replaced
+            open_error = f"{type(e).__name__}: {e}"
+            print(f"Knowledge base error: could not open {KNOWLEDGE_BASE_PATH} ({e}), building one in memory")
+    documents = list(default_documents)
+    if os.path.exists(BUNDLED_CORPUS):
+        documents.extend(load_corpus(BUNDLED_CORPUS))
+    knowledge_base = KnowledgeBase.build(documents)
+    knowledge_base.open_error = open_error
+    return knowledge_base
@@ -0,0 +1,471 @@
+"""
+Deterministic step-by-step answers for simple arithmetic and linear
+equations, written in the same format as the AI's math answers.
+
+solve() handles questions like "What is 25 + 17?", "Can you help me
+multiply 234 by 12?", "2 + 3 × (4 - 1)" and "Solve for x: 3x - 7 = 2x + 4".
+Anything else (word problems, units, several unknowns, non-linear or
+unsolvable equations, huge numbers) returns None and is left to the AI.
+Arithmetic is exact: numbers are Fractions, so 0.1 + 0.2 is 0.3.
+"""
+
+import ast
+import re
+from fractions import Fraction
+from typing import NamedTuple, Optional
+
+# Keeps the solver to questions a student would type, and answers short
+_MAX_OPERATIONS = 6
+_MAX_DIGITS = 12
+_MAX_EXPONENT = 10
+_MAX_COLUMN_DIGITS = 6
+
+_STEP_EMOJIS = ("1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟")
+_PLACES = ("ones", "tens", "hundreds", "thousands", "ten thousands", "hundred thousands")
+
+# "Can you please work out", "Solve for x:", "What's" ...
+_LEAD_IN = re.compile(
+    r"^(?:(?:please|can you|could you|help me|and|now|ok|okay)[\s,]+)*"
+    r"(?:what(?:'s|’s|\s+is|\s+are)|whats|calculate|compute|work\s+out|evaluate|simplify|find|solve|how\s+much\s+is)?"
+    r"(?:\s+for\s+(?P<var>[a-z]))?\s*[:,]?\s*",
+    re.IGNORECASE,
+)
+# "multiply 234 by 12", "subtract 8 from 20"
+_VERB_FORM = re.compile(r"^(add|subtract|multiply|divide)\s+(\S+)\s+(and|to|from|by)\s+(\S+)$")
+_VERB_TEMPLATES = {
+    ("add", "and"): "{0} + {1}", ("add", "to"): "{0} + {1}", ("subtract", "from"): "{1} - {0}",
+    ("multiply", "by"): "{0} * {1}", ("multiply", "and"): "{0} * {1}", ("divide", "by"): "{0} / {1}",
+}
+_WORD_OPERATORS = (
+    (re.compile(r"\bmultiplied\s+by\b|\btimes\b"), "*"),
+    (re.compile(r"\bdivided\s+by\b"), "/"),
+    (re.compile(r"\bplus\b"), "+"),
+    (re.compile(r"\bminus\b"), "-"),
+    (re.compile(r"\bsquared\b"), "^2"),
+    (re.compile(r"\bcubed\b"), "^3"),
+)
+_SYMBOLS = str.maketrans({"×": "*", "÷": "/", "−": "-", "–": "-", "·": "*", "^": "^"})
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d{3}\b)")
+_TIMES_X = re.compile(r"(?<=[\d)])\s*x\s*(?=[\d(])")
+_ALLOWED = re.compile(r"[\d\s.+\-*/()^=a-z]+")
+
+
+class Solution(NamedTuple):
+    kind: str    # "arithmetic" or "equation"
+    answer: str  # e.g. "42" or "x = 4"
+    text: str    # the full step-by-step answer
+
+
+class _Unsolvable(Exception):
+    pass
+
+
+# Expression trees: ("num", Fraction) | ("var", name) | ("op", symbol, left, right)
+_PRECEDENCE = {"+": 1, "-": 1, "×": 2, "÷": 2, "^": 3}
+_AST_OPERATORS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "×", ast.Div: "÷", ast.Pow: "^"}
+_OPERATION_NAMES = {"+": "addition", "-": "subtraction", "×": "multiplication", "÷": "division", "^": "power"}
+
+
+def _normalize(question: str) -> Optional[tuple]:
+    """The bare expression or equation in a question, and the unknown it names"""
+    text = question.strip().translate(_SYMBOLS)
+    match = _LEAD_IN.match(text)
+    named_var = (match.group("var") or "").lower() or None
+    text = text[match.end():].lower().rstrip(" ?.!")
+    text = re.sub(r"\s*=\s*\?*$", "", text)  # "25 + 17 = ?"
+    text = _THOUSANDS.sub("", text)
+    for pattern, symbol in _WORD_OPERATORS:
+        text = pattern.sub(symbol, text)
+    verb = _VERB_FORM.match(text)
+    if verb:
+        template = _VERB_TEMPLATES.get((verb.group(1), verb.group(3)))
+        if template is None:
+            return None
+        text = template.format(verb.group(2), verb.group(4))
+    if "=" not in text:
+        text = _TIMES_X.sub(" * ", text)
+    if not text or not re.search(r"\d", text) or not _ALLOWED.fullmatch(text):
+        return None
+    return text, named_var
+
+
+def _to_tree(node, variables: set, budget: list):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        value = Fraction(str(node.value))
+        if abs(value) >= 10 ** _MAX_DIGITS:
+            raise _Unsolvable("number too large")
+        return ("num", value)
+    if isinstance(node, ast.Name):
+        variables.add(node.id)
+        return ("var", node.id)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = _to_tree(node.operand, variables, budget)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if operand[0] == "num":
+            return ("num", -operand[1])
+        return ("op", "×", ("num", Fraction(-1)), operand)
+    if isinstance(node, ast.BinOp) and type(node.op) in _AST_OPERATORS:
+        budget[0] -= 1
+        if budget[0] < 0:
+            raise _Unsolvable("too many operations")
+        return ("op", _AST_OPERATORS[type(node.op)],
+                _to_tree(node.left, variables, budget), _to_tree(node.right, variables, budget))
+    raise _Unsolvable("unsupported syntax")
+
+
+def _parse(text: str, variables: set, budget: list):
+    text = text.strip().replace("^", "**")
+    # Implicit multiplication: 2x, 3(x + 1), (x + 1)(x - 1), x(2)
+    text = re.sub(r"(\d)\s*(?=[a-z(])", r"\1*", text)
+    text = re.sub(r"([a-z)])\s*(?=[\d(])", r"\1*", text)
+    try:
+        return _to_tree(ast.parse(text, mode="eval").body, variables, budget)
+    except (SyntaxError, ValueError):
+        raise _Unsolvable("not an expression")
+
+
+def _fmt(value: Fraction) -> str:
+    """An exact number as a student would write it: 42, 2.5, 1/3"""
+    if value.denominator == 1:
+        return str(value.numerator)
+    denominator = value.denominator
+    for factor in (2, 5):
+        while denominator % factor == 0:
+            denominator //= factor
+    if denominator == 1:
+        decimal = f"{float(value):.10f}".rstrip("0")
+        if len(decimal.split(".")[1]) <= 6:
+            return decimal
+    return f"{value.numerator}/{value.denominator}"
+
+
+def _fmt_answer(value: Fraction) -> str:
+    text = _fmt(value)
+    return f"{text} (about {float(value):.4g})" if "/" in text else text
+
+
+def _coefficient(value: Fraction) -> str:
+    if value == 1:
+        return ""
+    if value == -1:
+        return "-"
+    text = _fmt(value)
+    return f"({text})" if "/" in text else text
+
+
+def _render(tree, parent: Optional[str] = None, right: bool = False, substitute: Optional[Fraction] = None) -> str:
+    """Write a tree out with only the brackets it needs (substitute replaces the unknown)"""
+    kind = tree[0]
+    if kind == "num":
+        text = _fmt(tree[1])
+        bracket = parent and ("/" in text or (tree[1] < 0 and (right or parent == "^")))
+        return f"({text})" if bracket else text
+    if kind == "var":
+        return tree[1] if substitute is None else _render(("num", substitute), parent, right)
+    _, symbol, left, rhs = tree
+    if symbol == "×" and left[0] == "num" and rhs[0] != "num":
+        # 2x, 3(x + 1); checking an answer: 2(4), 3(4 + 1)
+        inner = _render(rhs, "^", True, substitute)
+        if rhs[0] == "var" and substitute is not None and not inner.startswith("("):
+            inner = f"({inner})"
+        text = _coefficient(left[1]) + inner
+    else:
+        text = f"{_render(left, symbol, False, substitute)} {symbol} {_render(rhs, symbol, True, substitute)}"
+    if parent is None:
+        return text
+    precedence, outer = _PRECEDENCE[symbol], _PRECEDENCE[parent]
+    # Same level: brackets on the right (a - (b - c)), and on the left of a power
+    bracket = precedence < outer or (precedence == outer and (right != (parent == "^")))
+    return f"({text})" if bracket else text
+
+
+def _apply(symbol: str, left: Fraction, right: Fraction) -> Fraction:
+    if symbol == "+":
+        return left + right
+    if symbol == "-":
+        return left - right
+    if symbol == "×":
+        return left * right
+    if symbol == "÷":
+        if right == 0:
+            raise _Unsolvable("division by zero")
+        return left / right
+    if right.denominator != 1 or not 0 <= right <= _MAX_EXPONENT or (left == 0 and right == 0):
+        raise _Unsolvable("unsupported power")
+    return left ** int(right)
+
+
+def _evaluate(tree, value: Optional[Fraction] = None) -> Fraction:
+    if tree[0] == "num":
+        return tree[1]
+    if tree[0] == "var":
+        return value
+    return _apply(tree[1], _evaluate(tree[2], value), _evaluate(tree[3], value))
+
+
+def _reduce_once(tree):
+    """Work out the first operation due under BODMAS: (new tree, left, symbol, right, result)"""
+    _, symbol, left, right = tree
+    if left[0] == "num" and right[0] == "num":
+        result = _apply(symbol, left[1], right[1])
+        return ("num", result), left[1], symbol, right[1], result
+    if left[0] == "op":
+        new_left, *worked = _reduce_once(left)
+        return ("op", symbol, new_left, right), *worked
+    new_right, *worked = _reduce_once(right)
+    return ("op", symbol, left, new_right), *worked
+
+
+def _step(number: int, title: str, lines=()) -> str:
+    # Lines of a ``` block (fences included) are indented as they are; everything else is a bullet
+    body, fenced = "", False
+    for line in lines:
+        if line.startswith("```"):
+            fenced = not fenced
+            body += f"\n   {line}"
+        else:
+            body += f"\n   {line}" if fenced or line.startswith(" ") else f"\n   - {line}"
+    return f"{_STEP_EMOJIS[number - 1]} **{title}:**{body}"
+
+
+def _column_addition(a: int, b: int) -> list:
+    width = max(len(str(a)), len(str(b))) + 2
+    steps = [("Line up the numbers", ["```", f"  {a:>{width - 2}}", f"+ {b:>{width - 2}}", "-" * width, "```"])]
+    carry = 0
+    digits_a, digits_b = str(a)[::-1], str(b)[::-1]
+    for place in range(max(len(digits_a), len(digits_b))):
+        da = int(digits_a[place]) if place < len(digits_a) else 0
+        db = int(digits_b[place]) if place < len(digits_b) else 0
+        total = da + db + carry
+        sum_text = f"{da} + {db}" + (f" + {carry} (carried)" if carry else "") + f" = {total}"
+        last = place == max(len(digits_a), len(digits_b)) - 1
+        if total >= 10 and not last:
+            lines = [sum_text, f"Write down {total % 10}, carry the {total // 10}"]
+        else:
+            lines = [sum_text]
+        title = f"Add the {_PLACES[place]} place" + (" first" if place == 0 else "")
+        steps.append((title, lines))
+        carry = total // 10
+    return steps
+
+
+def _count_back(a: int, b: int) -> list:
+    if a < b:
+        return [("Notice the second number is bigger", [
+            "Taking away more than we have gives a negative answer",
+            f"Work out {b} - {a} = {b - a} instead, then put a minus sign in front",
+        ])]
+    parts = [int(digit) * 10 ** power for power, digit in enumerate(str(b)[::-1]) if digit != "0"][::-1]
+    steps = [("Break the number we take away into parts",
+              [f"{b} = " + " + ".join(str(part) for part in parts)])]
+    current = a
+    for part in parts:
+        steps.append((f"Take away {part}", [f"{current} - {part} = {current - part}"]))
+        current -= part
+    return steps
+
+
+def _break_apart(a: int, b: int) -> list:
+    if a < 10 and b < 10:
+        return [("Use your times tables", [f"{a} × {b} = {a * b}", f"That's {a} groups of {b}"])]
+    small, big = (b, a) if len(str(b)) <= len(str(a)) else (a, b)
+    parts = [int(digit) * 10 ** power for power, digit in enumerate(str(small)[::-1]) if digit != "0"][::-1]
+    if len(parts) == 1:
+        return [("Multiply", [f"{big} × {small} = {big * small}"])]
+    steps = [("Break the smaller number into parts", [f"{small} = " + " + ".join(str(part) for part in parts)])]
+    steps.append(("Multiply each part", [f"{big} × {part} = {big * part}" for part in parts]))
+    steps.append(("Add the answers together",
+                  [" + ".join(str(big * part) for part in parts) + f" = {big * small}"]))
+    return steps
+
+
+def _share_out(a: int, b: int) -> list:
+    quotient, remainder = divmod(a, b)
+    steps = [("Ask the question", [f"How many groups of {b} fit into {a}?"]),
+             ("Find the biggest fit", [f"{b} × {quotient} = {b * quotient}"])]
+    if remainder:
+        steps.append(("Work out what is left over",
+                      [f"{a} - {b * quotient} = {remainder}",
+                       f"So {a} ÷ {b} = {quotient} remainder {remainder}",
+                       f"As a number: {quotient} + {remainder}/{b} = {_fmt(Fraction(a, b))}"]))
+    else:
+        steps.append(("Check our answer", [f"{quotient} × {b} = {a} ✓"]))
+    return steps
+
+
+def _solve_arithmetic(tree) -> Optional[Solution]:
+    if tree[0] != "op":
+        return None
+    expression = _render(tree)
+    result = _evaluate(tree)
+    _, symbol, left, right = tree
+    single = left[0] == "num" and right[0] == "num"
+    whole = single and all(n[1].denominator == 1 and n[1] >= 0 for n in (left, right))
+
+    if whole and symbol == "+" and max(left[1], right[1]) < 10 ** _MAX_COLUMN_DIGITS:
+        steps = _column_addition(int(left[1]), int(right[1]))
+    elif whole and symbol == "-" and right[1] < 10 ** 5:
+        steps = _count_back(int(left[1]), int(right[1]))
+    elif whole and symbol == "×" and min(left[1], right[1]) < 10 ** 4:
+        steps = _break_apart(int(left[1]), int(right[1]))
+    elif whole and symbol == "÷" and right[1] > 0:
+        steps = _share_out(int(left[1]), int(right[1]))
+    elif single:
+        steps = [("Work it out", [f"{expression} = {_fmt(result)}"])]
+    else:
+        steps = [("Use BODMAS", ["Brackets, then Orders (powers), then Division and Multiplication, "
+                                  "then Addition and Subtraction", expression])]
+        while tree[0] == "op":
+            new_tree, a, op, b, value = _reduce_once(tree)
+            worked = f"{_render(('num', a), op)} {op} {_render(('num', b), op, True)} = {_fmt(value)}"
+            steps.append((f"Work out {_fmt(a)} {op} {_fmt(b)}",
+                          [worked] + ([_render(new_tree)] if new_tree[0] == "op" else [])))
+            tree = new_tree
+
+    if single:
+        name = _OPERATION_NAMES[symbol]
+        opening = f"🔢 Great {name} question! Let me help you solve {expression} step by step!"
+    else:
+        opening = f"🧮 Nice one - this needs the order of operations! Let's work out {expression} together!"
+    tip = _PARENT_TIPS.get(symbol if single else "order", _PARENT_TIPS["order"])
+    return _format("arithmetic", opening, steps, _fmt_answer(result), tip,
+                   "**🎉 Great job! Want me to show you another way to solve this?**")
+
+
+def _linear(tree, var: str) -> tuple:
+    """(a, b) with tree == a*var + b, or _Unsolvable if it isn't linear"""
+    if tree[0] == "num":
+        return Fraction(0), tree[1]
+    if tree[0] == "var":
+        return Fraction(1), Fraction(0)
+    _, symbol, left, right = tree
+    (a1, b1), (a2, b2) = _linear(left, var), _linear(right, var)
+    if symbol == "+":
+        return a1 + a2, b1 + b2
+    if symbol == "-":
+        return a1 - a2, b1 - b2
+    if symbol == "×" and (a1 == 0 or a2 == 0):
+        return a1 * b2 + a2 * b1, b1 * b2
+    if symbol == "÷" and a2 == 0 and b2 != 0:
+        return a1 / b2, b1 / b2
+    if symbol == "^" and a1 == 0 and a2 == 0:
+        return Fraction(0), _apply("^", b1, b2)
+    raise _Unsolvable("not linear")
+
+
+def _linear_text(a: Fraction, b: Fraction, var: str) -> str:
+    if a == 0:
+        return _fmt(b)
+    text = f"{_coefficient(a)}{var}"
+    if b:
+        text += f" {'+' if b > 0 else '-'} {_fmt(abs(b))}"
+    return text
+
+
+def _is_simple_side(tree) -> bool:
+    """One x term and/or one number, e.g. 2x + 5, x, 13"""
+    terms = []
+
+    def collect(node, top=True):
+        if node[0] == "op" and node[1] in "+-" and top:
+            collect(node[2])
+            terms.append(node[3])
+        else:
+            terms.append(node)
+    collect(tree)
+    var_terms = [t for t in terms if t[0] == "var" or (t[0] == "op" and t[1] == "×" and t[2][0] == "num"
+                                                       and t[3][0] == "var")]
+    numbers = [t for t in terms if t[0] == "num"]
+    return len(var_terms) + len(numbers) == len(terms) and len(var_terms) <= 1 and len(numbers) <= 1
+
+
+def _solve_equation(left_tree, right_tree, var: str) -> Optional[Solution]:
+    (a, b), (c, d) = _linear(left_tree, var), _linear(right_tree, var)
+    if a - c == 0:
+        return None  # no solution, or every number works: worth a real explanation
+    original = f"{_render(left_tree)} = {_render(right_tree)}"
+    steps = [("Understand what we have", [original, f"We need to find what number {var} represents"])]
+
+    if a == 0:
+        # 4 = 2x: easier the other way round
+        left_tree, right_tree, (a, b), (c, d) = right_tree, left_tree, (c, d), (a, b)
+        steps.append((f"Swap the sides so {var} is on the left", [f"{_render(left_tree)} = {_render(right_tree)}"]))
+    left_text = _render(left_tree)
+    if not (_is_simple_side(left_tree) and _is_simple_side(right_tree)):
+        left_text = _linear_text(a, b, var)
+        steps.append(("Tidy up each side", [f"{left_text} = {_linear_text(c, d, var)}"]))
+    if c != 0:
+        move = f"{_coefficient(abs(c))}{var}"
+        title = f"Subtract {move} from both sides" if c > 0 else f"Add {move} to both sides"
+        a, c = a - c, Fraction(0)
+        left_text = _linear_text(a, b, var)
+        steps.append((title, [f"{left_text} = {_fmt(d)}"]))
+    if b != 0:
+        title = f"Subtract {_fmt(b)} from both sides" if b > 0 else f"Add {_fmt(-b)} to both sides"
+        sign = "-" if b > 0 else "+"
+        d_new = d - b
+        steps.append((title, [f"{left_text} {sign} {_fmt(abs(b))} = {_fmt(d)} {sign} {_fmt(abs(b))}",
+                              f"{_linear_text(a, Fraction(0), var)} = {_fmt(d_new)}"]))
+        b, d = Fraction(0), d_new
+    value = d / a
+    if a != 1:
+        title = "Multiply both sides by -1" if a == -1 else f"Divide both sides by {_fmt(a)}"
+        lines = [f"{var} = {_fmt(value)}"] if a == -1 else [
+            f"{_linear_text(a, Fraction(0), var)} ÷ {_render(('num', a), '÷', True)} = "
+            f"{_fmt(d)} ÷ {_render(('num', a), '÷', True)}",
+            f"{var} = {_fmt(value)}"]
+        steps.append((title, lines))
+
+    substituted = _render(left_tree, substitute=value)
+    checked = _evaluate(left_tree, value)
+    check = [f"{substituted} = {_fmt(checked)}"]
+    if right_tree[0] != "num":
+        check.append(f"{_render(right_tree, substitute=value)} = {_fmt(_evaluate(right_tree, value))}")
+    check[-1] += " ✓"
+    steps.append(("Check our answer", check))
+
+    opening = f"🧮 Awesome algebra problem! Let's solve {original} together!"
+    return _format("equation", opening, steps, f"{var} = {_fmt_answer(value)}", _PARENT_TIPS["equation"],
+                   "**🌟 Excellent! You're mastering algebra! Need help with more equation types?**")
+
+
+_PARENT_TIPS = {
+    "+": "Help your child use their fingers or objects to count. This makes abstract numbers concrete!",
+    "-": "Practise \"counting back\" on a number line drawn on paper - it shows what taking away really means.",
+    "×": "Multiplication is repeated addition: build groups with beans or buttons and count them together.",
+    "÷": "Share sweets or coins into equal groups to show what division means, then talk about the leftovers.",
+    "^": "Show that 3² means 3 × 3 by drawing a 3 by 3 square of dots.",
+    "order": "Make up a silly sentence to remember BODMAS together - the sillier, the easier to remember!",
+    "equation": "Use a balance scale analogy - whatever you do to one side, you must do to the other to keep "
+                "it balanced!",
+}
+
+
+def _format(kind: str, opening: str, steps: list, answer: str, tip: str, closing: str) -> Optional[Solution]:
+    if len(steps) + 1 > len(_STEP_EMOJIS):
+        return None
+    body = "\n\n".join(_step(number, title, lines) for number, (title, lines) in enumerate(steps, 1))
+    final = f"{_STEP_EMOJIS[len(steps)]} **Final answer:** {answer}"
+    text = (f"{opening}\n\n**🎯 Step-by-Step Solution:**\n\n{body}\n\n{final}\n\n"
+            f"**👨‍👩‍👧‍👦 Parent Tip:** {tip}\n\n{closing}")
+    return Solution(kind, answer, text)
+
+
+def solve(question: str) -> Optional[Solution]:
+    """A worked solution if the question is plain arithmetic or a linear equation, else None"""
+    normalized = _normalize(question)
+    if normalized is None:
+        return None
+    text, named_var = normalized
+    variables = set()
+    budget = [_MAX_OPERATIONS]
+    try:
+        sides = [_parse(side, variables, budget) for side in text.split("=")]
+        if len(sides) == 1 and not variables:
+            return _solve_arithmetic(sides[0])
+        if len(sides) == 2 and len(variables) == 1 and named_var in (None, *variables):
+            return _solve_equation(sides[0], sides[1], variables.pop())
+    except (_Unsolvable, ZeroDivisionError, OverflowError):
+        pass
+    return None
@@ -1,23 +1,57 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 import os
 from dotenv import load_dotenv
-import base64
-import io
-from PIL import Image
+import asyncio
+import json
+import anyio
+from contextlib import asynccontextmanager
 
-from database import get_db, init_db
-from models import User, ChatMessage, Credit
-from schemas import UserCreate, UserResponse, ChatRequest, ChatResponse, CreditResponse
-from auth import create_access_token, verify_token, get_password_hash, verify_password
-from ai_service import process_homework_question, analyze_homework_image, detect_subject_advanced
+from database import AsyncSessionLocal, close_db, get_db, init_db, write_lock
+from models import User
+from schemas import UserCreate, UserResponse, ChatRequest, ChatResponse, CreditResponse, BatchChatRequest, BatchChatItem, BatchChatResponse
+from auth import create_user_token, decode_access_token, hash_password, shutdown_password_pool, verify_and_update_password
+from dependencies import current_user, resolve_user
+from credit_ledger import reserve_credits, refund_credits, grant_credits
+from user_cache import CachedUser, user_cache
+from answer_bank import answer_bank
+from answer_cache import answer_cache
+from write_behind import write_behind
+from chat_history import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, InvalidCursor, get_message, history_page
+from chat_search import SEARCH_MAX_RESULTS, SEARCH_RESULTS, InvalidSearch, search_messages
+from image_pipeline import IMAGE_MAX_UPLOAD_BYTES, ImageValidationError, prepare_image, shutdown_image_pool
+from conversation import conversations
+from rate_limit import RATE_LIMIT_ENABLED, TOO_MANY_REQUESTS_DETAIL, RateLimitMiddleware, client_ip, rate_limiter, retry_after_seconds, token_subject
+from metrics import CONTENT_TYPE, METRICS_ENABLED, MetricFamily, MetricsMiddleware, register_collector, render_metrics, stage
+from ai_service import process_homework_question, stream_homework_question, analyze_homework_image, detect_subject, ai_singleflight, ai_upstream, knowledge_base, model_router, prompt_builder
+from image_fingerprint import image_cache
+from image_text import image_text_stats
 
 load_dotenv()
 
-app = FastAPI(title="StudyBuddy API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background workers; on shutdown, write queued rows before closing the pool"""
+    init_db()
+    write_behind.start()
+    try:
+        yield
+    finally:
+        await write_behind.stop()
+        shutdown_image_pool()
+        shutdown_password_pool()
+        await close_db()
+
+app = FastAPI(title="StudyBuddy API", version="1.0.0", lifespan=lifespan)
+
+# Innermost, so 429s still carry CORS headers and are counted by the metrics middleware,
+# but requests over their limit never reach routing, the DB or the AI service
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
 
 # Configure CORS
 app.add_middleware(
@@ -26,29 +60,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
 )
 
-security = HTTPBearer()
+# Outermost, so request latency includes CORS handling
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
-# Initialize database on startup
-@app.on_event("startup")
-async def startup_event():
-    init_db()
+NO_CREDITS_DETAIL = "No credits remaining. Please purchase more credits to continue learning!"
+
+# Questions from one batch request answered in parallel
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
 
 @app.get("/")
 async def root():
     return {"message": "StudyBuddy API is running! 🚀"}
 
 @app.post("/api/auth/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user"""
     # Check if user already exists
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
+    result = await db.execute(select(User).where(User.email == user.email))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = User(
         email=user.email,
         full_name=user.full_name,
@@ -56,11 +93,12 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         credits=5  # Give 5 free credits to new users
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     # Create access token
-    access_token = create_access_token(data={"sub": db_user.email})
+    user_cache.store(db_user)
+    access_token = create_user_token(db_user)
     
     return UserResponse(
         id=db_user.id,
@@ -71,13 +109,24 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     )
 
 @app.post("/api/auth/login", response_model=UserResponse)
-async def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+async def login(email: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
     """Login user"""
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+    result = await db.execute(select(User).where(User.email == email))
+    user = result.scalars().first()
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # BCRYPT_ROUNDS changed since this password was hashed: store it at the current cost
+    if new_hash:
+        async with write_lock():
+            user.hashed_password = new_hash
+            await db.commit()
     
-    access_token = create_access_token(data={"sub": user.email})
+    user_cache.store(user)
+    access_token = create_user_token(user)
     
     return UserResponse(
         id=user.id,
@@ -88,13 +137,8 @@ async def login(email: str = Form(...), password: str = Form(...), db: Session =
     )
 
 @app.get("/api/user/me", response_model=UserResponse)
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+async def get_current_user(user: CachedUser = Depends(current_user)):
     """Get current user info"""
-    email = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     return UserResponse(
         id=user.id,
         email=user.email,
@@ -105,154 +149,386 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat_with_ai(
     request: ChatRequest,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Process chat message with AI"""
-    # Verify user and check credits
-    email = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if user.credits <= 0:
-        raise HTTPException(status_code=402, detail="No credits remaining. Please purchase more credits to continue learning!")
+    # Reserve the credit up front; it is refunded if no answer is produced
+    credits_remaining = await reserve_credits(db, user.id, 1, f"Chat question: {request.message[:50]}...")
+    if credits_remaining is None:
+        raise HTTPException(status_code=402, detail=NO_CREDITS_DETAIL)
     
+    refunded = False
     try:
+        # Follow-ups ("explain step 3 again") get the recent conversation
+        context = await conversations.context_for(db, user.id, request.message, request.use_context)
+        
         # Auto-detect subject if not provided
         subject = request.subject
         if not subject:
-            subject = detect_subject_advanced(request.message)
+            subject = detect_subject(request.message) or (context.subject if context else None)
         
         # Process with AI
-        ai_response = await process_homework_question(request.message, subject)
+        answer = await process_homework_question(request.message, subject, context)
+        if answer.fallback:
+            credits_remaining = await refund_fallback(user.id)
+            refunded = True
         
-        # Save chat message to database
-        chat_message = ChatMessage(
-            user_id=user.id,
-            user_message=request.message,
-            ai_response=ai_response,
-            subject=subject
-        )
-        db.add(chat_message)
-        
-        # Deduct credit and record transaction
-        user.credits -= 1
-        credit_transaction = Credit(
-            user_id=user.id,
-            amount=-1,
-            transaction_type="usage",
-            description=f"Chat question: {request.message[:50]}..."
-        )
-        db.add(credit_transaction)
-        db.commit()
+        # Save chat message (written with the next batch)
+        await write_behind.add_message(user.id, request.message, answer.text, subject)
+        if not answer.fallback:
+            conversations.record(user.id, request.message, answer.text, subject)
         
         return ChatResponse(
-            message=ai_response,
-            credits_remaining=user.credits
+            message=answer.text,
+            credits_remaining=credits_remaining,
+            fallback=answer.fallback
         )
     
     except Exception as e:
         print(f"Chat processing error: {e}")
+        await db.rollback()
+        # A fallback's credit was already given back
+        if not refunded:
+            await refund_credits(db, user.id, 1)
         raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
 
+@app.post("/api/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(
+    request: BatchChatRequest,
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Answer a worksheet of questions in one request.
+    
+    The credits for every question are reserved in one atomic step, so the
+    whole batch is rejected up front if the user can't pay for it. Questions
+    are answered concurrently; credits for failed questions are refunded and
+    all chat messages are written in a single transaction.
+    """
+    needed = len(request.questions)
+    credits_remaining = await reserve_credits(db, user.id, needed, f"Batch of {needed} questions")
+    if credits_remaining is None:
+        raise HTTPException(
+            status_code=402,
+            detail=f"This batch needs {needed} credits but you have fewer. Please purchase more credits to continue learning!"
+        )
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def answer(index: int, item: ChatRequest) -> BatchChatItem:
+        subject = item.subject or detect_subject(item.message)
+        try:
+            async with semaphore:
+                answer = await process_homework_question(item.message, subject)
+            return BatchChatItem(index=index, question=item.message, subject=subject, message=answer.text,
+                                 success=True, fallback=answer.fallback)
+        except Exception as e:
+            print(f"Batch question {index} error: {e}")
+            return BatchChatItem(index=index, question=item.message, subject=subject, success=False, error=f"AI processing failed: {str(e)}")
+    
+    results = await asyncio.gather(*(answer(i, item) for i, item in enumerate(request.questions)))
+    answered = [result for result in results if result.success]
+    
+    try:
+        # Together, so written through they commit in one transaction or not at all
+        await write_behind.add_messages(user.id, [(result.question, result.message, result.subject) for result in answered])
+    except Exception as e:
+        print(f"Batch save error: {e}")
+        await refund_credits(db, user.id, needed, "Refund: batch could not be saved")
+        raise HTTPException(status_code=500, detail="Saving batch results failed. You have not been charged.")
+    
+    failed = len(results) - len(answered)
+    if failed:
+        credits_remaining = await refund_credits(db, user.id, failed, f"Refund for {failed} unanswered batch questions")
+    fallbacks = sum(result.fallback for result in answered)
+    if fallbacks:
+        credits_remaining = await refund_fallback(user.id, fallbacks)
+    
+    return BatchChatResponse(
+        results=results,
+        answered=len(answered),
+        failed=failed,
+        fallbacks=fallbacks,
+        credits_remaining=credits_remaining
+    )
+
+async def refund_fallback(user_id: int, count: int = 1) -> int:
+    """Return the credits charged for canned fallback answers; returns the new balance"""
+    async with AsyncSessionLocal() as db:
+        return await refund_credits(db, user_id, count, f"Refund: {count} fallback answer(s), AI unavailable")
+
+async def refund_stream(user_id: int, reason: str):
+    """Refund the credit reserved for a stream that didn't complete"""
+    # Shielded: this runs while the request's task is being cancelled
+    with anyio.CancelScope(shield=True):
+        async with AsyncSessionLocal() as db:
+            await refund_credits(db, user_id, 1, f"Refund: {reason}")
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_with_ai_stream(
+    request: ChatRequest,
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream the AI answer token by token as Server-Sent Events.
+    
+    The credit is reserved before streaming starts and the chat message is
+    saved once the stream completes; an aborted or failed stream, or a
+    fallback answer, is refunded.
+    """
+    context = await conversations.context_for(db, user.id, request.message, request.use_context)
+    credits_remaining = await reserve_credits(db, user.id, 1, f"Chat question: {request.message[:50]}...")
+    if credits_remaining is None:
+        raise HTTPException(status_code=402, detail=NO_CREDITS_DETAIL)
+    
+    user_id = user.id
+    subject = request.subject or detect_subject(request.message) or (context.subject if context else None)
+    
+    async def event_stream():
+        chunks = []
+        fallback = False
+        try:
+            async for chunk in stream_homework_question(request.message, subject, context):
+                chunks.append(chunk.text)
+                fallback = fallback or chunk.fallback
+                yield sse_event({"token": chunk.text})
+        except (asyncio.CancelledError, GeneratorExit):
+            print(f"Chat stream aborted by client (user {user_id})")
+            await refund_stream(user_id, "chat stream aborted")
+            raise
+        except Exception as e:
+            print(f"Chat streaming error: {e}")
+            await refund_stream(user_id, "chat stream failed")
+            yield sse_event({"detail": f"AI processing failed: {str(e)}"}, event="error")
+            return
+        
+        answer = "".join(chunks)
+        balance = credits_remaining
+        if fallback:
+            balance = await refund_fallback(user_id)
+        await write_behind.add_message(user_id, request.message, answer, subject)
+        if not fallback:
+            conversations.record(user_id, request.message, answer, subject)
+        yield sse_event({"subject": subject, "credits_remaining": balance, "fallback": fallback}, event="done")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/chat/ws")
+async def chat_websocket(websocket: WebSocket, token: str):
+    """Stream AI answers over a WebSocket.
+    
+    Authenticate with ?token=<jwt>, then send {"message": ..., "subject": ...}
+    per question. The server replies with {"type": "token"} frames followed by
+    one {"type": "done"} or {"type": "error"} frame. Each question reserves a
+    credit that is refunded unless the answer is fully delivered, or if it
+    was a fallback answer ("fallback": true in the done frame).
+    """
+    try:
+        with stage("jwt").time():
+            claims = decode_access_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    try:
+        while True:
+            payload = await websocket.receive_json()
+            message = (payload.get("message") or "").strip()
+            if not message:
+                await websocket.send_json({"type": "error", "detail": "Message is required"})
+                continue
+            
+            # The middleware only sees the handshake, so each question is limited here
+            if rate_limiter.enabled:
+                wait = await rate_limiter.check("chat", token_subject(claims), client_ip(websocket.scope))
+                if wait:
+                    await websocket.send_json({"type": "error", "detail": TOO_MANY_REQUESTS_DETAIL,
+                                               "retry_after": retry_after_seconds(wait)})
+                    continue
+            
+            async with AsyncSessionLocal() as db:
+                try:
+                    user = await resolve_user(claims, db)
+                    # Context is looked up before the credit is taken, so a failure costs nothing
+                    context = await conversations.context_for(db, user.id, message, payload.get("use_context"))
+                    credits_remaining = await reserve_credits(db, user.id, 1, f"Chat question: {message[:50]}...")
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                    return
+            if credits_remaining is None:
+                await websocket.send_json({"type": "error", "detail": NO_CREDITS_DETAIL})
+                continue
+            
+            subject = payload.get("subject") or detect_subject(message) or (context.subject if context else None)
+            chunks = []
+            fallback = False
+            failed = False
+            delivered = False
+            answer_stream = stream_homework_question(message, subject, context)
+            try:
+                while True:
+                    # Only upstream errors are reported; send failures mean the client left
+                    try:
+                        chunk = await answer_stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except Exception as e:
+                        print(f"Chat streaming error: {e}")
+                        await websocket.send_json({"type": "error", "detail": f"AI processing failed: {str(e)}"})
+                        failed = True
+                        break
+                    chunks.append(chunk.text)
+                    fallback = fallback or chunk.fallback
+                    await websocket.send_json({"type": "token", "content": chunk.text})
+                delivered = not failed
+            finally:
+                await answer_stream.aclose()
+                if not delivered:
+                    await refund_stream(user.id, "chat stream failed" if failed else "chat stream aborted")
+            if failed:
+                continue
+            
+            answer = "".join(chunks)
+            if fallback:
+                credits_remaining = await refund_fallback(user.id)
+            await write_behind.add_message(user.id, message, answer, subject)
+            if not fallback:
+                conversations.record(user.id, message, answer, subject)
+            await websocket.send_json({"type": "done", "subject": subject, "credits_remaining": credits_remaining,
+                                       "fallback": fallback})
+    
+    except WebSocketDisconnect:
+        print(f"Chat WebSocket closed by client ({claims['sub']})")
+
 @app.post("/api/chat/image", response_model=ChatResponse)
 async def chat_with_image(
     file: UploadFile = File(...),
     message: Optional[str] = Form(""),
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    document: Optional[bool] = Form(None),
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Process homework image with AI"""
-    # Verify user and check credits
-    email = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    """Process homework image with AI.
     
-    if user.credits <= 0:
-        raise HTTPException(status_code=402, detail="No credits remaining. Please purchase more credits to continue learning!")
+    Set document=true for printed worksheets to send a grayscale image.
+    """
+    # Read at most one byte past the limit so oversized uploads are rejected cheaply
+    image_data = await file.read(IMAGE_MAX_UPLOAD_BYTES + 1)
     
+    # Validate, downscale and re-encode in the worker pool before any credit is reserved
+    try:
+        prepared = await prepare_image(image_data, grayscale=document)
+    except ImageValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    # Reserve the credit up front; it is refunded if no answer is produced
+    credits_remaining = await reserve_credits(db, user.id, 1, "Image analysis question")
+    if credits_remaining is None:
+        raise HTTPException(status_code=402, detail=NO_CREDITS_DETAIL)
+    
+    refunded = False
     try:
-        # Process image
-        image_data = await file.read()
-        
-        # Convert to base64 for AI processing
-        image = Image.open(io.BytesIO(image_data))
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
         # Process with AI
-        ai_response = await analyze_homework_image(img_base64, message)
+        answer = await analyze_homework_image(prepared.base64, message, prepared.fingerprint, prepared.text)
+        if answer.fallback:
+            credits_remaining = await refund_fallback(user.id)
+            refunded = True
         
-        # Save chat message to database
-        chat_message = ChatMessage(
-            user_id=user.id,
-            user_message=message or "Image uploaded with homework question",
-            ai_response=ai_response,
-            has_image=True,
-            subject=detect_subject_advanced(message) if message else None
-        )
-        db.add(chat_message)
+        # Subject from the message and any text read from the photo
+        subject_text = "\n".join(filter(None, [message, prepared.text.text if prepared.text else None]))
         
-        # Deduct credit and record transaction
-        user.credits -= 1
-        credit_transaction = Credit(
-            user_id=user.id,
-            amount=-1,
-            transaction_type="usage",
-            description="Image analysis question"
+        # Save chat message (written with the next batch)
+        await write_behind.add_message(
+            user.id,
+            message or "Image uploaded with homework question",
+            answer.text,
+            subject=detect_subject(subject_text) if subject_text else None,
+            has_image=True
         )
-        db.add(credit_transaction)
-        db.commit()
         
         return ChatResponse(
-            message=ai_response,
-            credits_remaining=user.credits
+            message=answer.text,
+            credits_remaining=credits_remaining,
+            fallback=answer.fallback
         )
     
     except Exception as e:
         print(f"Image processing error: {e}")
+        await db.rollback()
+        if not refunded:
+            await refund_credits(db, user.id, 1)
         raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
 
 @app.get("/api/chat/history")
 async def get_chat_history(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|preview)$"),
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get user's chat history"""
-    email = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    messages = db.query(ChatMessage).filter(ChatMessage.user_id == user.id).order_by(ChatMessage.created_at.desc()).limit(50).all()
-    
-    return [
-        {
-            "id": msg.id,
-            "user_message": msg.user_message,
-            "ai_response": msg.ai_response,
-            "subject": msg.subject,
-            "has_image": msg.has_image,
-            "created_at": msg.created_at
-        }
-        for msg in messages
-    ]
+    """Get user's chat history, newest first (next page cursor in X-Next-Cursor)"""
+    # Read-your-writes: make sure the user's latest answers are in the table
+    if write_behind.has_pending(user.id):
+        await write_behind.flush()
+    try:
+        messages, next_cursor = await history_page(db, user.id, limit=limit, cursor=cursor, preview=view == "preview")
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return messages
+
+@app.get("/api/chat/search")
+async def search_chat_history(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_RESULTS, ge=1, le=SEARCH_MAX_RESULTS),
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Search the user's chat history, best match first, with highlighted snippets"""
+    if write_behind.has_pending(user.id):
+        await write_behind.flush()
+    try:
+        return await search_messages(db, user.id, q, limit=limit)
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/chat/history/{message_id}")
+async def get_chat_message(
+    message_id: int,
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get one full chat message"""
+    if write_behind.has_pending(user.id):
+        await write_behind.flush()
+    message = await get_message(db, user.id, message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message
 
 @app.post("/api/credits/purchase")
 async def purchase_credits(
     amount: int = Form(...),
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    user: CachedUser = Depends(current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """Purchase credits (mock implementation)"""
-    email = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     # Valid credit packages with South African pricing
     credit_packages = {
         5: 5,    # R 5 for 5 credits
@@ -267,42 +543,32 @@ async def purchase_credits(
     
     # Mock payment processing - in production, integrate with payment gateway
     try:
-        # Add credits to user account
-        user.credits += amount
-        
-        # Record credit purchase
-        credit_record = Credit(
-            user_id=user.id,
-            amount=amount,
-            transaction_type="purchase",
-            description=f"Purchased {amount} credits for R{credit_packages[amount]}"
+        # Add credits to user account and record the purchase
+        new_balance = await grant_credits(
+            db,
+            user.id,
+            amount,
+            "purchase",
+            f"Purchased {amount} credits for R{credit_packages[amount]}"
         )
-        db.add(credit_record)
-        db.commit()
-        
-        return {
-            "success": True,
-            "message": f"🎉 Successfully purchased {amount} credits for R{credit_packages[amount]}!", 
-            "new_balance": user.credits,
-            "amount_purchased": amount,
-            "cost": credit_packages[amount]
-        }
-        
     except Exception as e:
         print(f"Credit purchase error: {e}")
         raise HTTPException(status_code=500, detail="Credit purchase failed. Please try again.")
-
-@app.get("/api/credits", response_model=CreditResponse)
-async def get_credits(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-):
-    """Get user's current credit balance"""
-    email = verify_token(credentials.credentials)
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
+    
+    if new_balance is None:
         raise HTTPException(status_code=404, detail="User not found")
     
+    return {
+        "success": True,
+        "message": f"🎉 Successfully purchased {amount} credits for R{credit_packages[amount]}!", 
+        "new_balance": new_balance,
+        "amount_purchased": amount,
+        "cost": credit_packages[amount]
+    }
+
+@app.get("/api/credits", response_model=CreditResponse)
+async def get_credits(user: CachedUser = Depends(current_user)):
+    """Get user's current credit balance (served from the user cache)"""
     return CreditResponse(credits=user.credits)
 
 @app.get("/api/credits/packages")
@@ -318,6 +584,115 @@ async def get_credit_packages():
         ]
     }
 
+@app.get("/api/ai/stats")
+async def get_ai_stats():
+    """Get AI answer bank, answer cache, image cache, knowledge base, request coalescing, routing, upstream resilience, prompt, conversation, write-behind and rate limit statistics"""
+    return {
+        "answer_bank": answer_bank.stats(),
+        "answer_cache": answer_cache.stats(),
+        "image_cache": image_cache.stats(),
+        "image_text": image_text_stats.stats(),
+        "knowledge_base": knowledge_base.stats(),
+        "coalescing": ai_singleflight.stats(),
+        "routing": model_router.stats(),
+        "upstream": ai_upstream.stats(),
+        "prompts": prompt_builder.stats(),
+        "conversations": conversations.stats(),
+        "write_behind": write_behind.stats(),
+        "rate_limit": rate_limiter.stats()
+    }
+
+def service_metrics():
+    """Counters the AI service modules already keep, as Prometheus metrics"""
+    bank = answer_bank.stats()
+    yield MetricFamily("studybuddy_answer_bank_lookups_total", "counter", "Answer bank lookups by result",
+                       [({"result": "hit"}, bank["hits"]), ({"result": "miss"}, bank["misses"])])
+    yield MetricFamily("studybuddy_answer_bank_entries", "gauge", "Precomputed answers in the answer bank", [({}, bank["entries"])])
+
+    cache = answer_cache.stats()
+    yield MetricFamily("studybuddy_answer_cache_hits_total", "counter", "Answer cache hits by tier",
+                       [({"tier": tier}, cache[f"{tier}_hits"]) for tier in ("exact", "disk", "similar")])
+    yield MetricFamily("studybuddy_answer_cache_misses_total", "counter", "Answer cache misses",
+                       [({}, cache["misses"])])
+    yield MetricFamily("studybuddy_answer_cache_entries", "gauge", "Answers cached in memory", [({}, cache["entries"])])
+
+    images = image_cache.stats()
+    yield MetricFamily("studybuddy_image_cache_hits_total", "counter", "Image uploads answered from an earlier near-duplicate, by kind",
+                       [({"kind": "exact"}, images["exact_hits"]), ({"kind": "near"}, images["near_hits"]),
+                        ({"kind": "in_flight"}, images["shared"])])
+    yield MetricFamily("studybuddy_image_cache_misses_total", "counter", "Image uploads with no near-duplicate cached",
+                       [({}, images["misses"])])
+    yield MetricFamily("studybuddy_image_cache_entries", "gauge", "Image analyses cached in memory", [({}, images["entries"])])
+
+    image_text = image_text_stats.stats()
+    yield MetricFamily("studybuddy_images_answered_total", "counter", "Image uploads by answer path (text from OCR, or vision and why)",
+                       [({"path": "text"}, image_text["text_path"])] +
+                       [({"path": f"vision_{reason}"}, count) for reason, count in image_text["vision_path"].items()])
+
+    knowledge = knowledge_base.stats()
+    yield MetricFamily("studybuddy_knowledge_base_answers_total", "counter", "Answers from the local knowledge base, by use",
+                       [({"use": "answer"}, knowledge["answered"]), ({"use": "fallback_example"}, knowledge["fallback_examples"])])
+    yield MetricFamily("studybuddy_knowledge_base_documents", "gauge", "Worked examples in the knowledge base", [({}, knowledge["documents"])])
+    yield MetricFamily("studybuddy_knowledge_base_open_failed", "gauge",
+                       "1 if KNOWLEDGE_BASE_PATH couldn't be opened and the index was built in memory instead",
+                       [({}, int(knowledge["open_error"] is not None))])
+
+    coalescing = ai_singleflight.stats()
+    yield MetricFamily("studybuddy_ai_coalesced_total", "counter", "Questions that shared another request's upstream call",
+                       [({}, coalescing["coalesced"])])
+
+    routes = model_router.stats()["routes"]
+    yield MetricFamily("studybuddy_ai_answers_total", "counter", "Questions answered per route, fallbacks included",
+                       [({"route": name}, route["calls"]) for name, route in routes.items()])
+    yield MetricFamily("studybuddy_ai_fallbacks_total", "counter", "Fallback answers per route (AI unavailable)",
+                       [({"route": name}, route["fallbacks"]) for name, route in routes.items()])
+    yield MetricFamily("studybuddy_ai_tokens_total", "counter", "Tokens used per route",
+                       [({"route": name, "kind": kind}, route[f"{kind}_tokens"])
+                        for name, route in routes.items() for kind in ("prompt", "completion")])
+    yield MetricFamily("studybuddy_ai_cost_usd_total", "counter", "Estimated upstream cost per route",
+                       [({"route": name}, route["cost_usd"]) for name, route in routes.items()])
+
+    upstream = ai_upstream.stats()
+    yield MetricFamily("studybuddy_ai_upstream_attempts_total", "counter", "Upstream attempts by outcome",
+                       [({"outcome": "failed"}, upstream["failed_attempts"]),
+                        ({"outcome": "ok"}, upstream["attempts"] - upstream["failed_attempts"])])
+    yield MetricFamily("studybuddy_ai_retries_total", "counter", "Upstream retries", [({}, upstream["retries"])])
+    yield MetricFamily("studybuddy_ai_hedged_total", "counter", "Hedged upstream requests", [({}, upstream["hedged"])])
+    circuit = upstream["circuit"]
+    yield MetricFamily("studybuddy_ai_circuit_state", "gauge", "1 for the circuit breaker's current state",
+                       [({"state": state}, int(circuit["state"] == state)) for state in ("closed", "open", "half_open")])
+    yield MetricFamily("studybuddy_ai_short_circuited_total", "counter", "Calls answered by fallback while the circuit was open",
+                       [({}, circuit["short_circuited"])])
+
+    prompts = prompt_builder.stats()
+    yield MetricFamily("studybuddy_ai_truncated_answers_total", "counter", "Answers cut off at max_tokens",
+                       [({}, prompts["truncated"])])
+
+    queue = write_behind.stats()
+    yield MetricFamily("studybuddy_write_behind_pending", "gauge", "Rows waiting to be written", [({}, queue["pending"])])
+    yield MetricFamily("studybuddy_write_behind_rows_total", "counter", "Rows written by the write-behind queue",
+                       [({}, queue["rows_written"])])
+    yield MetricFamily("studybuddy_write_behind_failed_flushes_total", "counter", "Write-behind batches that failed",
+                       [({}, queue["failed_flushes"])])
+    yield MetricFamily("studybuddy_write_behind_dead_letters_total", "counter", "Rows moved to the dead-letter file after repeated failures",
+                       [({}, queue["dead_lettered"])])
+
+    limits = rate_limiter.stats()
+    yield MetricFamily("studybuddy_rate_limited_total", "counter", "Requests rejected with 429, by endpoint class and the bucket that ran out",
+                       [({"class": limit_class, "bucket": kind}, count)
+                        for limit_class, kinds in limits["limited"].items() for kind, count in kinds.items()])
+    yield MetricFamily("studybuddy_rate_limit_backend_errors_total", "counter", "Shared rate limit backend failures",
+                       [({}, limits["shared_errors"])])
+
+register_collector(service_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics for this worker: request latency, stage timings, AI counters"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
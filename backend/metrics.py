@@ -0,0 +1,256 @@
+"""
+Prometheus metrics in the text exposition format, without a client library.
+
+Hot paths only touch pre-bound children: Counter.inc() is one attribute
+add and Histogram.observe() a bisect into fixed buckets, both well under
+a microsecond. Numbers other modules already keep (answer cache,
+coalescing, routing, circuit breaker, write-behind, ...) are read from
+their stats() when /metrics is scraped, through collectors, instead of
+being counted twice. Like the other in-memory stats, metrics are per
+worker process; Prometheus sums them across workers.
+"""
+
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, NamedTuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: from a cached JWT check up to a slow upstream answer
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+
+class MetricFamily(NamedTuple):
+    """One metric as a collector reports it: samples are (labels dict, value)"""
+    name: str
+    type: str
+    help: str
+    samples: list
+
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return "+Inf" if value == float("inf") else repr(value)
+    return str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: "_HistogramChild"):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def time(self) -> _Timer:
+        """Context manager that observes the time spent in its block"""
+        return _Timer(self)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _metrics.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The child for these label values; bind it once and reuse it on hot paths"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _labels(self, values: tuple) -> dict:
+        return dict(zip(self.labelnames, values))
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            yield f"{self.name}{_label_text(self._labels(values))} {_number(child.value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, seconds: float):
+        self.labels().observe(seconds)
+
+    def render(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            labels = self._labels(values)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), child.counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_label_text({**labels, 'le': _number(float(bound))})} {cumulative}"
+            yield f"{self.name}_sum{_label_text(labels)} {_number(child.sum)}"
+            yield f"{self.name}_count{_label_text(labels)} {child.count}"
+
+
+def register_collector(collect: Callable[[], Iterable[MetricFamily]]):
+    """Add a function that reports metrics kept elsewhere, called on every scrape"""
+    _collectors.append(collect)
+
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text format"""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            families = list(collect())
+        except Exception as e:
+            # One broken collector shouldn't take the whole scrape down
+            print(f"Metrics collector error: {e}")
+            continue
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            lines.extend(f"{family.name}{_label_text(labels)} {_number(value)}" for labels, value in family.samples)
+    return "\n".join(lines) + "\n"
+
+
+# HTTP requests, recorded by MetricsMiddleware
+HTTP_REQUESTS = Counter("studybuddy_http_requests_total", "HTTP requests by route and status",
+                        ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = Histogram("studybuddy_http_request_duration_seconds",
+                                 "HTTP request latency by route, until the last body byte (streams included)",
+                                 ("method", "route"))
+HTTP_IN_PROGRESS = Gauge("studybuddy_http_requests_in_progress", "HTTP requests being handled")
+
+# Stages inside a request
+STAGE_SECONDS = Histogram("studybuddy_stage_duration_seconds", "Time spent per request stage", ("stage",))
+
+
+def stage(name: str) -> _HistogramChild:
+    """Histogram child for one stage: jwt, db_query, subject_detection, image_preprocessing, ai_upstream, ..."""
+    return STAGE_SECONDS.labels(name)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by its route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._in_progress = HTTP_IN_PROGRESS.labels()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self._in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self._in_progress.dec()
+            # The route template keeps label cardinality bounded (/history/{message_id}, not /history/42);
+            # Starlette versions that don't record the route still record the endpoint
+            path = (getattr(scope.get("route"), "path", None)
+                    or getattr(scope.get("endpoint"), "__name__", None) or "unmatched")
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.labels(method, path).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, path, str(status)).inc()
@@ -0,0 +1,147 @@
+"""
+Routes each question to the cheapest backend that answers it well.
+
+- local: plain arithmetic and one-unknown linear equations are worked out
+  by local_solver in microseconds, with no upstream call.
+- complex: long, multi-part or analysis-style questions go to the complex
+  backend (AI_COMPLEX_MODEL, optionally on its own AI_COMPLEX_BASE_URL).
+- standard: everything else goes to AI_MODEL.
+
+Both model routes use the OpenAI backend unless configured otherwise;
+any OpenAI-compatible server (vLLM, llama.cpp, Ollama) works by pointing
+a base URL at it. Calls, latency percentiles, tokens and estimated cost
+are kept per route for /api/ai/stats.
+"""
+
+import os
+import re
+from collections import Counter, deque
+from typing import NamedTuple, Optional
+
+from local_solver import Solution, solve
+from prompt_builder import count_tokens
+
+# Router configuration (override via environment)
+LOCAL_SOLVER_ENABLED = os.getenv("LOCAL_SOLVER_ENABLED", "True").lower() == "true"
+AI_MODEL = os.getenv("AI_MODEL", "gpt-3.5-turbo")
+AI_COMPLEX_MODEL = os.getenv("AI_COMPLEX_MODEL", AI_MODEL)
+AI_COMPLEX_BASE_URL = os.getenv("AI_COMPLEX_BASE_URL", "")
+ROUTER_COMPLEX_MIN_TOKENS = int(os.getenv("ROUTER_COMPLEX_MIN_TOKENS", "120"))
+
+# USD per million (input, output) tokens; models not listed (self-hosted) cost nothing
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4-turbo": (10.00, 30.00),
+}
+
+# Latency samples kept per route for percentiles
+_LATENCY_WINDOW = 1000
+
+# Questions that ask for reasoning, not just an explanation
+_COMPLEX_WORDS = re.compile(
+    r"\b(prove|proof|derive|derivation|differentiate|integrate|derivative|integral|calculus|"
+    r"analy[sz]e|analysis|compare|contrast|critically|discuss|justify|essay|evaluate the)\b",
+    re.IGNORECASE,
+)
+# "1. ...", "a) ...", "(b) ..." at the start of a line
+_NUMBERED_PART = re.compile(r"^\s*(?:\d+[.)]|\(?[a-h]\))\s", re.MULTILINE)
+
+
+class ModelBackend(NamedTuple):
+    """An OpenAI-compatible client, the model to ask, and its resilience wrapper"""
+    model: str
+    client: object    # openai.AsyncOpenAI
+    upstream: object  # ai_resilience.ResilientUpstream
+
+
+class Route(NamedTuple):
+    name: str                        # "local", "standard" or "complex"
+    backend: Optional[ModelBackend]  # None when the local solver answered
+    solution: Optional[Solution] = None
+
+
+def is_complex(question: str, subject: Optional[str]) -> bool:
+    """Whether a question deserves the stronger (or larger) model"""
+    if _COMPLEX_WORDS.search(question):
+        return True
+    if question.count("?") >= 2 or len(_NUMBERED_PART.findall(question)) >= 2:
+        return True
+    # Long questions need more reasoning; a subject-less one is usually pasted text
+    limit = ROUTER_COMPLEX_MIN_TOKENS if subject else ROUTER_COMPLEX_MIN_TOKENS * 2
+    return count_tokens(question) >= limit
+
+
+def _cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelRouter:
+    """Picks a route per question and keeps latency and cost per route"""
+
+    def __init__(self, standard: ModelBackend, complex_backend: Optional[ModelBackend] = None,
+                 local_solver: bool = LOCAL_SOLVER_ENABLED):
+        self.backends = {"standard": standard, "complex": complex_backend or standard}
+        self.local_solver = local_solver
+        self._counters = {name: Counter() for name in ("local", "standard", "complex")}
+        self._costs = dict.fromkeys(self._counters, 0.0)
+        self._latencies = {name: deque(maxlen=_LATENCY_WINDOW) for name in self._counters}
+
+    def route(self, question: str, subject: Optional[str]) -> Route:
+        """Route for a question; a local route carries its worked solution"""
+        if self.local_solver and subject in (None, "math"):
+            solution = solve(question)
+            if solution is not None:
+                return Route("local", None, solution)
+        name = "complex" if is_complex(question, subject) else "standard"
+        return Route(name, self.backends[name])
+
+    def record(self, route: Route, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+               fallback: bool = False):
+        """Record one answered (or failed, fallback=True) question on a route"""
+        counters = self._counters[route.name]
+        counters["calls"] += 1
+        if fallback:
+            counters["fallbacks"] += 1
+            return
+        counters["prompt_tokens"] += prompt_tokens
+        counters["completion_tokens"] += completion_tokens
+        if route.backend is not None:
+            self._costs[route.name] += _cost(route.backend.model, prompt_tokens, completion_tokens)
+        self._latencies[route.name].append(latency)
+
+    def stats(self) -> dict:
+        """Calls, latency percentiles, tokens and estimated cost per route"""
+        total = sum(counters["calls"] for counters in self._counters.values())
+        routes = {}
+        for name, counters in self._counters.items():
+            latencies = sorted(self._latencies[name])
+            answered = counters["calls"] - counters["fallbacks"]
+
+            def latency_ms(pct: float) -> float:
+                if not latencies:
+                    return 0.0
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct))] * 1000, 3)
+
+            backend = self.backends.get(name)
+            routes[name] = {
+                "model": backend.model if backend else "local_solver",
+                "circuit": backend.upstream.breaker.state if backend else None,
+                "calls": counters["calls"],
+                "share": round(counters["calls"] / total, 3) if total else 0.0,
+                "fallbacks": counters["fallbacks"],
+                "avg_latency_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+                "p50_latency_ms": latency_ms(0.5),
+                "p95_latency_ms": latency_ms(0.95),
+                "prompt_tokens": counters["prompt_tokens"],
+                "completion_tokens": counters["completion_tokens"],
+                "cost_usd": round(self._costs[name], 6),
+                "avg_cost_usd": round(self._costs[name] / answered, 6) if answered else 0.0,
+            }
+        # What the locally solved questions would have cost at the standard route's average
+        saved = routes["local"]["calls"] * routes["standard"]["avg_cost_usd"]
+        return {"local_solver": self.local_solver, "routes": routes, "est_saved_usd": round(saved, 6)}
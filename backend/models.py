@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -34,6 +34,11 @@ class ChatMessage(Base):
     # Relationships
     user = relationship("User", back_populates="chat_messages")
 
+    # History is always "this user's messages, newest first", paged by (created_at, id)
+    __table_args__ = (
+        Index("ix_chat_messages_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
 class Credit(Base):
     __tablename__ = "credits"
     
@@ -47,6 +52,10 @@ class Credit(Base):
     # Relationships
     user = relationship("User", back_populates="credit_transactions")
 
+    __table_args__ = (
+        Index("ix_credits_user_id_created_at", "user_id", "created_at"),
+    )
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
     
@@ -0,0 +1,290 @@
+"""
+Prompt assembly and token budgeting for upstream chat completions.
+
+Per-subject system messages (system prompt, subject context and optional
+few-shot examples from the training data) are formatted and measured once,
+when the builder is created, so building a prompt is a dict lookup plus
+counting the question's tokens. Each prompt is kept within
+PROMPT_MAX_INPUT_TOKENS - the question is trimmed only if it can't fit on
+its own, conversation context (see conversation.py) gets what's left up to
+PROMPT_CONTEXT_TOKENS, newest turns first, and few-shot examples fill any
+remaining room - and gets a max_tokens sized by subject and question
+length instead of a flat 1000.
+
+Token counts use tiktoken when it is installed and its encoding can be
+loaded (it is downloaded on first use, so offline hosts may not have it);
+otherwise a conservative local estimate that tends to over-count.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+
+# Prompt configuration (override via environment)
+PROMPT_FEW_SHOT_EXAMPLES = int(os.getenv("PROMPT_FEW_SHOT_EXAMPLES", "0"))
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "1500"))
+AI_MAX_OUTPUT_TOKENS = int(os.getenv("AI_MAX_OUTPUT_TOKENS", "1000"))
+AI_MIN_OUTPUT_TOKENS = int(os.getenv("AI_MIN_OUTPUT_TOKENS", "250"))
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "800"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+AI_LOG_CALLS = os.getenv("AI_LOG_CALLS", "False").lower() == "true"
+
+# Typical answer length per subject; the default covers undetected subjects
+SUBJECT_OUTPUT_TOKENS = {
+    "math": 700,
+    "science": 800,
+    "english": 700,
+    "history": 850,
+    "geography": 750,
+}
+DEFAULT_OUTPUT_TOKENS = 600
+
+# (question tokens up to, share of the subject budget): a one-line sum needs
+# a shorter answer than a pasted comprehension passage
+_LENGTH_SCALE = ((12, 0.6), (40, 0.8), (150, 1.0))
+_LONG_QUESTION_SCALE = 1.25
+
+# Chat format overhead: each message is wrapped in role/separator tokens,
+# and the reply is primed with a few more
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+
+_TRIM_MARKER = "\n[…]\n"
+_SUMMARY_HEADER = "Earlier in this conversation the student:\n"
+
+_HEURISTIC_PATTERN = re.compile(r"[A-Za-z]+|\d+|\n+|[^\sA-Za-z\d]")
+
+
+def _load_encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception:
+        # Not installed, or the encoding file can't be fetched
+        return None
+
+
+_encoding = _load_encoding()
+TOKENIZER = "tiktoken" if _encoding is not None else "heuristic"
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text (exact with tiktoken, an over-estimate without)"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    tokens = 0
+    for piece in _HEURISTIC_PATTERN.findall(text):
+        first = piece[0]
+        if first.isdigit():
+            # Digits are split into groups of three
+            tokens += math.ceil(len(piece) / 3)
+        elif first.isalpha():
+            # Common words are one token; long ones split every ~6 letters
+            tokens += 1 + len(piece) // 6
+        elif first == "\n":
+            tokens += 1
+        else:
+            # ASCII punctuation is one token; emoji and other symbols take several bytes
+            tokens += 1 if first.isascii() else 2
+    return tokens
+
+
+def trim_to_tokens(text: str, budget: int) -> str:
+    """Trim text to about `budget` tokens, keeping its start and end.
+
+    Homework questions usually put the context first and the actual question
+    last, so the middle goes.
+    """
+    if count_tokens(text) <= budget:
+        return text
+    if _encoding is not None:
+        ids = _encoding.encode(text)
+        keep = max(budget - count_tokens(_TRIM_MARKER), 2)
+        head = _encoding.decode(ids[:keep * 2 // 3])
+        tail = _encoding.decode(ids[len(ids) - keep // 3:])
+        return f"{head}{_TRIM_MARKER}{tail}"
+    # Without a tokenizer, cut by characters and shrink until it fits
+    keep = len(text) * budget // max(count_tokens(text), 1)
+    while keep > 0:
+        trimmed = f"{text[:keep * 2 // 3]}{_TRIM_MARKER}{text[len(text) - keep // 3:]}"
+        if count_tokens(trimmed) <= budget:
+            return trimmed
+        keep = keep * 9 // 10
+    return text[:budget]
+
+
+def output_token_budget(subject: Optional[str], question_tokens: int) -> int:
+    """max_tokens for an answer, from the subject and the question's length"""
+    base = SUBJECT_OUTPUT_TOKENS.get(subject, DEFAULT_OUTPUT_TOKENS)
+    scale = _LONG_QUESTION_SCALE
+    for limit, share in _LENGTH_SCALE:
+        if question_tokens <= limit:
+            scale = share
+            break
+    return max(AI_MIN_OUTPUT_TOKENS, min(AI_MAX_OUTPUT_TOKENS, int(base * scale)))
+
+
+class Prompt(NamedTuple):
+    messages: list
+    input_tokens: int
+    max_tokens: int
+    context_tokens: int = 0
+
+
+class _SubjectPrompt(NamedTuple):
+    system: dict
+    examples: tuple  # (user message, assistant message) pairs
+    system_tokens: int
+    example_tokens: tuple
+
+
+class PromptBuilder:
+    """Builds chat messages from precomputed per-subject system prompts"""
+
+    def __init__(self, training_data: dict, subject_context: dict, default_subject: str, default_context: str,
+                 few_shot: int = PROMPT_FEW_SHOT_EXAMPLES, max_input_tokens: int = PROMPT_MAX_INPUT_TOKENS,
+                 context_tokens: int = PROMPT_CONTEXT_TOKENS):
+        self.max_input_tokens = max_input_tokens
+        self.context_tokens = context_tokens
+        self._subjects = {}
+        for subject in (*training_data, None):
+            data = training_data.get(subject, training_data[default_subject])
+            context = subject_context.get(subject, default_context)
+            self._subjects[subject] = self._precompute(data, context, few_shot)
+        self._counters = Counter()
+        self._calls = {"stateless": Counter(), "contextual": Counter()}
+
+    @staticmethod
+    def _precompute(data: dict, context: str, few_shot: int) -> _SubjectPrompt:
+        content = (
+            f"{data['system_prompt']}\n\nAdditional context: {context}\n\n"
+            "Always format your response with clear sections, emojis, and practical examples. "
+            "Include specific steps and encourage further learning."
+        )
+        examples = tuple(
+            ({"role": "user", "content": example["question"]},
+             {"role": "assistant", "content": example["response"]})
+            for example in data.get("examples", [])[:max(few_shot, 0)]
+        )
+        return _SubjectPrompt(
+            system={"role": "system", "content": content},
+            examples=examples,
+            system_tokens=count_tokens(content) + _TOKENS_PER_MESSAGE,
+            example_tokens=tuple(
+                count_tokens(user["content"]) + count_tokens(assistant["content"]) + 2 * _TOKENS_PER_MESSAGE
+                for user, assistant in examples
+            ),
+        )
+
+    def _context_messages(self, context, budget: int):
+        """Summary + recent turns (newest kept first) within budget tokens"""
+        turns, used = [], 0
+        for turn in reversed(context.turns):
+            cost = turn.tokens + 2 * _TOKENS_PER_MESSAGE
+            if used + cost > budget:
+                break
+            turns[:0] = ({"role": "user", "content": turn.question}, {"role": "assistant", "content": turn.answer})
+            used += cost
+        self._counters["turns_dropped"] += len(context.turns) - len(turns) // 2
+
+        summary_cost = context.summary_tokens + count_tokens(_SUMMARY_HEADER) + _TOKENS_PER_MESSAGE
+        if context.summary and used + summary_cost <= budget:
+            turns.insert(0, {"role": "system", "content": _SUMMARY_HEADER + context.summary})
+            used += summary_cost
+        return turns, used
+
+    def build(self, question: str, subject: Optional[str], context=None) -> Prompt:
+        """Messages, input token count and max_tokens for one question.
+
+        context is a conversation.ConversationContext for follow-up questions.
+        """
+        prepared = self._subjects.get(subject, self._subjects[None])
+        fixed = prepared.system_tokens + _TOKENS_PER_MESSAGE + _TOKENS_PER_REPLY
+
+        # The question itself is only trimmed if it can't fit on its own
+        question_tokens = count_tokens(question)
+        room = max(self.max_input_tokens - fixed, 32)
+        if question_tokens > room:
+            question = trim_to_tokens(question, room)
+            question_tokens = count_tokens(question)
+            self._counters["questions_trimmed"] += 1
+        remaining = self.max_input_tokens - fixed - question_tokens
+
+        history, context_tokens = [], 0
+        if context is not None:
+            history, context_tokens = self._context_messages(context, min(remaining, self.context_tokens))
+            remaining -= context_tokens
+
+        # Few-shot examples only fill what's left
+        examples, example_tokens = [], 0
+        for pair, tokens in zip(prepared.examples, prepared.example_tokens):
+            if example_tokens + tokens > remaining:
+                self._counters["examples_dropped"] += len(prepared.examples) - len(examples)
+                break
+            examples.extend(pair)
+            example_tokens += tokens
+
+        messages = [prepared.system, *examples, *history, {"role": "user", "content": question}]
+        input_tokens = fixed + example_tokens + context_tokens + question_tokens
+        max_tokens = output_token_budget(subject, question_tokens)
+        self._counters["prompts"] += 1
+        self._counters["input_tokens"] += input_tokens
+        self._counters["max_tokens"] += max_tokens
+        return Prompt(messages, input_tokens, max_tokens, context_tokens)
+
+    def record_completion(self, prompt: Prompt, latency: float, usage=None, finish_reason: Optional[str] = None):
+        """Record an upstream call: latency, token usage, and whether it hit max_tokens"""
+        mode = "contextual" if prompt.context_tokens else "stateless"
+        calls = self._calls[mode]
+        calls["calls"] += 1
+        calls["latency_ms"] += latency * 1000
+        calls["input_tokens"] += prompt.input_tokens
+        calls["context_tokens"] += prompt.context_tokens
+        if usage is not None:
+            calls["completions"] += 1
+            calls["prompt_tokens"] += usage.prompt_tokens or 0
+            calls["completion_tokens"] += usage.completion_tokens or 0
+        if finish_reason == "length":
+            self._counters["truncated"] += 1
+
+        if AI_LOG_CALLS:
+            line = (f"AI call ({mode}): {latency * 1000:.0f} ms, {prompt.input_tokens} input tokens "
+                    f"({prompt.context_tokens} context), max_tokens {prompt.max_tokens}")
+            if usage is not None:
+                line += f", upstream usage {usage.prompt_tokens} prompt / {usage.completion_tokens} completion"
+            print(line)
+
+    def stats(self) -> dict:
+        """Prompt sizes, plus latency and token usage for stateless vs contextual calls"""
+        prompts = self._counters["prompts"]
+
+        def average(counter: Counter, key: str, of: str = "calls") -> float:
+            return round(counter[key] / counter[of], 1) if counter[of] else 0.0
+
+        return {
+            "tokenizer": TOKENIZER,
+            "max_input_tokens": self.max_input_tokens,
+            "system_tokens": {str(subject): prepared.system_tokens + sum(prepared.example_tokens)
+                              for subject, prepared in self._subjects.items()},
+            "prompts": prompts,
+            "avg_input_tokens": round(self._counters["input_tokens"] / prompts, 1) if prompts else 0.0,
+            "avg_max_tokens": round(self._counters["max_tokens"] / prompts, 1) if prompts else 0.0,
+            "examples_dropped": self._counters["examples_dropped"],
+            "questions_trimmed": self._counters["questions_trimmed"],
+            "turns_dropped": self._counters["turns_dropped"],
+            "truncated": self._counters["truncated"],
+            "calls": {
+                mode: {
+                    "calls": calls["calls"],
+                    "avg_latency_ms": average(calls, "latency_ms"),
+                    "avg_input_tokens": average(calls, "input_tokens"),
+                    "avg_context_tokens": average(calls, "context_tokens"),
+                    "avg_prompt_tokens": average(calls, "prompt_tokens", of="completions"),
+                    "avg_completion_tokens": average(calls, "completion_tokens", of="completions"),
+                }
+                for mode, calls in self._calls.items()
+            },
+        }
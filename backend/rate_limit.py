@@ -0,0 +1,352 @@
+"""
+Token-bucket rate limiting in front of the API.
+
+Every /api/ request belongs to an endpoint class (chat, batch, image,
+auth, default) with its own limit, written "<requests>/<seconds>[:<burst>]":
+"20/60:10" refills 20 tokens a minute and holds at most 10, so a user can
+fire 10 questions at once and then one every 3 s. A request takes one
+token from each bucket it falls in:
+
+- the user's bucket, keyed on the verified JWT subject (the uid claim);
+- the client IP's bucket, RATE_LIMIT_IP_MULTIPLIER times the class limit
+  so a classroom behind one NAT address isn't throttled as one user
+  (auth endpoints, which have no user yet, use the class limit per IP);
+- the class's global bucket, if RATE_LIMIT_GLOBAL_<CLASS> is set.
+
+If any bucket is empty the request is rejected with 429 and Retry-After
+before routing, so it costs no DB session, credit check or upstream call.
+
+Buckets live in an LRU-bounded dict per worker. With RATE_LIMIT_REDIS_URL
+(and the optional redis package) they are shared through one Lua script
+per request, so limits hold across workers and hosts; any Redis-protocol
+server works (Redis, Valkey, KeyDB, a local redis-server in development).
+If the shared backend fails, requests fall back to the local buckets for
+a few seconds instead of failing.
+"""
+
+import json
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+from auth import decode_access_token
+from metrics import stage
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+RATE_LIMIT_IP_MULTIPLIER = float(os.getenv("RATE_LIMIT_IP_MULTIPLIER", "20"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+RATE_LIMIT_REDIS_TIMEOUT_MS = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT_MS", "50"))
+
+# Per-user (per-IP for auth) limit of each endpoint class
+_DEFAULT_LIMITS = {
+    "chat": "20/60:10",
+    "batch": "4/60:2",
+    "image": "10/60:5",
+    "auth": "30/60:30",
+    "default": "120/60:60",
+}
+
+# Paths outside /api/ (docs, /metrics, /) are not limited
+_ENDPOINT_CLASSES = {
+    "/api/chat": "chat",
+    "/api/chat/stream": "chat",
+    "/api/chat/batch": "batch",
+    "/api/chat/image": "image",
+    "/api/auth/login": "auth",
+    "/api/auth/register": "auth",
+}
+
+# How long requests use the local buckets after the shared backend fails
+_SHARED_RETRY_SECONDS = 5.0
+
+# All-or-nothing take from every bucket in KEYS; ARGV holds (rate, burst) per key.
+# Returns the 1-based index of the bucket that ran out (0 if none) and the wait.
+_TOKEN_BUCKET_LUA = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local limiting, wait = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    levels[i] = tokens
+    if tokens < 1 and (1 - tokens) / rate > wait then
+        limiting, wait = i, (1 - tokens) / rate
+    end
+end
+if limiting == 0 then
+    for i, key in ipairs(KEYS) do
+        local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+        redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'updated', tostring(now))
+        redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+    end
+end
+return {limiting, tostring(wait)}
+"""
+
+
+class Limit(NamedTuple):
+    rate: float   # tokens added per second
+    burst: float  # bucket capacity
+
+
+def parse_limit(text: str) -> Optional[Limit]:
+    """Parse "<requests>/<seconds>[:<burst>]"; empty or "0" means no limit"""
+    text = text.strip()
+    if not text or text == "0":
+        return None
+    spec, _, burst = text.partition(":")
+    requests, _, seconds = spec.partition("/")
+    requests = float(requests)
+    return Limit(requests / float(seconds or 1), float(burst) if burst else requests)
+
+
+def _scaled(limit: Limit, factor: float) -> Limit:
+    return Limit(limit.rate * factor, limit.burst * factor)
+
+
+def endpoint_class(path: str) -> Optional[str]:
+    """Rate-limit class of a request path, or None for unlimited paths"""
+    limit_class = _ENDPOINT_CLASSES.get(path)
+    if limit_class is None and path.startswith("/api/"):
+        return "default"
+    return limit_class
+
+
+def client_ip(scope) -> str:
+    """Client address of an ASGI connection (uvicorn resolves X-Forwarded-For from trusted proxies)"""
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class Bucket(NamedTuple):
+    key: str
+    limit: Limit
+    kind: str  # "user", "ip" or "global"
+
+
+class MemoryBuckets:
+    """Token buckets in this process, least recently used dropped past max_keys"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> [tokens, last update (monotonic)]; a dropped bucket simply starts full again
+        self._buckets = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, buckets: List[Bucket]) -> Tuple[int, float]:
+        """Take a token from every bucket or from none; returns (index of the empty bucket or -1, wait)"""
+        now = time.monotonic()
+        levels = []
+        limiting, wait = -1, 0.0
+        for i, bucket in enumerate(buckets):
+            state = self._buckets.get(bucket.key)
+            if state is None:
+                tokens = bucket.limit.burst
+            else:
+                tokens = min(bucket.limit.burst, state[0] + (now - state[1]) * bucket.limit.rate)
+            levels.append(tokens)
+            if tokens < 1 and (1 - tokens) / bucket.limit.rate > wait:
+                limiting, wait = i, (1 - tokens) / bucket.limit.rate
+        if limiting >= 0:
+            return limiting, wait
+
+        for bucket, tokens in zip(buckets, levels):
+            self._buckets[bucket.key] = [tokens - 1, now]
+            self._buckets.move_to_end(bucket.key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return -1, 0.0
+
+
+def _connect_shared(url: str):
+    """Lua token-bucket script on a Redis-protocol server, or None if unavailable"""
+    if not url:
+        return None
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        print("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; using per-worker buckets")
+        return None
+    timeout = RATE_LIMIT_REDIS_TIMEOUT_MS / 1000
+    client = redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+    return client.register_script(_TOKEN_BUCKET_LUA)
+
+
+class RateLimiter:
+    """Per-user, per-IP and global token buckets for each endpoint class"""
+
+    def __init__(self, limits: dict, global_limits: dict, ip_multiplier: float = RATE_LIMIT_IP_MULTIPLIER,
+                 shared_url: str = "", enabled: bool = True, key_prefix: str = "studybuddy:rl:"):
+        self.enabled = enabled
+        self.limits = limits
+        self.global_limits = global_limits
+        self.ip_multiplier = ip_multiplier
+        self.key_prefix = key_prefix
+        self.local = MemoryBuckets()
+        self._shared = _connect_shared(shared_url)
+        self._shared_down_until = 0.0
+        self._allowed = 0
+        self._limited = Counter()  # (class, bucket kind) -> rejections
+        self._shared_errors = 0
+
+    def buckets(self, limit_class: str, subject: Optional[str], ip: str) -> List[Bucket]:
+        """Buckets a request takes a token from"""
+        limit = self.limits.get(limit_class)
+        buckets = []
+        if limit is not None:
+            prefix = f"{self.key_prefix}{limit_class}:"
+            if subject is not None and limit_class != "auth":
+                buckets.append(Bucket(prefix + subject, limit, "user"))
+                buckets.append(Bucket(prefix + "ip:" + ip, _scaled(limit, self.ip_multiplier), "ip"))
+            else:
+                # Anonymous callers only have an address; auth endpoints are limited per IP by design
+                factor = 1 if limit_class == "auth" else self.ip_multiplier
+                buckets.append(Bucket(prefix + "ip:" + ip, _scaled(limit, factor), "ip"))
+        global_limit = self.global_limits.get(limit_class)
+        if global_limit is not None:
+            buckets.append(Bucket(f"{self.key_prefix}{limit_class}:global", global_limit, "global"))
+        return buckets
+
+    async def _take_shared(self, buckets: List[Bucket]) -> Optional[Tuple[int, float]]:
+        if self._shared is None or time.monotonic() < self._shared_down_until:
+            return None
+        args = []
+        for bucket in buckets:
+            args.extend((bucket.limit.rate, bucket.limit.burst))
+        try:
+            index, wait = await self._shared(keys=[bucket.key for bucket in buckets], args=args)
+        except Exception as e:
+            print(f"Rate limit backend error, using per-worker buckets for {_SHARED_RETRY_SECONDS:.0f}s: {e}")
+            self._shared_errors += 1
+            self._shared_down_until = time.monotonic() + _SHARED_RETRY_SECONDS
+            return None
+        return int(index) - 1, float(wait)
+
+    async def check(self, limit_class: str, subject: Optional[str], ip: str) -> float:
+        """Take a token for one request; returns 0 if allowed, otherwise seconds until a retry can succeed"""
+        buckets = self.buckets(limit_class, subject, ip)
+        if not buckets:
+            return 0.0
+        result = await self._take_shared(buckets)
+        if result is None:
+            result = self.local.take(buckets)
+        index, wait = result
+        if index < 0:
+            self._allowed += 1
+            return 0.0
+        self._limited[(limit_class, buckets[index].kind)] += 1
+        return wait
+
+    def stats(self) -> dict:
+        """Allowed and rejected requests, by endpoint class and the bucket that ran out"""
+        limited = {}
+        for (limit_class, kind), count in self._limited.items():
+            limited.setdefault(limit_class, {})[kind] = count
+        return {
+            "enabled": self.enabled,
+            "backend": "shared" if self._shared is not None else "memory",
+            "allowed": self._allowed,
+            "limited": limited,
+            "local_buckets": len(self.local),
+            "shared_errors": self._shared_errors,
+        }
+
+
+def _limits_from_env(prefix: str, defaults: dict) -> dict:
+    limits = {}
+    for limit_class in _DEFAULT_LIMITS:
+        limit = parse_limit(os.getenv(f"{prefix}{limit_class.upper()}", defaults.get(limit_class, "")))
+        if limit is not None:
+            limits[limit_class] = limit
+    return limits
+
+
+rate_limiter = RateLimiter(
+    _limits_from_env("RATE_LIMIT_", _DEFAULT_LIMITS),
+    # Global buckets are off unless configured: their size depends on the upstream quota
+    _limits_from_env("RATE_LIMIT_GLOBAL_", {}),
+    shared_url=RATE_LIMIT_REDIS_URL,
+    enabled=RATE_LIMIT_ENABLED,
+)
+
+_jwt_stage = stage("jwt")
+
+# Where the middleware leaves the (token, claims) it verified, for current_user to reuse
+VERIFIED_TOKEN_KEY = "verified_token"
+
+
+def token_subject(claims: dict) -> str:
+    """Rate-limit key for verified token claims"""
+    user_id = claims.get("uid")
+    return f"uid:{user_id}" if user_id is not None else f"sub:{claims['sub']}"
+
+
+def _bearer_subject(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                with _jwt_stage.time():
+                    claims = decode_access_token(token.strip())
+            except HTTPException:
+                # Keyed by IP; the endpoint rejects the token itself
+                return None
+            scope.setdefault("state", {})[VERIFIED_TOKEN_KEY] = (token.strip(), claims)
+            return token_subject(claims)
+    return None
+
+
+TOO_MANY_REQUESTS_DETAIL = "Too many requests. Please slow down and try again shortly."
+_TOO_MANY_REQUESTS_BODY = json.dumps({"detail": TOO_MANY_REQUESTS_DETAIL}).encode()
+
+
+def retry_after_seconds(wait: float) -> int:
+    """Whole seconds for a Retry-After header"""
+    return max(1, math.ceil(wait))
+
+
+class RateLimitMiddleware:
+    """ASGI middleware rejecting requests over their limit before any endpoint work"""
+
+    def __init__(self, app, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        # WebSocket messages are limited one by one in the handler; CORS preflights are free
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not self.limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+        limit_class = endpoint_class(scope["path"])
+        if limit_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        wait = await self.limiter.check(limit_class, _bearer_subject(scope), client_ip(scope))
+        if not wait:
+            await self.app(scope, receive, send)
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(_TOO_MANY_REQUESTS_BODY)).encode()),
+                (b"retry-after", str(retry_after_seconds(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": _TOO_MANY_REQUESTS_BODY})
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
+import os
 from datetime import datetime
 
 class UserCreate(BaseModel):
@@ -20,10 +21,34 @@ class UserResponse(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     subject: Optional[str] = None  # math, science, english, etc.
+    use_context: Optional[bool] = None  # send recent turns along; default: only for follow-up questions
 
 class ChatResponse(BaseModel):
     message: str
     credits_remaining: int
+    fallback: bool = False  # canned answer while the AI is unavailable (not charged)
+
+# Most questions a single batch request may contain
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "30"))
+
+class BatchChatRequest(BaseModel):
+    questions: List[ChatRequest] = Field(..., min_length=1, max_length=BATCH_MAX_QUESTIONS)
+
+class BatchChatItem(BaseModel):
+    index: int
+    question: str
+    subject: Optional[str] = None
+    message: Optional[str] = None
+    success: bool
+    fallback: bool = False
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatItem]
+    answered: int
+    failed: int
+    fallbacks: int = 0
+    credits_remaining: int
 
 class CreditResponse(BaseModel):
     credits: int
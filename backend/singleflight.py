@@ -0,0 +1,44 @@
+"""
+Request coalescing for identical in-flight calls.
+
+When many callers ask for the same key at once, only the first one (the
+leader) runs the call; the rest await the leader's result. The shared call
+runs as its own task, so a caller that disconnects never cancels the work
+the others are waiting on.
+"""
+
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Share one in-flight call between concurrent callers with the same key"""
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._counters = Counter()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """Run fn() for key, or join the call already in flight for it"""
+        self._counters["calls"] += 1
+        task = self._calls.get(key)
+        if task is None:
+            self._counters["leaders"] += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self._counters["shared"] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """Coalescing counters; shared calls are upstream calls saved"""
+        calls = self._counters["calls"]
+        return {
+            "calls": calls,
+            "upstream_calls": self._counters["leaders"],
+            "coalesced": self._counters["shared"],
+            "coalesce_ratio": round(self._counters["shared"] / calls, 4) if calls else 0.0,
+            "in_flight": len(self._calls),
+        }
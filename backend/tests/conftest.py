@@ -0,0 +1,72 @@
+"""Shared fixtures for the StudyBuddy backend tests"""
+
+import io
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# The app is configured from the environment at import time: a scratch
+# database, an upstream nothing listens on, and no caches or rate limits
+# between the tests and the code under test
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='studybuddy-tests'), 'test.db')}",
+    OPENAI_API_KEY="test-key",
+    OPENAI_BASE_URL="http://127.0.0.1:9/v1",
+    AI_MAX_RETRIES="0",
+    AI_DEADLINE_SECONDS="2",
+    AI_REQUEST_TIMEOUT="2",
+    ANSWER_CACHE_ENABLED="False",
+    ANSWER_CACHE_PATH="",
+    ANSWER_BANK_ENABLED="False",
+    KNOWLEDGE_BASE_ENABLED="False",
+    IMAGE_CACHE_ENABLED="False",
+    OCR_ENABLED="False",
+    RATE_LIMIT_ENABLED="False",
+    BCRYPT_ROUNDS="4",
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def auth(client):
+    """Authorization header of a newly registered user (5 credits)"""
+    response = client.post("/api/auth/register", json={
+        "email": f"{uuid.uuid4().hex}@example.com",
+        "full_name": "Test Student",
+        "password": "correct horse battery",
+    })
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def balance(client, auth):
+    """Reads the user's current credits"""
+    def read() -> int:
+        response = client.get("/api/credits", headers=auth)
+        assert response.status_code == 200, response.text
+        return response.json()["credits"]
+    return read
+
+
+@pytest.fixture
+def photo() -> bytes:
+    """A small PNG standing in for a homework photo"""
+    buffered = io.BytesIO()
+    Image.new("RGB", (320, 240), (240, 240, 240)).save(buffered, format="PNG")
+    return buffered.getvalue()
@@ -0,0 +1,45 @@
+"""Follow-up detection: only questions that refer back to an earlier turn get conversation context"""
+
+import pytest
+
+from conversation import is_follow_up
+
+
+@pytest.mark.parametrize("question", [
+    "explain step 3 again",
+    "Can you explain it?",
+    "Why does that work?",
+    "Why does it work for 5?",
+    "What does this mean?",
+    "I don't understand it",
+    "Is that right?",
+    "How did you get that?",
+    "What are they?",
+    "tell me more",
+    "Give me another one",
+    "Can you do it a different way?",
+    "Can you show the same steps for 12 + 9?",
+    "and what about 5?",
+    "So what is the answer?",
+])
+def test_question_referring_back_is_a_follow_up(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "What is the derivative of this function: x^2",
+    "Is it true that 2+2=4",
+    "Is it possible to divide by zero?",
+    "Why is it important to drink water?",
+    "What is a number that is divisible by 3?",
+    "Name three things that are magnetic",
+    "Solve this equation: 2x + 3 = 7",
+    "What do these words mean: noun, verb",
+    "How do they make chocolate?",
+    "What happens when it rains?",
+    "Which is more, 3/4 or 2/3?",
+    "Is 7 the same as 7.0?",
+    "What is photosynthesis?",
+])
+def test_stand_alone_question_is_not_a_follow_up(question):
+    assert not is_follow_up(question)
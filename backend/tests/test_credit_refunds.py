@@ -0,0 +1,54 @@
+"""Credits of questions the AI service couldn't answer are given back exactly once"""
+
+import ai_service
+import main
+
+QUESTION = "Why do leaves change colour in autumn?"
+
+
+def test_chat_fallback_is_refunded(client, auth, balance):
+    response = client.post("/api/chat", json={"message": QUESTION}, headers=auth)
+    assert response.status_code == 200, response.text
+    assert response.json()["fallback"] is True
+    assert response.json()["credits_remaining"] == 5
+    assert balance() == 5
+
+
+def test_chat_fallback_is_refunded_once_when_saving_fails(client, auth, balance, monkeypatch):
+    async def failing_add_message(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(main.write_behind, "add_message", failing_add_message)
+    response = client.post("/api/chat", json={"message": QUESTION}, headers=auth)
+    assert response.status_code == 500
+    assert balance() == 5
+
+
+def test_image_with_unreachable_upstream_is_refunded(client, auth, balance, photo):
+    response = client.post("/api/chat/image", files={"file": ("page.png", photo, "image/png")},
+                           data={"message": QUESTION}, headers=auth)
+    assert response.status_code == 200, response.text
+    assert response.json()["fallback"] is True
+    assert balance() == 5
+
+
+def test_image_analysis_error_is_refunded(client, auth, balance, photo, monkeypatch):
+    async def unreachable(*args, **kwargs):
+        raise ConnectionError("upstream unreachable")
+
+    # Without a fingerprint the analysis result is returned as is, not through the image cache
+    monkeypatch.setattr(ai_service, "process_homework_question", unreachable)
+    monkeypatch.setattr(ai_service, "IMAGE_CACHE_ENABLED", False)
+    response = client.post("/api/chat/image", files={"file": ("page.png", photo, "image/png")},
+                           data={"message": QUESTION}, headers=auth)
+    assert response.status_code == 200, response.text
+    assert response.json()["fallback"] is True
+    assert balance() == 5
+
+
+def test_batch_fallbacks_are_refunded(client, auth, balance):
+    response = client.post("/api/chat/batch", json={"questions": [{"message": QUESTION}, {"message": "What is a verb?"}]},
+                           headers=auth)
+    assert response.status_code == 200, response.text
+    assert response.json()["fallbacks"] == 2
+    assert balance() == 5
@@ -0,0 +1,61 @@
+"""Knowledge base index on disk: saving only ever replaces an index, and a failed open is visible"""
+
+import os
+
+import pytest
+
+import knowledge_base
+import main
+from knowledge_base import KnowledgeBase, KnowledgeDocument
+
+DOCUMENTS = [
+    KnowledgeDocument("What is photosynthesis?", "Plants turn light into sugar.", "science", "test"),
+    KnowledgeDocument("What is a noun?", "A word that names something.", "english", "test"),
+]
+
+
+def test_save_replaces_an_existing_index(tmp_path):
+    path = str(tmp_path / "index")
+    KnowledgeBase.build(DOCUMENTS[:1]).save(path)
+    opened = KnowledgeBase.open(path)
+    KnowledgeBase.build(DOCUMENTS).save(path)
+    assert KnowledgeBase.open(path).size == 2
+    # The index opened before the swap still reads its own files
+    assert opened.search("What is photosynthesis?")[0].document == DOCUMENTS[0]
+    assert sorted(os.listdir(tmp_path)) == ["index"]
+
+
+def test_save_into_an_empty_directory(tmp_path):
+    KnowledgeBase.build(DOCUMENTS).save(str(tmp_path))
+    assert KnowledgeBase.open(str(tmp_path)).size == 2
+
+
+@pytest.mark.parametrize("meta", [None, '{"format": 0}', "not json"])
+def test_save_refuses_to_replace_a_directory_that_is_not_an_index(tmp_path, meta):
+    path = tmp_path / "homework"
+    path.mkdir()
+    (path / "essay.txt").write_text("do not delete")
+    if meta is not None:
+        (path / "meta.json").write_text(meta)
+    with pytest.raises(ValueError, match="refusing to replace"):
+        KnowledgeBase.build(DOCUMENTS).save(str(path))
+    assert (path / "essay.txt").read_text() == "do not delete"
+    assert sorted(os.listdir(tmp_path)) == ["homework"]
+
+
+def test_open_failure_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(knowledge_base, "KNOWLEDGE_BASE_ENABLED", True)
+    monkeypatch.setattr(knowledge_base, "KNOWLEDGE_BASE_PATH", str(tmp_path / "missing"))
+    opened = knowledge_base.open_knowledge_base(DOCUMENTS)
+    assert opened.size >= len(DOCUMENTS)
+    assert "FileNotFoundError" in opened.stats()["open_error"]
+
+    KnowledgeBase.build(DOCUMENTS).save(str(tmp_path / "index"))
+    monkeypatch.setattr(knowledge_base, "KNOWLEDGE_BASE_PATH", str(tmp_path / "index"))
+    assert knowledge_base.open_knowledge_base(DOCUMENTS).stats()["open_error"] is None
+
+
+def test_open_failure_is_a_metric(client, monkeypatch):
+    monkeypatch.setattr(main.knowledge_base, "open_error", "FileNotFoundError: missing")
+    metrics = client.get("/metrics").text
+    assert "studybuddy_knowledge_base_open_failed 1" in metrics
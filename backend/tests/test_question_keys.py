@@ -0,0 +1,79 @@
+"""Question normalization: different questions never share a cache, bank or coalescing key"""
+
+import pytest
+
+from answer_bank import question_id
+from answer_cache import AnswerCache, cache_key, normalize_question
+from image_fingerprint import ImageAnswerCache
+from knowledge_base import signature
+
+# Pairs that read alike but ask different things
+DIFFERENT = [
+    ("Expand 2(x+3)", "Expand 2x+3"),
+    ("Simplify [2 + 3] x 4", "Simplify 2 + 3 x 4"),
+    ("Simplify {a + b}c", "Simplify a + bc"),
+    ("What is 3,5 + 1?", "What is 3 5 + 1?"),
+    ("Write 1,000 in words", "Write 1 000 in words"),
+]
+
+# Pairs that only differ in case, spacing or punctuation
+SAME = [
+    ("Expand 2(x+3)", "expand 2 ( x + 3 )"),
+    ("What is 3,5 + 1?", "what is 3,5+1"),
+    ("What is photosynthesis?", "  WHAT is photosynthesis "),
+]
+
+
+@pytest.mark.parametrize("first, second", DIFFERENT)
+def test_different_questions_get_different_keys(first, second):
+    assert normalize_question(first) != normalize_question(second)
+    # Singleflight coalesces on cache_key, the answer bank on question_id
+    assert cache_key(first, "math") != cache_key(second, "math")
+    assert question_id(first)[0] != question_id(second)[0]
+    assert signature(first) != signature(second)
+
+
+@pytest.mark.parametrize("first, second", SAME)
+def test_trivial_variations_share_a_key(first, second):
+    assert cache_key(first, "math") == cache_key(second, "math")
+    assert question_id(first) == question_id(second)
+
+
+@pytest.mark.parametrize("first, second", DIFFERENT)
+def test_answer_cache_does_not_serve_a_different_question(first, second):
+    cache = AnswerCache(persist_path=None)
+    cache.put(first, "math", "cached answer")
+    assert cache.get(second, "math") is None
+    assert cache.get(first, "math") == "cached answer"
+
+
+@pytest.mark.parametrize("first, second", [
+    ("How fast can a cheetah swim?", "How fast can a cheetah run?"),
+    ("Draw a house", "Draw a mouse"),
+    ("What is not photosynthesis?", "What is photosynthesis?"),
+    ("Convert 5 m to km", "Convert 5 km to m"),
+    ("Why did World War 2 start?", "When did World War 2 start?"),
+])
+def test_similar_tier_rejects_different_content(first, second):
+    cache = AnswerCache(persist_path=None)
+    cache.put(first, None, "cached answer")
+    assert cache.get(second, None) is None
+
+
+@pytest.mark.parametrize("first, second", [
+    ("What is photosynthesis?", "Can you explain what is photosynthesis please?"),
+    ("Explain the water cycle", "Please explain the water cycle to me"),
+    ("What is 25 + 17?", "what is 25+17 please"),
+])
+def test_similar_tier_matches_filler_variations(first, second):
+    cache = AnswerCache(persist_path=None)
+    cache.put(first, None, "cached answer")
+    assert cache.get(second, None) == "cached answer"
+
+
+def test_image_cache_keeps_bracketed_messages_apart():
+    cache = ImageAnswerCache(max_entries=8)
+    fingerprint = bytes(32)
+    cache.put(fingerprint, "expand 2(x+3)", "analysis")
+    assert cache.get(fingerprint, "expand 2x+3") is None
+    assert cache.get(fingerprint, "Expand 2(x+3)") == "analysis"
@@ -0,0 +1,100 @@
+"""Write-behind queue: failing rows are dead-lettered and the queue stays bounded"""
+
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import func, select
+
+import main
+from database import AsyncSessionLocal, init_db
+from models import ChatMessage
+from write_behind import WriteBehindQueue
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    init_db()
+
+
+async def message_count(user_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(ChatMessage).where(ChatMessage.user_id == user_id))
+
+
+def test_bad_row_is_dead_lettered_after_retries(tmp_path):
+    dead_letters = tmp_path / "dead.jsonl"
+
+    async def scenario():
+        queue = WriteBehindQueue(enabled=False, max_retries=2, dead_letter_path=str(dead_letters))
+        # Queue a row that violates NOT NULL between good ones, as a background flusher would see them
+        queue._messages += [
+            {"user_id": 9001, "user_message": "good 1", "ai_response": "a", "subject": None, "has_image": False},
+            {"user_id": 9001, "user_message": None, "ai_response": "a", "subject": None, "has_image": False},
+        ]
+        queue._pending_users[9001] += 2
+        with pytest.raises(Exception):
+            await queue.flush()
+        assert queue.pending == 2
+        # The second failure writes the rows one at a time and dead-letters the bad one
+        await queue.flush()
+        assert queue.pending == 0
+        assert not queue.has_pending(9001)
+        return queue.stats(), await message_count(9001)
+
+    stats, written = asyncio.run(scenario())
+    assert written == 1
+    assert stats["dead_lettered"] == 1
+    letters = [json.loads(line) for line in dead_letters.read_text().splitlines()]
+    assert [letter["table"] for letter in letters] == ["chat_messages"]
+    assert letters[0]["row"]["user_id"] == 9001
+
+
+def test_queue_is_bounded(tmp_path):
+    async def scenario():
+        # A flusher that never wakes up on its own: only backpressure writes the queue
+        queue = WriteBehindQueue(flush_ms=3_600_000, max_batch=5, max_pending=10)
+        queue.start()
+        high_water = 0
+        for number in range(35):
+            await queue.add_message(9002, f"question {number}", "answer")
+            high_water = max(high_water, queue.pending)
+        await queue.stop()
+        return high_water, queue.stats(), await message_count(9002)
+
+    high_water, stats, written = asyncio.run(scenario())
+    assert high_water <= 10
+    assert stats["backpressure_flushes"] > 0
+    assert written == 35
+
+
+def test_written_through_messages_commit_together():
+    async def scenario():
+        queue = WriteBehindQueue(enabled=False)
+        with pytest.raises(Exception):
+            await queue.add_messages(9003, [("good", "a", None), (None, "a", None), ("good too", "a", None)])
+        assert queue.pending == 0
+        await queue.add_messages(9003, [("first", "a", "math"), ("second", "b", "math")])
+        return queue.stats(), await message_count(9003)
+
+    stats, written = asyncio.run(scenario())
+    assert written == 2
+    assert stats["flushes"] == 1
+
+
+def test_batch_save_failure_saves_nothing_and_refunds(client, auth, balance, monkeypatch):
+    queue = WriteBehindQueue(enabled=False)
+    monkeypatch.setattr(main, "write_behind", queue)
+
+    async def failing_insert(messages, credits):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(queue, "_insert", failing_insert)
+    response = client.post("/api/chat/batch", json={"questions": [{"message": "What is 2 + 2?"}, {"message": "What is 3 + 5?"}]},
+                           headers=auth)
+    assert response.status_code == 500
+    assert balance() == 5
+    monkeypatch.undo()
+    history = client.get("/api/chat/history", headers=auth)
+    assert history.status_code == 200
+    assert history.json() == []
@@ -0,0 +1,80 @@
+"""
+Short-lived in-process cache of user records.
+
+Authenticated endpoints resolve the token's user id through this cache so
+read-only requests don't need a database round trip. Records expire after
+USER_CACHE_TTL_SECONDS and are updated whenever this process changes a
+user's credits; other workers see the change once their entry expires.
+Cached balances are only used for display and cheap early rejection - the
+credit ledger enforces the real balance in the database.
+"""
+
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+
+class CachedUser(NamedTuple):
+    id: int
+    email: str
+    full_name: str
+    credits: int
+    is_active: bool
+
+
+class UserCache:
+    """TTL'd map of user id -> CachedUser"""
+
+    def __init__(self, ttl_seconds: float = USER_CACHE_TTL_SECONDS, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: dict = {}
+        # Sync scripts and threadpool code share it too, so guard the evict-and-insert step
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        """Return the cached record, or None if missing or expired"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if expires_at <= time.monotonic():
+            self.invalidate(user_id)
+            return None
+        return record
+
+    def store(self, user) -> CachedUser:
+        """Cache a User row (or CachedUser) and return the cached record"""
+        record = CachedUser(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            credits=user.credits,
+            is_active=user.is_active if user.is_active is not None else True,
+        )
+        with self._lock:
+            self._entries.pop(record.id, None)
+            while len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[record.id] = (time.monotonic() + self.ttl_seconds, record)
+        return record
+
+    def update_credits(self, user_id: int, credits: int):
+        """Write a new balance through to the cached record, if there is one"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires_at, record = entry
+                self._entries[user_id] = (expires_at, record._replace(credits=credits))
+
+    def invalidate(self, user_id: int):
+        """Drop a user's record so the next request reloads it"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache()
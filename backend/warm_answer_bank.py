@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Warm the answer bank (see answer_bank.py) from curriculum question lists.
+
+Each input is CSV with a "question" column (and optionally "subject"), or
+JSONL with {"question", "subject"} per line. Every question not yet in the
+bank is answered through process_homework_question, --concurrency at a
+time. Answers are committed every --checkpoint answers and when the job
+stops (Ctrl+C or SIGTERM stop it cleanly), so a rerun carries on where the
+last one stopped. Fallback answers are not banked; those questions are
+tried again next run.
+
+Progress, throughput and token spend are printed every --progress seconds;
+the bank keeps the total spend across runs.
+
+    python warm_answer_bank.py curriculum/grade4.csv curriculum/grade5.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import signal
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from answer_bank import ANSWER_BANK_PATH, AnswerBankWriter, question_id  # noqa: E402
+from ai_service import model_router, process_homework_question  # noqa: E402
+
+
+def read_questions(path: str):
+    """(question, subject) pairs of a CSV or JSONL file"""
+    with open(path, encoding="utf-8", newline="") as source:
+        if path.endswith((".jsonl", ".json")):
+            for number, line in enumerate(source, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                        yield record["question"], record.get("subject") or None
+                    except (ValueError, KeyError) as e:
+                        raise ValueError(f"{path}:{number}: invalid question record ({e})")
+        else:
+            reader = csv.DictReader(source)
+            if "question" not in (reader.fieldnames or []):
+                raise ValueError(f"{path}: no 'question' column")
+            for row in reader:
+                if row["question"] and row["question"].strip():
+                    yield row["question"].strip(), (row.get("subject") or "").strip() or None
+
+
+def spend() -> dict:
+    """Tokens and estimated cost of every upstream call so far, from the model router"""
+    routes = model_router.stats()["routes"].values()
+    return {
+        "prompt_tokens": sum(route["prompt_tokens"] for route in routes),
+        "completion_tokens": sum(route["completion_tokens"] for route in routes),
+        "cost_usd": sum(route["cost_usd"] for route in routes),
+    }
+
+
+def duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+async def warm(pending: list, writer: AnswerBankWriter, args) -> dict:
+    counts = {"answered": 0, "failed": 0}
+    checkpointed = {"answers": 0, **spend()}
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    def checkpoint():
+        """Commit banked answers together with the spend since the last checkpoint"""
+        now = {"answers": counts["answered"], **spend()}
+        writer.add_totals(**{name: now[name] - checkpointed[name] for name in now})
+        writer.commit()
+        checkpointed.update(now)
+
+    queue = iter(pending)
+    started = time.perf_counter()
+
+    async def worker():
+        for question, subject in queue:
+            if stop.is_set():
+                return
+            answer = await process_homework_question(question, subject)
+            if answer.fallback:
+                counts["failed"] += 1
+                continue
+            writer.add(question, subject, answer.text)
+            counts["answered"] += 1
+            if counts["answered"] - checkpointed["answers"] >= args.checkpoint:
+                checkpoint()
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.progress)
+            done = counts["answered"] + counts["failed"]
+            elapsed = time.perf_counter() - started
+            rate = done / elapsed if elapsed else 0.0
+            used = spend()
+            eta = duration((len(pending) - done) / rate) if rate else "?"
+            print(f"[{done}/{len(pending)}] {done / len(pending):.0%}  {rate:.1f} questions/s  "
+                  f"tokens {used['prompt_tokens']:,} in / {used['completion_tokens']:,} out  "
+                  f"${used['cost_usd']:.4f}  failed {counts['failed']}  ETA {eta}", flush=True)
+
+    reporter = asyncio.create_task(report())
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        reporter.cancel()
+        checkpoint()
+    counts["seconds"] = time.perf_counter() - started
+    counts["stopped"] = stop.is_set()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="CSV or JSONL question lists")
+    parser.add_argument("--bank", default=ANSWER_BANK_PATH, help="answer bank file (ANSWER_BANK_PATH)")
+    parser.add_argument("--concurrency", type=int, default=8, help="questions answered at once")
+    parser.add_argument("--checkpoint", type=int, default=25, help="answers per commit")
+    parser.add_argument("--progress", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--limit", type=int, default=0, help="answer at most this many questions this run")
+    args = parser.parse_args()
+
+    writer = AnswerBankWriter(args.bank)
+    banked = writer.ids()
+    pending, seen = [], set()
+    try:
+        for path in args.inputs:
+            for question, subject in read_questions(path):
+                key, _ = question_id(question)
+                if key not in banked and key not in seen:
+                    seen.add(key)
+                    pending.append((question, subject))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    if args.limit:
+        pending = pending[:args.limit]
+    print(f"{len(banked)} questions already banked, {len(pending)} to answer with concurrency {args.concurrency}")
+    if not pending:
+        return 0
+
+    counts = asyncio.run(warm(pending, writer, args))
+    used, totals = spend(), writer.totals()
+    writer.close()
+    print(f"\n{'Stopped' if counts['stopped'] else 'Done'}: {counts['answered']} answered, {counts['failed']} failed"
+          f"{' (tried again next run)' if counts['failed'] else ''} in {duration(counts['seconds'])}, "
+          f"{(counts['answered'] + counts['failed']) / counts['seconds']:.1f} questions/s")
+    print(f"This run: {used['prompt_tokens']:,} prompt + {used['completion_tokens']:,} completion tokens, ${used['cost_usd']:.4f}")
+    print(f"Bank {args.bank}: {int(totals.get('answers', 0))} answers warmed in total, "
+          f"{int(totals.get('prompt_tokens', 0) + totals.get('completion_tokens', 0)):,} tokens, ${totals.get('cost_usd', 0.0):.4f}")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
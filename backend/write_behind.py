@@ -0,0 +1,268 @@
+"""
+Write-behind persistence for chat messages and credit ledger rows.
+
+Append-only rows (ChatMessage and Credit) are queued in memory and written
+by a background task in bulk INSERTs, one transaction per batch, instead
+of one commit per request. A flush happens every WRITE_BEHIND_FLUSH_MS or as
+soon as WRITE_BEHIND_MAX_BATCH rows are waiting, and the queue is drained
+on shutdown (see the lifespan handler in main.py). Without the background
+task (disabled, or in a script) each call writes its rows through in one
+transaction.
+
+Only the log rows are deferred. Credit balances are still changed by the
+ledger's conditional UPDATE, committed before the request continues, so
+balance checks stay strongly consistent.
+
+A batch that fails is put back and retried with the next flush. After
+WRITE_BEHIND_MAX_RETRIES failures in a row its rows are written one at a
+time, and any row that still fails on its own (a constraint violation, say)
+is appended to the dead-letter file WRITE_BEHIND_DEAD_LETTER_PATH instead
+of blocking every later flush. At WRITE_BEHIND_MAX_PENDING queued rows the
+request adding one writes the queue itself before continuing.
+"""
+
+import asyncio
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal, write_lock
+from models import ChatMessage, Credit
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "True").lower() == "true"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "50"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "20000"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))
+WRITE_BEHIND_DEAD_LETTER_PATH = os.getenv("WRITE_BEHIND_DEAD_LETTER_PATH", "write_behind_dead_letter.jsonl")
+
+
+class WriteBehindQueue:
+    """Buffers ChatMessage / Credit inserts and writes them in batches"""
+
+    def __init__(self, enabled: bool = WRITE_BEHIND_ENABLED, flush_ms: int = WRITE_BEHIND_FLUSH_MS,
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH, max_pending: int = WRITE_BEHIND_MAX_PENDING,
+                 max_retries: int = WRITE_BEHIND_MAX_RETRIES, dead_letter_path: str = WRITE_BEHIND_DEAD_LETTER_PATH):
+        self.enabled = enabled
+        self.flush_interval = flush_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max(max_pending, max_batch)
+        self.max_retries = max(1, max_retries)
+        self.dead_letter_path = dead_letter_path
+        # Failed attempts at the batch at the front of the queue
+        self._failures = 0
+
+        self._messages: list = []
+        self._credits: list = []
+        self._pending_users = Counter()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._counters = Counter()
+
+    # Enqueue
+
+    async def add_message(self, user_id: int, user_message: str, ai_response: str,
+                          subject: Optional[str] = None, has_image: bool = False):
+        """Queue a chat message (timestamped now, not at flush time)"""
+        await self.add_messages(user_id, [(user_message, ai_response, subject)], has_image)
+
+    async def add_messages(self, user_id: int, messages: List[Tuple[str, str, Optional[str]]], has_image: bool = False):
+        """Queue (user_message, ai_response, subject) chat messages together; written through, they
+        commit in one transaction or not at all"""
+        now = datetime.utcnow()
+        await self._add("messages", user_id, [{
+            "user_id": user_id,
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "subject": subject,
+            "has_image": has_image,
+            "created_at": now,
+        } for user_message, ai_response, subject in messages])
+
+    async def add_credit(self, user_id: int, amount: int, transaction_type: str, description: Optional[str] = None):
+        """Queue a credit ledger row"""
+        await self._add("credits", user_id, [{
+            "user_id": user_id,
+            "amount": amount,
+            "transaction_type": transaction_type,
+            "description": description,
+            "created_at": datetime.utcnow(),
+        }])
+
+    async def _add(self, table: str, user_id: int, rows: list):
+        self._counters["enqueued"] += len(rows)
+        if not self.active:
+            # No background flusher (disabled, or a script): write through in one transaction; if it
+            # fails the caller gets the error and nothing is kept for a retry
+            messages, credits = (rows, []) if table == "messages" else ([], rows)
+            await self._insert(messages, credits)
+            self._written(len(rows))
+            return
+
+        if self.pending >= self.max_pending:
+            # Backpressure: the flusher is behind (or the database failing), so this request writes
+            # the queue before adding to it; if that fails, the request fails instead of the queue growing
+            self._counters["backpressure_flushes"] += 1
+            await self.flush()
+        # No await from here on: a flush swaps self._messages / self._credits for new lists
+        (self._messages if table == "messages" else self._credits).extend(rows)
+        self._pending_users[user_id] += len(rows)
+        if self.pending >= self.max_batch:
+            self._wakeup.set()
+
+    # Flushing
+
+    @property
+    def active(self) -> bool:
+        """Whether rows are being deferred to the background flusher"""
+        return self._task is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._messages) + len(self._credits)
+
+    def has_pending(self, user_id: int) -> bool:
+        """Whether rows for this user are still waiting to be written"""
+        return self._pending_users[user_id] > 0
+
+    async def flush(self):
+        """Write everything queued so far, in transactions of up to max_batch rows"""
+        if self._flush_lock is None:
+            await self._write_pending()
+            return
+        # Serialized so a caller that flushes to read its own rows also waits
+        # for a batch the background task is already writing
+        async with self._flush_lock:
+            await self._write_pending()
+
+    async def _write_pending(self):
+        while self.pending:
+            messages, self._messages = self._messages[:self.max_batch], self._messages[self.max_batch:]
+            room = self.max_batch - len(messages)
+            credits, self._credits = self._credits[:room], self._credits[room:]
+            # Shielded: once rows leave the queue, a cancelled caller (say, a
+            # disconnected client waiting on its history) must not drop them
+            await asyncio.shield(self._write_batch(messages, credits))
+
+    async def _insert(self, messages: list, credits: list):
+        async with AsyncSessionLocal() as db:
+            async with write_lock():
+                if messages:
+                    await db.execute(insert(ChatMessage), messages)
+                if credits:
+                    await db.execute(insert(Credit), credits)
+                await db.commit()
+
+    async def _write_batch(self, messages: list, credits: list):
+        try:
+            await self._insert(messages, credits)
+        except Exception as e:
+            self._counters["failed_flushes"] += 1
+            self._failures += 1
+            if self._failures < self.max_retries:
+                # Put the rows back in order; the next flush retries them
+                self._messages[:0] = messages
+                self._credits[:0] = credits
+                raise
+            print(f"Write-behind batch failed {self._failures} times ({e}), writing its rows one at a time")
+            self._failures = 0
+            await self._write_rows(messages, credits)
+            return
+
+        self._failures = 0
+        self._done(messages + credits)
+        self._written(len(messages) + len(credits))
+
+    async def _write_rows(self, messages: list, credits: list):
+        """Write a failing batch row by row; rows that fail alone go to the dead-letter file"""
+        for row in messages:
+            await self._write_row("chat_messages", row, [row], [])
+        for row in credits:
+            await self._write_row("credits", row, [], [row])
+
+    async def _write_row(self, table: str, row: dict, messages: list, credits: list):
+        try:
+            await self._insert(messages, credits)
+            self._counters["rows_written"] += 1
+        except Exception as e:
+            self._dead_letter(table, row, e)
+        self._done([row])
+
+    def _dead_letter(self, table: str, row: dict, error: Exception):
+        self._counters["dead_lettered"] += 1
+        print(f"Write-behind dead letter: {table} row for user {row['user_id']} ({error})")
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as log:
+                log.write(json.dumps({"table": table, "row": row, "error": str(error),
+                                      "failed_at": datetime.utcnow().isoformat()}, default=str) + "\n")
+        except OSError as e:
+            print(f"Write-behind dead letter error: could not write {self.dead_letter_path} ({e}): {row}")
+
+    def _written(self, count: int):
+        self._counters["flushes"] += 1
+        self._counters["rows_written"] += count
+        self._counters["largest_batch"] = max(self._counters["largest_batch"], count)
+
+    def _done(self, rows: list):
+        for row in rows:
+            self._pending_users[row["user_id"]] -= 1
+            if not self._pending_users[row["user_id"]]:
+                del self._pending_users[row["user_id"]]
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Write-behind flush error ({self.pending} rows kept for retry): {e}")
+
+    # Lifecycle
+
+    def start(self):
+        """Start the background flusher (call from the running event loop)"""
+        if self.enabled and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write everything still queued"""
+        if self._task is not None:
+            # Let the flusher finish its current batch rather than cancelling it mid-commit
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+        self._flush_lock = None
+
+    def stats(self) -> dict:
+        """Queue depth and flush counters"""
+        return {
+            "enabled": self.enabled,
+            "pending": self.pending,
+            "enqueued": self._counters["enqueued"],
+            "rows_written": self._counters["rows_written"],
+            "flushes": self._counters["flushes"],
+            "largest_batch": self._counters["largest_batch"],
+            "failed_flushes": self._counters["failed_flushes"],
+            "dead_lettered": self._counters["dead_lettered"],
+            "backpressure_flushes": self._counters["backpressure_flushes"],
+            "rows_per_flush": round(self._counters["rows_written"] / self._counters["flushes"], 2)
+            if self._counters["flushes"] else 0.0,
+        }
+
+
+write_behind = WriteBehindQueue()